@@ -0,0 +1,727 @@
+# -*- coding: utf-8 -*-
+import os
+import base64
+import asyncio
+import weakref
+import httpx
+import init
+from pathlib import Path
+from functools import wraps
+from app.utils.alioss import upload_file_to_oss
+from app.utils.path_cache import PathCache
+from app.utils.single_flight import AsyncSingleFlight
+from app.utils.file_hash import file_sha1_by_range_async
+from app.core.open_115 import get_parent_paths, format_offline_task, DEFAULT_POOL_SIZE, \
+    DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_MAX_RETRIES, NO_NEGATIVE_CACHE_CODES
+
+
+def handle_token_expiry_async(func):
+    """装饰器：协程版本的token过期处理，逻辑与 open_115.handle_token_expiry 一致"""
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        max_retries = 2  # 最大重试次数
+        for attempt in range(max_retries):
+            try:
+                response = await func(self, *args, **kwargs)
+
+                if isinstance(response, dict) and 'code' in response:
+                    if response['code'] == 40140125:
+                        # token需要刷新
+                        if attempt < max_retries - 1:
+                            init.logger.info("Token需要刷新，正在重试...")
+                            await self.refresh_access_token()
+                            continue
+                        else:
+                            init.logger.warn("Token刷新后仍然失败")
+                            return response
+                    elif response['code'] in [40140116, 40140119]:
+                        init.logger.warn("Access token 已过期，请重新授权！")
+                        return response
+                    elif response['code'] == 40140118:
+                        init.logger.warn("开发者认证已过期，请到115开放平台重新授权！")
+                        return response
+                    elif response['code'] == 40140110:
+                        init.logger.warn("应用已过期，请到115开放平台重新授权！")
+                        return response
+                    elif response['code'] == 40140109:
+                        init.logger.warn("应用被停用，请到115开放平台查询详细信息！")
+                        return response
+                    elif response['code'] == 40140108:
+                        init.logger.warn("应用审核未通过，请稍后再试！")
+                        return response
+
+                return response
+
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    init.logger.warn(f"API调用失败，正在重试: {e}")
+                    continue
+                else:
+                    init.logger.warn(f"API调用最终失败: {e}")
+                    raise
+
+        return response
+    return wrapper
+
+
+class AsyncOpenAPI_115:
+    """
+    OpenAPI_115 的协程版本，方法签名与同步版本保持一致
+
+    与同步客户端共享token、限流令牌桶、风控计数和路径缓存，
+    因此同步线程和协程同时使用时不会超出115的请求配额。
+    """
+
+    def __init__(self, client):
+        # 同步客户端，持有token、限流器和缓存等共享状态
+        self._client = client
+        self.base_url = client.base_url
+        # httpx连接池与事件循环绑定，每个事件循环各自维护一个
+        self._http_clients = weakref.WeakKeyDictionary()
+        self._token_lock = None
+        # 合并同一事件循环内并发的相同只读请求，同步客户端的写操作之后同样丢弃进行中的请求
+        self.single_flight = AsyncSingleFlight()
+        client.single_flights.append(self.single_flight)
+
+    def _get_http_client(self):
+        loop = asyncio.get_running_loop()
+        http_client = self._http_clients.get(loop)
+        if http_client is None or http_client.is_closed:
+            http_config = init.bot_config.get('115_http') or {}
+            pool_size = int(http_config.get('pool_size', DEFAULT_POOL_SIZE))
+            connect_timeout = float(http_config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT))
+            read_timeout = float(http_config.get('read_timeout', DEFAULT_READ_TIMEOUT))
+            max_retries = int(http_config.get('max_retries', DEFAULT_MAX_RETRIES))
+            http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                # 指定transport时AsyncClient的limits不生效，连接池大小需要设置在transport上
+                # 仅对建立连接失败进行重试
+                transport=httpx.AsyncHTTPTransport(
+                    retries=max_retries,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                )
+            )
+            self._http_clients[loop] = http_client
+        return http_client
+
+    async def close(self):
+        """关闭当前事件循环的连接池"""
+        loop = asyncio.get_running_loop()
+        http_client = self._http_clients.pop(loop, None)
+        if http_client is not None:
+            await http_client.aclose()
+
+    @property
+    def path_cache(self):
+        return self._client.path_cache
+
+    def _forget_file_reads(self):
+        """文件写操作之后调用，与同步客户端共用，两个客户端进行中的请求一并丢弃"""
+        self._client._forget_file_reads()
+
+    def _forget_offline_reads(self):
+        """离线任务添加、删除之后调用，与同步客户端共用，离线任务索引的刷新同样重新发起"""
+        self._client._forget_offline_reads()
+
+    async def refresh_access_token(self):
+        """刷新token，复用同步客户端的刷新逻辑（包括从token文件加载最新token）"""
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            await asyncio.to_thread(self._client.refresh_access_token)
+
+    async def _make_api_request(self, method: str, url: str, params=None, data=None, headers=None):
+        """统一的API请求方法"""
+        # 1. 检查风控计数
+        with self._client.lock:
+            if self._client.check_risk():
+                return {"code": -1, "message": "今日请求即将到达上限！请明日再试！"}
+
+        # 2. 令牌桶流控，与同步客户端共享配额
+        limiter = self._client.rate_limiter
+        endpoint = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        await limiter.acquire_async(limiter.get_weight(endpoint))
+
+        if headers is None:
+            headers = self._client._get_headers()
+
+        http_client = self._get_http_client()
+        if method.upper() == 'GET':
+            response = await http_client.get(url, headers=headers, params=params)
+        elif method.upper() == 'POST':
+            response = await http_client.post(url, headers=headers, data=data)
+        else:
+            raise ValueError(f"不支持的HTTP方法: {method}")
+        if response.status_code == 200:
+            return response.json()
+        else:
+            init.logger.warn(f"API请求失败: {response.status_code} - {response.text}")
+            return {"code": response.status_code, "message": response.text}
+
+    @handle_token_expiry_async
+    async def get_file_info(self, path: str):
+        # 优先从缓存获取
+        found, data = self.path_cache.get(path)
+        if found:
+            init.logger.debug(f"Cache hit for {path}")
+            return data
+
+        url = f"{self.base_url}/open/folder/get_info"
+        params = {"path": path}
+        # 查询期间发生写操作时不写入缓存
+        generation = self.path_cache.generation
+        response = await self.single_flight.do(("get_file_info", PathCache.normalize(path)),
+                                               self._make_api_request, 'GET', url, params=params)
+
+        if isinstance(response, dict) and response.get('code') == 0:
+            init.logger.debug(f"获取文件信息成功: {response}")
+            self.path_cache.set(path, response['data'], generation=generation)
+            return response['data']
+        else:
+            init.logger.warn(f"获取文件信息失败: {response}")
+            if response['code'] == 40140125:
+                return response
+            if isinstance(response, dict) and response.get('code', 0) not in NO_NEGATIVE_CACHE_CODES \
+                    and response.get('code', 0) >= 1000:
+                self.path_cache.set_missing(path, generation=generation)
+            return None
+
+    @handle_token_expiry_async
+    async def get_file_info_by_id(self, file_id: str):
+        url = f"{self.base_url}/open/folder/get_info"
+        params = {"file_id": file_id}
+        response = await self._make_api_request('GET', url, params=params)
+
+        if isinstance(response, dict) and response.get('code') == 0:
+            init.logger.debug(f"获取文件信息成功: {response}")
+            return response['data']
+        else:
+            init.logger.warn(f"获取文件信息失败: {response}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def offline_download(self, download_url):
+        url = f"{self.base_url}/open/offline/add_task_urls"
+        file_info = await self.get_file_info(init.bot_config['offline_path'])
+        if not file_info:
+            init.logger.warn(f"获取离线下载目录信息失败: {file_info}")
+            return False
+
+        data = {
+            "urls": download_url,
+            "wp_path_id": file_info['file_id']
+        }
+        response = await self._make_api_request('POST', url, data=data)
+        if response['state'] == True:
+            init.logger.info(f"离线下载任务添加成功: {response['message']}")
+            self._forget_offline_reads()
+            return True
+        else:
+            init.logger.warn(f"离线下载任务添加失败: {response['message']}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def offline_download_specify_path(self, download_url, save_path):
+        save_path = os.path.normpath(save_path)
+        url = f"{self.base_url}/open/offline/add_task_urls"
+        file_info = await self.get_file_info(save_path)
+
+        if not file_info:
+            created_info = await self.create_dir_recursive(save_path)
+            if created_info:
+                file_info = created_info
+
+            # 创建目录可能存在延迟，重试获取目录信息
+            if not file_info:
+                for _ in range(3):
+                    self.path_cache.invalidate(save_path)
+                    file_info = await self.get_file_info(save_path)
+                    if file_info:
+                        break
+                    await asyncio.sleep(2)
+
+        data = {
+            "urls": download_url,
+            "wp_path_id": file_info['file_id']
+        }
+        response = await self._make_api_request('POST', url, data=data)
+        if response['state'] == True:
+            init.logger.info(f"离线下载任务添加成功: {response}")
+            self._forget_offline_reads()
+            return True
+        else:
+            if response['code'] == 40140125:
+                return response
+            init.logger.warn(f"离线下载任务添加失败: {response['message']}")
+            raise Exception(response['message'])
+
+    async def get_offline_tasks_by_page(self, page=1):
+        url = f"{self.base_url}/open/offline/get_task_list"
+        params = {"page": page}
+        response = await self.single_flight.do(("get_offline_tasks_by_page", page),
+                                               self._make_api_request, 'GET', url, params=params)
+        if isinstance(response, dict) and response.get('code') == 0 and 'data' in response:
+            return response['data']
+        else:
+            init.logger.warn(f"获取离线下载任务列表失败: {response}")
+            if isinstance(response, dict) and response.get('code') == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def get_offline_tasks(self):
+        task_list = await self.single_flight.do("get_offline_tasks", self._get_offline_tasks)
+        if isinstance(task_list, list):
+            return list(task_list)
+        return task_list
+
+    async def _get_offline_tasks(self):
+        url = f"{self.base_url}/open/offline/get_task_list"
+        response = await self._make_api_request('GET', url)
+        task_list = []
+        if isinstance(response, dict) and response.get('code') == 0 and 'data' in response:
+            page_count = response['data'].get('page_count', 1)
+            for i in range(1, page_count + 1):
+                tasks = await self.get_offline_tasks_by_page(i)
+                if tasks and 'tasks' in tasks:
+                    for task in tasks['tasks']:
+                        task_list.append(format_offline_task(task))
+            return task_list
+        else:
+            init.logger.warn(f"获取离线下载任务列表失败: {response}")
+            if isinstance(response, dict) and response.get('code') == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def del_offline_task(self, info_hash, del_source_file=1):
+        url = f"{self.base_url}/open/offline/del_task"
+        data = {
+            "info_hash": info_hash,
+            "del_source_file": del_source_file
+        }
+        response = await self._make_api_request('POST', url, data=data)
+        if response['state'] == True:
+            self._forget_offline_reads()
+            if del_source_file == 1:
+                init.logger.info(f"清理失败的离线下载任务成功!")
+            else:
+                init.logger.info(f"清理已完成的云端任务成功!")
+            return True
+        else:
+            init.logger.warn(f"清理离线下载任务失败: {response['message']}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def copy_file(self, source_path, target_path, nodupli=1):
+        """复制文件或目录"""
+        src_file_info = await self.get_file_info(source_path)
+        if not src_file_info:
+            init.logger.warn(f"获取源文件信息失败: {src_file_info}")
+            return False
+
+        dst_file_info = await self.get_file_info(target_path)
+        if not dst_file_info:
+            init.logger.warn(f"获取目标文件信息失败: {dst_file_info}")
+            return False
+
+        url = f"{self.base_url}/open/ufile/copy"
+        data = {
+            "pid": dst_file_info['file_id'],
+            "file_id": src_file_info['file_id'],
+            "nodupli": nodupli
+        }
+        response = await self._make_api_request('POST', url, data=data)
+        if response['state'] == True:
+            init.logger.info(f"文件复制成功: [{source_path}] -> [{target_path}]")
+            self._forget_file_reads()
+            return True
+        else:
+            init.logger.warn(f"文件复制失败: {response['message']}")
+            if response['code'] == 40140125:
+                return response
+        return None
+
+    @handle_token_expiry_async
+    async def rename(self, old_name, new_name):
+        """重命名文件或目录"""
+        file_info = await self.get_file_info(old_name)
+        if not file_info:
+            init.logger.warn(f"获取文件信息失败: {file_info}")
+            return False
+
+        url = f"{self.base_url}/open/ufile/update"
+        data = {
+            "file_id": file_info['file_id'],
+            "file_name": new_name
+        }
+        response = await self._make_api_request('POST', url, data=data)
+        if response['state'] == True:
+            init.logger.info(f"文件重命名成功: [{old_name}] -> [{new_name}]")
+            # 清除旧名称和新名称的缓存，避免脏读
+            self.path_cache.invalidate_prefix(old_name)
+            self.path_cache.invalidate_prefix(f"{Path(old_name).parent}/{new_name}")
+            self._forget_file_reads()
+            return True
+        else:
+            init.logger.warn(f"文件重命名失败: {response['message']}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def get_file_list(self, params):
+        """获取指定目录下的所有文件"""
+        url = f"{self.base_url}/open/ufile/files"
+        response = await self.single_flight.do(("get_file_list", tuple(sorted(params.items()))),
+                                               self._make_api_request, 'GET', url, params=params)
+
+        if isinstance(response, dict) and response.get('code') == 0:
+            init.logger.debug(f"获取文件列表成功: {response}")
+            return response['data']
+        else:
+            init.logger.warn(f"获取文件列表失败: {response}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def create_directory(self, pid, file_name):
+        """创建目录"""
+        url = f"{self.base_url}/open/folder/add"
+        data = {
+            "pid": pid,
+            "file_name": file_name,
+        }
+        response = await self._make_api_request('POST', url, data=data)
+
+        if isinstance(response, dict) and (response.get('state') == True or response.get('code') == 0):
+            init.logger.info(f"目录创建成功: {file_name}")
+            self._forget_file_reads()
+            return response.get('data') or True
+        elif response.get('code') == 20004:
+            init.logger.info(f"目录已存在: {file_name}")
+            return True
+        else:
+            init.logger.warn(f"目录创建失败: {response}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def delete_single_file(self, path):
+        """删除单个文件"""
+        file_info = await self.get_file_info(path)
+        if not file_info:
+            return None
+        url = f"{self.base_url}/open/ufile/delete"
+        data = {
+            "file_ids": file_info['file_id']
+        }
+        response = await self._make_api_request('POST', url, data=data)
+        if response['state'] == True:
+            init.logger.info(f"文件(夹)删除成功: {path}")
+            self.path_cache.invalidate_prefix(path)
+            self._forget_file_reads()
+            return True
+        else:
+            init.logger.warn(f"文件(夹)删除失败: {response['message']}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    async def move_file(self, source_path, target_path):
+        """移动文件或目录"""
+        copy_result = await self.copy_file(source_path, target_path)
+        if copy_result != True:
+            init.logger.warn(f"移动文件失败: 复制文件失败")
+            return False
+        # 清除目标位置可能存在的旧缓存
+        self.path_cache.invalidate_prefix(f"{target_path.rstrip('/')}/{os.path.basename(source_path.rstrip('/'))}")
+
+        delete_result = await self.delete_single_file(source_path)
+        if delete_result == True:
+            return True
+        init.logger.warn(f"移动文件失败: 删除源文件失败")
+        return False
+
+    @handle_token_expiry_async
+    async def upload_file(self, **kwargs):
+        """
+        上传文件
+        :param sign_val_provider: 可选，async (start, end) -> sha1，没有本地文件时用于计算二次认证的区间SHA1
+        :param oss_uploader: 可选，async (**oss参数) -> bool，秒传失败时代替从file_path上传到OSS
+        """
+        file_info = await self.get_file_info(kwargs.get('target'))
+        if not file_info:
+            init.logger.warn(f"获取目标目录信息失败: {file_info}")
+            return False, False
+        url = f"{self.base_url}/open/upload/init"
+        data = {
+            "file_name": kwargs.get('file_name', ''),
+            "file_size": kwargs.get('file_size', 0),
+            "target": f"U_1_{file_info['file_id']}",
+            "fileid": kwargs.get('fileid', '')
+        }
+        # 如果提供了sign_key和sign_val，则使用它们进行二次认证
+        if kwargs.get('sign_key') or kwargs.get('sign_val'):
+            data['sign_key'] = kwargs.get('sign_key')
+            data['sign_val'] = kwargs.get('sign_val')
+        response = await self._make_api_request('POST', url, data=data)
+        if not (isinstance(response, dict) and response.get('code') == 0):
+            init.logger.warn(f"文件上传初始化失败: {response['message']}")
+            return False, False
+
+        init.logger.info(response['data'])
+        # 需要二次认证
+        if response['data']['sign_key'] and response['data']['sign_check'] and kwargs.get('request_times') == 1:
+            sign_check = response['data']['sign_check'].split('-')
+            sign_val_provider = kwargs.get('sign_val_provider')
+            if sign_val_provider:
+                sign_val = await sign_val_provider(int(sign_check[0]), int(sign_check[1]))
+            else:
+                sign_val = await file_sha1_by_range_async(kwargs.get('file_path', ''), int(sign_check[0]), int(sign_check[1]))
+            return await self.upload_file(
+                file_name=kwargs.get('file_name', ''),
+                file_size=kwargs.get('file_size', 0),
+                target=kwargs.get('target'),
+                fileid=kwargs.get('fileid', ''),
+                file_path=kwargs.get('file_path', ''),
+                sign_key=response['data']['sign_key'],
+                sign_val=sign_val.upper(),
+                oss_uploader=kwargs.get('oss_uploader'),
+                request_times=2)
+
+        if response['data']['status'] == 2:
+            init.logger.info(f"[{kwargs.get('file_name', '')}]秒传成功！")
+            return True, True
+
+        # 秒传失败，需要上传到阿里服务器
+        callback_params = response['data'].get('callback', {})
+        if not callback_params:
+            return None
+        token_info = await self.get_upload_token()
+        if not token_info:
+            init.logger.warn("获取上传token失败")
+            return False, False
+        callback_body_str = callback_params.get('callback', '{}')
+        callback_vars_str = callback_params.get('callback_var', '{}')
+        try:
+            init.logger.info(f"开始上传文件: {kwargs.get('file_name', '')}")
+            oss_params = dict(
+                access_key_id=token_info['AccessKeyId'],
+                access_key_secret=token_info['AccessKeySecret'],
+                security_token=token_info['SecurityToken'],
+                endpoint=token_info['endpoint'],
+                bucket=response['data']['bucket'],
+                key=response['data']['object'],
+                region='cn-shenzhen',
+                callback=base64.b64encode(callback_body_str.encode()).decode(),
+                callback_var=base64.b64encode(callback_vars_str.encode()).decode()
+            )
+            oss_uploader = kwargs.get('oss_uploader')
+            if oss_uploader:
+                upload_result = await oss_uploader(**oss_params)
+            else:
+                upload_result = await asyncio.to_thread(
+                    upload_file_to_oss, file_path=kwargs.get('file_path', ''), **oss_params)
+            if upload_result:
+                init.logger.info(f"[{kwargs.get('file_name', '')}]上传成功！")
+                return True, False
+            init.logger.warn(f"[{kwargs.get('file_name', '')}]上传失败!")
+            return False, False
+        except Exception as e:
+            init.logger.warn(f"上传文件到OSS时出错: {e}")
+            return False, False
+
+    @handle_token_expiry_async
+    async def get_upload_token(self):
+        """获取上传文件的token"""
+        url = f"{self.base_url}/open/upload/get_token"
+        response = await self._make_api_request('GET', url)
+
+        if isinstance(response, dict) and response.get('code') == 0:
+            init.logger.info(f"获取上传token成功: {response}")
+            return response['data']
+        else:
+            init.logger.warn(f"获取上传token失败: {response}")
+            if response['code'] == 40140125:
+                return response
+        return None
+
+    @handle_token_expiry_async
+    async def get_user_info(self):
+        """获取用户信息"""
+        url = f"{self.base_url}/open/user/info"
+        response = await self._make_api_request('GET', url)
+
+        if isinstance(response, dict) and response.get('code') == 0:
+            init.logger.info(f"获取用户信息成功: {response}")
+            return response['data']
+        else:
+            init.logger.warn(f"获取用户信息失败: {response}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def get_quota_info(self):
+        """获取配额信息"""
+        url = f"{self.base_url}/open/offline/get_quota_info"
+        response = await self._make_api_request('GET', url)
+
+        if isinstance(response, dict) and response.get('code') == 0:
+            init.logger.info(f"获取配额信息成功: {response}")
+            return response['data']
+        else:
+            init.logger.warn(f"获取配额信息失败: {response}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    @handle_token_expiry_async
+    async def clear_cloud_task(self, flag=0):
+        url = f"{self.base_url}/open/offline/clear_task"
+        data = {
+            "flag": flag
+        }
+        response = await self._make_api_request('POST', url, data=data)
+        if response['state'] == True:
+            init.logger.info(f"清理云端任务成功！")
+            self._forget_offline_reads()
+            return True
+        else:
+            init.logger.warn(f"清理云端任务失败: {response['message']}")
+            if response['code'] == 40140125:
+                return response
+            return None
+
+    async def check_offline_download_success(self, url, offline_timeout=300):
+        # 与同步客户端共享同一个后台监听器
+        from app.core.offline_task_watcher import TASK_SUCCESS, TASK_FAILED
+        state, task = await init.offline_task_watcher.wait_async(url, offline_timeout)
+        task_name = task.get('name', '') if task else ""
+        info_hash = task.get('info_hash', '') if task else ""
+        if state == TASK_SUCCESS:
+            return True, task_name, info_hash
+        if state == TASK_FAILED:
+            init.logger.warn(f"[{task_name}]离线下载失败!")
+        else:
+            init.logger.warn(f"[{task_name}]离线下载超时!")
+        return False, task_name, info_hash
+
+    async def get_files_from_dir(self, path, file_type=4):
+        """获取指定目录下的所有文件"""
+        video_list = []
+        file_info = await self.get_file_info(path)
+        if not file_info:
+            init.logger.warn(f"获取目录信息失败: {file_info}")
+            return video_list
+
+        params = {
+            "cid": file_info['file_id'],
+            "type": file_type,
+            "limit": 1000
+        }
+        file_list = await self.get_file_list(params)
+        for file in file_list or []:
+            video_list.append(file['fn'])
+        return video_list
+
+    async def is_directory(self, path):
+        """检查路径是否为目录"""
+        file_info = await self.get_file_info(path)
+        if not file_info:
+            init.logger.warn(f"获取文件信息失败: {file_info}")
+            return False
+        return file_info['file_category'] == '0'
+
+    async def create_dir_for_file(self, path, floder_name):
+        file_info = await self.get_file_info(path)
+        if not file_info:
+            init.logger.warn(f"获取目录信息失败: {path}")
+            return False
+        self.path_cache.invalidate(f"{path}/{floder_name}")
+        return await self.create_directory(file_info['file_id'], floder_name)
+
+    async def create_dir_recursive(self, path):
+        """递归创建目录"""
+        # 清除目标路径缓存，确保状态最新
+        self.path_cache.invalidate(path)
+
+        res = await self.get_file_info(path)
+        if res:
+            init.logger.info(f"[{path}]目录已存在！")
+            return res
+
+        last_path = ""
+        final_info = None
+        for index, item in enumerate(get_parent_paths(path)):
+            self.path_cache.invalidate(item)
+
+            res = await self.get_file_info(item)
+            if res:
+                last_path = item
+                final_info = res
+                continue
+
+            # 需要创建
+            parent_id = 0
+            if index > 0:
+                if not final_info:
+                    final_info = await self.get_file_info(last_path)
+                if final_info:
+                    parent_id = final_info.get('file_id') or final_info.get('cid')
+                else:
+                    init.logger.error(f"无法获取父目录信息: {last_path}")
+                    return None
+
+            name = os.path.basename(item)
+            if not name and index == 0:
+                name = item.strip("/")
+
+            created_res = await self.create_directory(parent_id, name)
+            current_info = None
+            if isinstance(created_res, dict):
+                current_info = created_res
+                if 'file_id' not in current_info and 'cid' in current_info:
+                    current_info['file_id'] = current_info['cid']
+            elif created_res is True:
+                # 目录已存在 (code 20004)，但 get_file_info 没查到
+                init.logger.info(f"目录已存在但未获取到信息，尝试从父目录列表查找: {item}")
+                try:
+                    file_list_data = await self.get_file_list({'cid': parent_id, 'limit': 1000})
+                    file_list = []
+                    if isinstance(file_list_data, list):
+                        file_list = file_list_data
+                    elif isinstance(file_list_data, dict):
+                        file_list = file_list_data.get('list', []) or file_list_data.get('data', [])
+                    for f in file_list:
+                        fname = f.get('n') or f.get('file_name') or f.get('name')
+                        if fname == name:
+                            current_info = f
+                            if 'file_id' not in current_info:
+                                current_info['file_id'] = current_info.get('cid') or current_info.get('fid')
+                            break
+                except Exception as e:
+                    init.logger.warn(f"从父目录查找失败: {e}")
+
+            if current_info:
+                final_info = current_info
+                self.path_cache.set(item, final_info)
+                last_path = item
+                init.logger.info(f"目录[{item}]检查/创建/获取成功, ID: {final_info.get('file_id')}")
+            else:
+                init.logger.error(f"创建目录后无法获取其信息: {item}")
+                return None
+
+            await asyncio.sleep(1)
+
+        init.logger.info(f"目录[{path}]处理完成！")
+        return final_info
@@ -135,60 +135,51 @@ def check_yesterday_exists():
 
 
 def save_av_daily_update2db(results):
-    with SqlLiteLib() as sqlite:
-        for item in results:
-            av_number = item['av_number']
-            publish_date = item['publish_date']
-            title = item['av_title']
-            post_url = item['cover_url']
-            magnet = item['magnet_url']
-            pub_url = item['pub_url']
+    from app.core.sehua_spider import check_magnet
+    from app.utils.utils import magnet_info_hash
+    records = []
+    for item in results:
+        av_number = item['av_number']
+        publish_date = item['publish_date']
+        title = item['av_title']
+        post_url = item['cover_url']
+        magnet = item['magnet_url']
+        pub_url = item['pub_url']
+
+        if not av_number or not publish_date or not title or not magnet or not pub_url:
+            init.logger.warn(f"跳过无效的AV记录，番号: {av_number}, 标题: {title}, 发布链接: {pub_url}")
+            continue
+
+        if check_magnet(magnet) is False:
+            init.logger.warn(f"[{magnet}]磁力链接格式不正确，跳过入库!")
+            continue
 
-            if not av_number or not publish_date or not title or not magnet or not pub_url:
-                init.logger.warn(f"跳过无效的AV记录，番号: {av_number}, 标题: {title}, 发布链接: {pub_url}")
-                continue
-            
-            from app.core.sehua_spider import check_magnet
-            if check_magnet(magnet) is False:
-                init.logger.warn(f"[{magnet}]磁力链接格式不正确，跳过入库!")
-                continue
-            
-            # 检查是否已存在相同的记录
-            from app.core.sehua_spider import get_magnet_hash
-            magnet_hash = get_magnet_hash(magnet)
-            if magnet_hash:
-                # 如果能提取到hash，使用模糊匹配查询
-                sql_check = "select count(*) from av_daily_update where magnet LIKE ?"
-                params_check = (f'%{magnet_hash}%', )
-            else:
-                # 提取不到hash，回退到完全匹配
-                sql_check = "select count(*) from av_daily_update where magnet = ?"
-                params_check = (magnet, )
+        # 判断数据完整性
+        if not av_number or \
+            not publish_date or \
+            not title or \
+            not post_url or \
+            not magnet or \
+            not pub_url:
+            init.logger.warn(f"AV番号: {av_number}, 标题: {title} 数据不完整，跳过入库！")
+            continue
+
+        records.append({
+            'av_number': av_number,
+            'publish_date': publish_date,
+            'title': title,
+            'post_url': post_url,
+            'magnet': magnet,
+            'pub_url': pub_url,
+            # 通过info_hash去重
+            'info_hash': magnet_info_hash(magnet)
+        })
+    if not records:
+        return
+    with SqlLiteLib() as sqlite:
+        insert_count, skip_count = sqlite.bulk_insert('av_daily_update', records)
+    init.logger.info(f"AV日更保存成功 {insert_count} 条，已存在跳过 {skip_count} 条。")
 
-            count = sqlite.query_one(sql_check, params_check)
-            if count > 0:
-                init.logger.info(f"[{title}]检测到相同磁力链接(Hash: {magnet_hash})已存在，跳过入库！")
-                continue  # 已存在，跳过
-            
-            # 判断数据完整性
-            if not av_number or \
-                not publish_date or \
-                not title or \
-                not post_url or \
-                not magnet or \
-                not pub_url:
-                init.logger.warn(f"AV番号: {av_number}, 标题: {title} 数据不完整，跳过入库！")
-                continue
-            
-            # 插入新记录
-            sql_insert = """
-                INSERT INTO av_daily_update (av_number, publish_date, title, post_url, magnet, pub_url)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """
-            params_insert = (av_number, publish_date, title, post_url, magnet, pub_url)
-            sqlite.execute_sql(sql_insert, params_insert)
-            init.logger.info(f"AV日更 {av_number} 保存成功。")   
-            
 def av_daily_update():
     # 检查配置是否启用AV日更
     if not init.bot_config.get('av_daily_update', {}).get('enable', False):
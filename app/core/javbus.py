@@ -14,7 +14,8 @@ import re
 from app.core.offline_task_retry import javbus_offline
 from app.utils.sqlitelib import *
 from concurrent.futures import ThreadPoolExecutor
-from app.utils.utils import check_magnet, clean_magnet
+from app.utils.utils import check_magnet, clean_magnet, magnet_info_hash
+from app.utils.temp_storage import SUBSYSTEM_JAVBUS
 
 # 全局信号量，限制并发数为 5
 sem = asyncio.Semaphore(5)
@@ -113,12 +114,14 @@ async def get_content_from_rssurl(rss_url):
         init.logger.error(f"获取RSS内容发生未知错误: {e}")
         return None
     
-async def download_image(url, referer=None, save_dir="/tmp/javbus"):
+async def download_image(url, referer=None, save_dir=None):
     """异步下载图片"""
     if not url:
         return None
     
     try:
+        if save_dir is None:
+            save_dir = init.temp_storage.subsystem_dir(SUBSYSTEM_JAVBUS)
         if not os.path.exists(save_dir):
             os.makedirs(save_dir, exist_ok=True)
             
@@ -143,8 +146,8 @@ async def download_image(url, referer=None, save_dir="/tmp/javbus"):
         )
         
         if response.status_code == 200:
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
+            if not init.temp_storage.save_bytes(SUBSYSTEM_JAVBUS, save_path, response.content):
+                return None
             return save_path
         else:
             init.logger.warn(f"下载图片失败: {url}, 状态码: {response.status_code}")
@@ -193,43 +196,32 @@ async def save_items_to_db(items):
 
 def _batch_insert_sync(items):
     """同步的批量插入逻辑"""
-    # 实际的 SQL 插入逻辑，根据你的表结构调整
-    # 这里使用上下文管理器，确保连接正确关闭
-    insert_count = 0
-    with init.SqlLiteLib() as sqlite:
-        for data in items:
-            # 判断数据有效性 (只检查核心字段，防止因非关键字段缺失导致丢弃)
-            if  not data.get("magnet") or \
-                not data.get("av_number") or \
-                not data.get("title"):
-                init.logger.info(f"跳过无效数据(缺失核心字段): {json.dumps(data)}")
-                continue
-            
-            # 判断是否是重复数据
-            sql = "SELECT COUNT(*) FROM javbus WHERE magnet = ? or av_number = ?"
-            params = (data["magnet"], data["av_number"])
-            count = sqlite.query_one(sql, params)
-            if count and count > 0:
-                init.logger.info(f"跳过重复数据: {data['av_number']}")
-                continue
-            
-            # 准备数据，处理可能的空值
-            title = data.get("title", "")
-            av_number = data.get("av_number", "")
-            actress = data.get("actress", "")
-            save_path = data.get("save_path", "")
-            publish_date = data.get("publish_date", "")
-            sub_category = data.get("sub_category", "")
-            
-            # 转义 Markdown
-            safe_title = escape_markdown(title, version=2)
-            safe_av_number = escape_markdown(av_number, version=2)
-            safe_actress = escape_markdown(actress, version=2)
-            safe_save_path = escape_markdown(save_path, version=2)
-            safe_publish_date = escape_markdown(publish_date, version=2)
-            safe_sub_category = escape_markdown(sub_category, version=2)
-            
-            movie_info = f"""
+    records = []
+    for data in items:
+        # 判断数据有效性 (只检查核心字段，防止因非关键字段缺失导致丢弃)
+        if  not data.get("magnet") or \
+            not data.get("av_number") or \
+            not data.get("title"):
+            init.logger.info(f"跳过无效数据(缺失核心字段): {json.dumps(data)}")
+            continue
+
+        # 准备数据，处理可能的空值
+        title = data.get("title", "")
+        av_number = data.get("av_number", "")
+        actress = data.get("actress", "")
+        save_path = data.get("save_path", "")
+        publish_date = data.get("publish_date", "")
+        sub_category = data.get("sub_category", "")
+
+        # 转义 Markdown
+        safe_title = escape_markdown(title, version=2)
+        safe_av_number = escape_markdown(av_number, version=2)
+        safe_actress = escape_markdown(actress, version=2)
+        safe_save_path = escape_markdown(save_path, version=2)
+        safe_publish_date = escape_markdown(publish_date, version=2)
+        safe_sub_category = escape_markdown(sub_category, version=2)
+
+        movie_info = f"""
 JAvBus订阅通知：
 
 **订阅类别：**  {safe_sub_category}
@@ -241,25 +233,35 @@ JAvBus订阅通知：
 **发布地址：**  [点击查看详情]({data.get('pub_url', '')})
 **保存路径：**  `{safe_save_path}`
 """
-            insert_sql = """
-                INSERT INTO javbus (sub_category, av_number, title, publish_date, actress, magnet, poster_url, pub_url, save_path, movie_info)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """
-            # 注意：SqlLiteLib 的方法名是 execute_sql
-            sqlite.execute_sql(insert_sql, (
-                sub_category,
-                av_number,
-                title,
-                publish_date,
-                actress,
-                data.get("magnet"),
-                data.get("poster_url"),
-                data.get("pub_url"),
-                save_path,
-                movie_info
-            ))
-            insert_count += 1
-        init.logger.info(f"本次批量插入完成，共插入 {insert_count} 条新数据。")
+        records.append({
+            "sub_category": sub_category,
+            "av_number": av_number,
+            "title": title,
+            "publish_date": publish_date,
+            "actress": actress,
+            "magnet": data.get("magnet"),
+            "poster_url": data.get("poster_url"),
+            "pub_url": data.get("pub_url"),
+            "save_path": save_path,
+            "movie_info": movie_info,
+            "info_hash": magnet_info_hash(data["magnet"])
+        })
+    if not records:
+        return
+
+    with init.SqlLiteLib() as sqlite:
+        # 按番号和info_hash去重，提取不到info_hash的磁力链接回退到完全匹配
+        existing_magnets = sqlite.existing_values(
+            "javbus", "magnet", (record["magnet"] for record in records if not record["info_hash"]))
+        new_records = []
+        for record in records:
+            if not record["info_hash"]:
+                if record["magnet"] in existing_magnets:
+                    continue
+                existing_magnets.add(record["magnet"])
+            new_records.append(record)
+        insert_count, skip_count = sqlite.bulk_insert("javbus", new_records, keys=("info_hash", "av_number"))
+    init.logger.info(f"本次批量插入完成，共插入 {insert_count} 条新数据，跳过 {skip_count + len(records) - len(new_records)} 条重复数据。")
 
 async def process_single_item(sub_category, item, user_input):
     async with sem:
@@ -397,6 +399,7 @@ def get_save_path(sub_category, user_input):
 if __name__ == "__main__":
     init.init_log()
     init.load_yaml_config()
+    init.init_temp_storage()
     try:
         asyncio.run(rss_javbus("女优", "https://rss.yhfw.fun/javbus/search/河北彩花", "河北彩花"))
     finally:
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+import time
+import init
+from concurrent.futures import ThreadPoolExecutor
+from telegram.helpers import escape_markdown
+from app.utils.sqlitelib import *
+from app.utils.message_queue import add_task_to_queue
+from app.core.offline_task_index import is_task_success
+from app.core.offline_task_watcher import wait_offline_tasks
+from app.core.offline_task_retry import offline2115, create_offline_url, create_offline_group_by_save_path, \
+    add_year_month_to_path, generate_strm_file, del_images, wait_for_message_queue_completion, status_updates, \
+    sehua_success_proccesser, av_daily_success_proccesser, t66y_success_proccesser, javbus_success_proccesser
+
+
+class OfflineRun:
+    """单个来源一次离线流程的上下文"""
+
+    def __init__(self, source):
+        self.source = source
+        self.items = []
+        self.save_paths = []
+        self.success_task = []
+        self.images = []
+        self.time_stamp = 0
+        self.success_count = 0
+        # {section_name: {'total': 0, 'success': 0}}
+        self.section_stats = {}
+
+
+class OfflineSource:
+    """
+    离线来源，按阶段提供钩子：
+    select -> batches -> (提交) -> (等待完成) -> on_success/on_failure -> notify -> clean -> finish
+    """
+    # 来源名称，用于日志和通知
+    name = ""
+    # bot_config中的配置路径
+    config_path = ()
+    # 清理垃圾文件时是否同时删除空目录
+    clean_empty_dir = False
+
+    def config(self):
+        config = init.bot_config
+        for key in self.config_path:
+            config = (config or {}).get(key, {})
+        return config or {}
+
+    def resolve_save_path(self, save_path):
+        """按年月分类存储"""
+        return add_year_month_to_path(self.config().get('sort_by_year_month', False), save_path)
+
+    def select(self):
+        """查询需要离线的任务"""
+        raise NotImplementedError
+
+    def batches(self, items):
+        """按保存路径分批，返回 [(save_path, 换行分隔的链接)]"""
+        offline_groups = create_offline_group_by_save_path(items)
+        if not offline_groups:
+            return None
+        result = []
+        for save_path, batches in offline_groups.items():
+            save_path = self.resolve_save_path(save_path)
+            for batch_tasks in batches:
+                result.append((save_path, batch_tasks))
+        return result
+
+    def section_of(self, item):
+        return item.get('section_name') or self.name
+
+    def success_entry(self, item, save_path, task):
+        """生成strm时使用的成功任务信息"""
+        return {"task": task, "save_path": save_path}
+
+    def on_success(self, run, item, save_path, task):
+        raise NotImplementedError
+
+    def on_failure(self, run, item, task):
+        init.logger.warn(f"{item['title']} 离线下载失败或未完成。")
+        # 删除离线失败的文件
+        init.openapi_115.del_offline_task(task['info_hash'])
+
+    def notify(self, run):
+        """发送汇总通知，返回False则跳过后续清理"""
+        return True
+
+    def notify_sections(self, run, title, success_image):
+        """按板块发送汇总通知，返回是否有需要通知的板块"""
+        messages = []
+        for section_name, stats in run.section_stats.items():
+            if stats['total'] > 0:
+                line = f"[{section_name}]离线任务完成情况: {stats['success']}/{stats['total']}"
+                messages.append(escape_markdown(line, version=2))
+                init.logger.info(line)
+        if not messages:
+            return False
+        final_message = f"**{title}:**\n" + "\n".join(messages)
+        image = success_image if run.success_count > 0 else f"{init.IMAGE_PATH}/teacher_pto.jpg"
+        add_task_to_queue(init.bot_config['allowed_user'], image, final_message)
+        return True
+
+    def clean(self, run):
+        """删除垃圾文件，创建strm文件"""
+        for path in run.save_paths:
+            init.openapi_115.auto_clean_all(path, clean_empty_dir=self.clean_empty_dir)
+            result = init.openapi_115.find_all_voideos(path, run.success_task, run.time_stamp)
+            generate_strm_file(result)
+
+    def finish(self, run):
+        """删除本地临时文件"""
+        del_images(run.images)
+
+
+class SehuaSource(OfflineSource):
+    name = "涩花"
+    config_path = ('sehua_spider',)
+
+    def select(self):
+        items = []
+        for section in self.config().get('sections', []):
+            section_name = section.get('name', '')
+            sql = "select * from sehua_data WHERE is_download=0 and section_name=? order by publish_date desc"
+            with SqlLiteLib() as sqlite:
+                results = sqlite.query_all(sql, (section_name,))
+            if not results:
+                init.logger.info(f"[涩花][{section_name}]板块，没有找到需要离线任务~")
+                continue
+            init.logger.info(f"[涩花][{section_name}]板块，找到 {len(results)} 个需要离线的任务")
+            items.extend(results)
+        return items
+
+    def success_entry(self, item, save_path, task):
+        if item['section_name'] == '国产原创':
+            return {"task": task, "save_path": save_path, "image_path": item['image_path']}
+        return {"task": task, "save_path": save_path}
+
+    def on_success(self, run, item, save_path, task):
+        sehua_success_proccesser(item, save_path, task)
+        run.images.append(item['image_path'])
+
+    def notify(self, run):
+        if self.notify_sections(run, "涩花离线任务完成情况", f"{init.IMAGE_PATH}/sehua_daily_update.png"):
+            # 全部失败时不做清理，保留现场
+            return run.success_count > 0
+        return True
+
+
+class AvDailySource(OfflineSource):
+    name = "AV日更"
+    config_path = ('av_daily_update',)
+
+    def select(self):
+        save_path = self.config().get('save_path', '/AV/日更')
+        with SqlLiteLib() as sqlite:
+            sql = "SELECT av_number, magnet, publish_date, title, post_url, pub_url, id FROM av_daily_update WHERE is_download=0 ORDER BY publish_date DESC"
+            need_offline_av = sqlite.query(sql)
+        if not need_offline_av:
+            init.logger.info("没有需要离线下载的日更")
+            return []
+        return [{
+            "av_number": row[0],
+            "magnet": row[1],
+            "publish_date": row[2],
+            "title": row[3],
+            "post_url": row[4],
+            "pub_url": row[5],
+            "id": row[6],
+            "save_path": save_path
+        } for row in need_offline_av]
+
+    def batches(self, items):
+        create_offline_url_list = create_offline_url(items)
+        if not create_offline_url_list:
+            return None
+        save_path = self.resolve_save_path(items[0]['save_path'])
+        return [(save_path, offline_tasks) for offline_tasks in create_offline_url_list]
+
+    def on_success(self, run, item, save_path, task):
+        av_daily_success_proccesser(item, task, save_path)
+
+    def on_failure(self, run, item, task):
+        init.logger.warn(f"{item['av_number']} 离线下载失败或未完成。")
+        init.openapi_115.del_offline_task(task['info_hash'])
+
+    def notify(self, run):
+        total_count = len(run.items)
+        message = f"本次AV日更结束！总计离线：{total_count}， 成功：{run.success_count}， 失败：{total_count - run.success_count}"
+        init.logger.info(message)
+        if total_count != run.success_count:
+            init.logger.info("失败的任务会在下次自动重试，请检查日志。")
+            message += "\n失败的任务会在下次自动重试，请留意日志或通知！"
+        add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/av_daily_update.png", message)
+        return True
+
+
+class T66ySource(OfflineSource):
+    name = "t66y"
+    config_path = ('rsshub', 't66y')
+    clean_empty_dir = True
+
+    def select(self):
+        sql = "select * from t66y WHERE is_download=0 order by publish_date desc"
+        with SqlLiteLib() as sqlite:
+            results = sqlite.query_all(sql)
+        if not results:
+            init.logger.info("t66y没有找到需要离线任务~")
+            return []
+        init.logger.info(f"t66y找到 {len(results)} 个需要离线的任务")
+        return results
+
+    def section_of(self, item):
+        return item.get('section_name', '未知板块')
+
+    def on_success(self, run, item, save_path, task):
+        t66y_success_proccesser(item, save_path, task)
+
+    def notify(self, run):
+        self.notify_sections(run, "t66y离线任务完成情况", f"{init.IMAGE_PATH}/rss_1024.jpg")
+        return True
+
+
+class JavbusSource(OfflineSource):
+    name = "JavBus"
+    config_path = ('rsshub', 'javbus')
+
+    def select(self):
+        sql = "select * from javbus WHERE is_download=0 order by publish_date desc"
+        with SqlLiteLib() as sqlite:
+            results = sqlite.query_all(sql)
+        if not results:
+            init.logger.info("JavBus没有找到需要离线任务~")
+            return []
+        init.logger.info(f"JavBus找到 {len(results)} 个需要离线的任务")
+        return results
+
+    def on_success(self, run, item, save_path, task):
+        javbus_success_proccesser(item, save_path, task)
+        run.images.append(item['poster_url'])
+
+    def notify(self, run):
+        message = escape_markdown(f"JavBus订阅任务完成情况: {run.success_count}/{len(run.items)}", version=2)
+        if run.success_count > 0:
+            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/rss_javbus.jpg", message)
+        else:
+            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/teacher_pto.jpg", message)
+        return True
+
+
+def run_source(source):
+    """按阶段执行单个来源的离线流程，返回是否完成了清理（需要清空云端任务）"""
+    init.logger.info(f"开始{source.name}离线任务...")
+    run = OfflineRun(source)
+
+    # 1. 查询需要离线的任务
+    run.items = source.select()
+    if not run.items:
+        return False
+
+    # 2. 分批
+    batches = source.batches(run.items)
+    if not batches:
+        message = f"{source.name}离线任务未执行，可能是115离线配额不足，请检查115账号状态！"
+        init.logger.warn(message)
+        add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/male023.png", message)
+        return False
+
+    # 3. 按配额提交离线，超出配额的任务保持未下载状态，推迟到下个配额周期
+    deferred = set()
+    for save_path, batch_tasks in batches:
+        if save_path not in run.save_paths:
+            run.save_paths.append(save_path)
+        deferred.update(offline2115(batch_tasks, len(batch_tasks.split('\n')), save_path))
+    if deferred:
+        run.items = [item for item in run.items if item['magnet'] not in deferred]
+        init.logger.warn(f"{source.name}离线配额不足，{len(deferred)}个任务推迟到下个配额周期")
+        if not run.items:
+            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/male023.png",
+                              f"{source.name}离线配额不足，{len(deferred)}个任务推迟到下个配额周期！")
+            return False
+
+    # 4. 等待离线完成
+    wait_offline_tasks([item['magnet'] for item in run.items])
+
+    # 5. 处理离线结果
+    init.offline_task_index.refresh()
+    run.time_stamp = int(time.time())
+    for item in run.items:
+        stats = run.section_stats.setdefault(source.section_of(item), {'total': 0, 'success': 0})
+        stats['total'] += 1
+        task = init.offline_task_index.get(item['magnet'])
+        if not task:
+            continue
+        if is_task_success(task):
+            save_path = source.resolve_save_path(item['save_path'])
+            source.on_success(run, item, save_path, task)
+            run.success_task.append(source.success_entry(item, save_path, task))
+            run.success_count += 1
+            stats['success'] += 1
+        else:
+            source.on_failure(run, item, task)
+    # 本次成功任务的下载状态合并为一个事务写入
+    status_updates.flush()
+
+    # 6. 等待消息队列处理完成后发送汇总通知，避免在消息发送期间删除图片文件
+    wait_for_message_queue_completion(source.name)
+    if not source.notify(run):
+        return False
+
+    # 7. 删除垃圾文件 创建strm文件
+    source.clean(run)
+
+    # 8. 删除本地临时文件
+    source.finish(run)
+    return True
+
+
+def _run_source_safe(source):
+    try:
+        return run_source(source)
+    except Exception as e:
+        init.logger.error(f"{source.name}离线任务异常: {e}")
+        return False
+    finally:
+        # 异常退出时也写入已处理任务的状态，避免下次重复离线
+        status_updates.flush()
+
+
+def run_offline_pipeline(sources):
+    """
+    并发执行多个来源的离线流程
+    各来源的等待阶段互相重叠，115请求共用 openapi_115 的限流令牌桶；
+    全部来源结束后统一清空云端已完成任务，避免某个来源提前清空后其他来源查不到任务状态
+    """
+    if len(sources) == 1:
+        results = [_run_source_safe(sources[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="offline-pipeline") as executor:
+            results = list(executor.map(_run_source_safe, sources))
+    if any(results):
+        # 清空已完成的离线任务
+        init.openapi_115.clear_cloud_task()
+    return results
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import init
+
+# 优先级：手动离线（/av、磁力链接）优先于爬虫积压任务
+PRIORITY_USER = 0
+PRIORITY_CRAWLER = 1
+
+# 配额刷新周期(秒)
+DEFAULT_REFRESH_INTERVAL = 60 * 60
+# 获取配额失败后，间隔该时间(秒)再重新获取，不超过配额刷新周期
+FAILED_RETRY_INTERVAL = 5 * 60
+# 为手动离线保留的配额
+DEFAULT_USER_RESERVE = 20
+
+
+class OfflineQuotaScheduler:
+    """
+    115离线配额调度
+
+    每个周期只调用一次 get_quota_info，之后在本地扣减剩余配额；
+    爬虫任务不能占用为手动离线保留的配额，超出部分推迟到下个周期（数据库中仍为未下载状态）。
+    获取配额失败时不做限制，避免因为接口异常阻塞离线；间隔 FAILED_RETRY_INTERVAL 后再重新获取，
+    避免115异常时每次提交都多请求一次配额接口。
+    """
+
+    def __init__(self, client, refresh_interval=DEFAULT_REFRESH_INTERVAL, user_reserve=DEFAULT_USER_RESERVE,
+                 enable=True):
+        self._client = client
+        self.refresh_interval = refresh_interval
+        self.user_reserve = user_reserve
+        self.enable = enable
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._last_refresh = 0
+        # 获取配额失败后，下次重新获取的时间
+        self._retry_at = 0
+        # 统计信息
+        self.granted = 0
+        self.deferred = 0
+
+    @classmethod
+    def from_config(cls, client):
+        quota_config = init.bot_config.get('offline_quota') or {}
+        return cls(
+            client,
+            refresh_interval=float(quota_config.get('refresh_interval', DEFAULT_REFRESH_INTERVAL)),
+            user_reserve=int(quota_config.get('user_reserve', DEFAULT_USER_RESERVE)),
+            enable=quota_config.get('enable', True)
+        )
+
+    def _refresh_if_needed(self):
+        now = time.time()
+        if self._remaining is not None:
+            if now - self._last_refresh < self.refresh_interval:
+                return
+        elif now < self._retry_at:
+            return
+        self._last_refresh = now
+        try:
+            quota_info = self._client.get_quota_info()
+        except Exception as e:
+            init.logger.warn(f"获取离线配额失败: {e}")
+            quota_info = None
+        if isinstance(quota_info, dict) and 'count' in quota_info and 'used' in quota_info:
+            self._remaining = max(int(quota_info['count']) - int(quota_info['used']), 0)
+            init.logger.info(f"115离线剩余配额: {self._remaining}")
+        else:
+            self._remaining = None
+            self._retry_at = now + min(FAILED_RETRY_INTERVAL, self.refresh_interval)
+
+    def acquire(self, count, priority=PRIORITY_CRAWLER):
+        """申请离线配额，返回实际可以提交的任务数"""
+        if not self.enable or count <= 0:
+            return max(count, 0)
+        with self._lock:
+            self._refresh_if_needed()
+            if self._remaining is None:
+                return count
+            available = self._remaining
+            if priority != PRIORITY_USER:
+                available -= self.user_reserve
+            granted = min(count, max(available, 0))
+            self._remaining -= granted
+            self.granted += granted
+            self.deferred += count - granted
+        if granted < count:
+            init.logger.warn(f"离线配额不足: 申请{count}个, 可提交{granted}个, 其余推迟到下个配额周期")
+        return granted
+
+    def release(self, count):
+        """提交失败时归还配额"""
+        if not self.enable or count <= 0:
+            return
+        with self._lock:
+            if self._remaining is not None:
+                self._remaining += count
+                self.granted -= count
+
+    def invalidate(self):
+        """下次申请时重新获取配额"""
+        with self._lock:
+            self._remaining = None
+            self._retry_at = 0
+
+    @property
+    def remaining(self):
+        with self._lock:
+            return self._remaining
+
+
+def submit_offline(links, save_path, priority=PRIORITY_CRAWLER):
+    """
+    按离线配额提交离线任务，超出配额的链接不提交
+    :param links: 链接列表
+    :return: (offline_download_specify_path的返回值, 因配额不足未提交的链接列表)
+    """
+    granted = init.offline_quota.acquire(len(links), priority)
+    submit_links, deferred = links[:granted], links[granted:]
+    if not submit_links:
+        return False, deferred
+    try:
+        offline_success = init.openapi_115.offline_download_specify_path("\n".join(submit_links), save_path)
+    except Exception:
+        init.offline_quota.release(len(submit_links))
+        raise
+    if offline_success is not True:
+        init.offline_quota.release(len(submit_links))
+    return offline_success, deferred
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import init
+from app.core.open_115 import format_offline_task
+from app.utils.single_flight import SingleFlight
+from app.utils.utils import magnet_info_hash
+
+# 增量刷新时，距离上次全量刷新超过该时间则强制全量刷新(秒)
+DEFAULT_FULL_REFRESH_INTERVAL = 300
+
+
+def offline_task_key(url):
+    """离线链接的索引key：磁力链接统一为小写hex info_hash，其他链接去掉首尾空白"""
+    if not url:
+        return ""
+    url = url.strip()
+    info_hash = magnet_info_hash(url) if url.startswith("magnet:") else None
+    return info_hash or url
+
+
+def is_task_success(task):
+    return task['status'] == 2 and task['percentDone'] == 100
+
+
+class OfflineTaskIndex:
+    """
+    115离线任务状态索引
+
+    按 info_hash 和规范化后的链接建立索引，查询为O(1)。
+    刷新时从第一页开始翻页，记录每一页的签名（info_hash、状态、进度），
+    遇到与上次快照完全相同的页时停止翻页，后续页沿用上次结果（指定了until_seen时，
+    还需要这些任务都已在本次请求的页中出现）；
+    超过 full_refresh_interval 未全量刷新时强制全量刷新，保证较早任务的状态也能更新。
+    """
+
+    def __init__(self, client, full_refresh_interval=DEFAULT_FULL_REFRESH_INTERVAL):
+        self._client = client
+        self.full_refresh_interval = full_refresh_interval
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+        # page -> (signature, [task])
+        self._pages = {}
+        self._by_hash = {}
+        self._by_key = {}
+        self.last_refresh = 0
+        self.last_full_refresh = 0
+        # 最近一次刷新实际请求的页数
+        self.last_pages_fetched = 0
+
+    def _fetch_page(self, page):
+        data = self._client.get_offline_tasks_by_page(page)
+        # 分页接口没有token过期处理，这里刷新一次后重试
+        if isinstance(data, dict) and data.get('code') == 40140125:
+            init.logger.info("Token需要刷新，正在重试...")
+            self._client.refresh_access_token()
+            data = self._client.get_offline_tasks_by_page(page)
+        if not isinstance(data, dict) or 'tasks' not in data:
+            return None
+        return data
+
+    def refresh(self, full=False, until_seen=None):
+        """
+        刷新索引，并发调用时共享同一次刷新；返回是否刷新成功
+        :param full: 是否全量刷新
+        :param until_seen: 需要确保拿到最新状态的任务key集合（info_hash或链接）
+        """
+        return self._single_flight.do("refresh", self._refresh, full, set(until_seen or ()))
+
+    def invalidate(self):
+        """添加或删除离线任务之后调用，之后的 refresh 重新翻页，不再共享写之前开始的刷新"""
+        self._single_flight.forget("refresh")
+
+    def _refresh(self, full, until_seen):
+        if not full and time.time() - self.last_full_refresh > self.full_refresh_interval:
+            full = True
+
+        first = self._fetch_page(1)
+        if first is None:
+            init.logger.warn("刷新离线任务索引失败: 获取第1页失败")
+            return False
+        page_count = max(int(first.get('page_count', 1) or 1), 1)
+
+        pages = {} if full else {p: v for p, v in self._pages.items() if p <= page_count}
+        fetched = 1
+        seen = set()
+        data = first
+        for page in range(1, page_count + 1):
+            if page > 1:
+                data = self._fetch_page(page)
+                if data is None:
+                    init.logger.warn(f"刷新离线任务索引失败: 获取第{page}页失败")
+                    return False
+                fetched += 1
+            tasks = [format_offline_task(task) for task in data['tasks']]
+            signature = tuple((task['info_hash'], task['status'], task['percentDone']) for task in tasks)
+            previous = self._pages.get(page)
+            pages[page] = (signature, tasks)
+            for task in tasks:
+                seen.add(task['info_hash'].lower())
+                seen.add(offline_task_key(task['url']))
+            # 本页与上次快照完全相同，说明后续页也没有变化
+            if not full and previous is not None and previous[0] == signature and until_seen <= seen:
+                break
+
+        by_hash = {}
+        by_key = {}
+        # 从最后一页往前写入，同一链接重复添加时以最新的任务为准
+        for page in sorted(pages, reverse=True):
+            for task in reversed(pages[page][1]):
+                if task['info_hash']:
+                    by_hash[task['info_hash'].lower()] = task
+                key = offline_task_key(task['url'])
+                if key:
+                    by_key[key] = task
+
+        with self._lock:
+            self._pages = pages
+            self._by_hash = by_hash
+            self._by_key = by_key
+        now = time.time()
+        self.last_refresh = now
+        if full:
+            self.last_full_refresh = now
+        self.last_pages_fetched = fetched
+        init.logger.debug(f"离线任务索引已刷新: 请求{fetched}/{page_count}页, 共{len(by_hash)}个任务")
+        return True
+
+    def get(self, url):
+        """按离线链接查询任务，磁力链接按info_hash匹配"""
+        key = offline_task_key(url)
+        if not key:
+            return None
+        with self._lock:
+            return self._by_hash.get(key) or self._by_key.get(key)
+
+    def get_by_hash(self, info_hash):
+        if not info_hash:
+            return None
+        with self._lock:
+            return self._by_hash.get(info_hash.lower())
+
+    def tasks(self):
+        with self._lock:
+            return list(self._by_hash.values())
+
+    def __len__(self):
+        return len(self._by_hash)
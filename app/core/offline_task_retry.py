@@ -8,9 +8,13 @@ from pathlib import Path
 from datetime import datetime
 from app.utils.sqlitelib import *
 from app.utils.message_queue import add_task_to_queue
+from app.core.offline_quota import submit_offline, PRIORITY_CRAWLER
 from telegram.helpers import escape_markdown
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+# 离线成功后的状态更新，合并写入数据库，离线流程结束时调用 status_updates.flush()
+status_updates = UpdateBuffer()
+
 
 def wait_for_message_queue_completion(task_name="任务", timeout=0):
     """
@@ -57,144 +61,30 @@ def wait_for_message_queue_completion(task_name="任务", timeout=0):
 
 
 def offline_task_retry():
-    init.logger.info("开始涩花离线任务...")
-    sehua_offline()
-    init.logger.info("开始AV日更离线任务...")
-    av_daily_offline()
-    init.logger.info("开始t66y离线任务...")
-    t66y_offline()
-    init.logger.info("开始JavBus离线任务...")
-    javbus_offline()
+    """各来源并发执行离线流程，全部结束后统一清空云端任务"""
+    from app.core.offline_pipeline import run_offline_pipeline, SehuaSource, AvDailySource, T66ySource, JavbusSource
+    run_offline_pipeline([SehuaSource(), AvDailySource(), T66ySource(), JavbusSource()])
 
 
 def sehua_offline():
-    save_path_list= []
-    check_results = []
-    sections = init.bot_config.get('sehua_spider', {}).get('sections', [])
-    for section in sections:
-        section_name = section.get('name', '')
-        save_path = section.get('save_path', f'/AV/涩花/{section_name}')
-        sql = "select * from sehua_data WHERE is_download=0 and section_name=? order by publish_date desc"
-        with SqlLiteLib() as sqlite:
-            results = sqlite.query_all(sql, (section_name,))
-            if not results:
-                init.logger.info(f"[涩花][{section_name}]板块，没有找到需要离线任务~")
-                continue
-            init.logger.info(f"[涩花][{section_name}]板块，找到 {len(results)} 个需要离线的任务")
-            check_results.extend(results)
-            # 分批处理，每100个任务一批
-            offline_groups = create_offline_group_by_save_path(results)
-            if offline_groups:
-                for save_path, batches in offline_groups.items():
-                    # 按年月分类存储
-                    save_path = add_year_month_to_path(init.bot_config.get('sehua_spider', {}).get('sort_by_year_month', False), save_path)
-                    if save_path not in save_path_list:
-                        save_path_list.append(save_path)
-                    for batch_tasks in batches:
-                        task_count = len(batch_tasks.split('\n')) 
-                        offline2115(batch_tasks, task_count, save_path)
-            else:
-                init.logger.warn("涩花离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-                add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/male023.png", "涩花离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-                return
-
-    # 等待离线完成
-    time.sleep(300)
-    domestic_original_count = 0
-    domestic_original_success = 0
-    asia_censored_count = 0
-    asia_censored_success = 0
-    asia_uncensored_count = 0
-    asia_uncensored_success = 0
-    hd_subtitle_count = 0
-    hd_subtitle_success = 0
-    
-    # 创建一个共享的成功计数列表
-    success_counters = [0, 0, 0, 0]  # [国产原创, 亚洲有码原创, 亚洲无码原创, 高清中文字幕]
-    
-    # 获取离线任务状态
-    offline_task_status = init.openapi_115.get_offline_tasks()
-    images = []
-    time_stamp = int(time.time())
-    success_task = []
-    for item in check_results:
-        section_name = item['section_name']
-        magnet = item['magnet']
-        if section_name == '国产原创':
-            domestic_original_count += 1
-        elif section_name == '亚洲有码原创':
-            asia_censored_count += 1
-        elif section_name == '亚洲无码原创':
-            asia_uncensored_count += 1
-        elif section_name == '高清中文字幕':
-            hd_subtitle_count += 1
-        save_path = add_year_month_to_path(init.bot_config.get('sehua_spider', {}).get('sort_by_year_month', False), item['save_path'])
-        for task in offline_task_status:
-            if task['url'] == magnet:
-                if task['status'] == 2 and task['percentDone'] == 100:
-                    sehua_success_proccesser(item, save_path, task, success_counters)
-                    images.append(item['image_path'])
-                    if section_name == '国产原创':
-                        success_task.append({"task": task, "save_path": save_path, "image_path": item['image_path']})
-                    else:
-                        success_task.append({"task": task, "save_path": save_path})
-                else:
-                    init.logger.warn(f"{item['title']} 离线下载失败或未完成。")
-                    # 删除离线失败的文件
-                    init.openapi_115.del_offline_task(task['info_hash'])
-                break
-    # 等待消息队列处理完成，避免在消息发送期间删除图片文件
-    wait_for_message_queue_completion("涩花")
-
-    # 从共享列表中获取最终的成功计数
-    domestic_original_success = success_counters[0]
-    asia_censored_success = success_counters[1]
-    asia_uncensored_success = success_counters[2] 
-    hd_subtitle_success = success_counters[3]
-    
-    # 收集有任务的类别信息
-    messages = []
-    if domestic_original_count > 0:
-        message_line = escape_markdown(f"[国产原创]离线任务完成情况: {domestic_original_success}/{domestic_original_count}", version=2)
-        messages.append(message_line)
-        init.logger.info(f"[国产原创]离线任务完成情况: {domestic_original_success}/{domestic_original_count}")
-    
-    if asia_censored_count > 0:
-        message_line = escape_markdown(f"[亚洲有码原创]离线任务完成情况: {asia_censored_success}/{asia_censored_count}", version=2)
-        messages.append(message_line)
-        init.logger.info(f"[亚洲有码原创]离线任务完成情况: {asia_censored_success}/{asia_censored_count}")
-    
-    if asia_uncensored_count > 0:
-        message_line = escape_markdown(f"[亚洲无码原创]离线任务完成情况: {asia_uncensored_success}/{asia_uncensored_count}", version=2)
-        messages.append(message_line)
-        init.logger.info(f"[亚洲无码原创]离线任务完成情况: {asia_uncensored_success}/{asia_uncensored_count}")
-    
-    if hd_subtitle_count > 0:
-        message_line = escape_markdown(f"[高清中文字幕]离线任务完成情况: {hd_subtitle_success}/{hd_subtitle_count}", version=2)
-        messages.append(message_line)
-        init.logger.info(f"[高清中文字幕]离线任务完成情况: {hd_subtitle_success}/{hd_subtitle_count}")
-
-    # 只有当有任务时才发送消息
-    if messages: 
-        final_message = "**涩花离线任务完成情况:**\n" + "\n".join(messages)
-        if domestic_original_success + asia_censored_success + asia_uncensored_success + hd_subtitle_success > 0:
-            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/sehua_daily_update.png", final_message)
-        else:
-            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/teacher_pto.jpg", final_message)
-            return
-    
-    # 删除垃圾文件 创建strm文件
-    for path in save_path_list:
-        init.openapi_115.auto_clean_all(path)
-        result = init.openapi_115.find_all_voideos(path, success_task, time_stamp)
-        generate_strm_file(result)
-    
-    # 清空已完成的离线任务
-    init.openapi_115.clear_cloud_task()
-    
-    # 删除临时文件
-    del_images(images)
-    
+    from app.core.offline_pipeline import run_offline_pipeline, SehuaSource
+    run_offline_pipeline([SehuaSource()])
+
+
+def av_daily_offline():
+    from app.core.offline_pipeline import run_offline_pipeline, AvDailySource
+    run_offline_pipeline([AvDailySource()])
+
+
+def t66y_offline():
+    from app.core.offline_pipeline import run_offline_pipeline, T66ySource
+    run_offline_pipeline([T66ySource()])
+
+
+def javbus_offline():
+    from app.core.offline_pipeline import run_offline_pipeline, JavbusSource
+    run_offline_pipeline([JavbusSource()])
+
 
 def del_images(images):
     if not images:
@@ -209,7 +99,7 @@ def del_images(images):
     init.logger.info("所有临时图片文件已删除!")
     
                 
-def sehua_success_proccesser(item, save_path, task, success_list):
+def sehua_success_proccesser(item, save_path, task):
     id = item['id']
     section_name = item['section_name']
     av_number = item['av_number']
@@ -223,23 +113,10 @@ def sehua_success_proccesser(item, save_path, task, success_list):
     image_path = item['image_path']
 
     # 更新数据库状态
-    with SqlLiteLib() as sqlite:
-        sql_update = "UPDATE sehua_data SET is_download=1 WHERE id=?"
-        params_update = (id,)
-        sqlite.execute_sql(sql_update, params_update)
+    status_updates.add("sehua_data", "is_download=1", id)
     
     init.logger.info(f"{title} 离线下载成功！")
     
-    # 更新成功计数器
-    if section_name == '国产原创':
-        success_list[0] += 1
-    elif section_name == '亚洲有码原创':
-        success_list[1] += 1
-    elif section_name == '亚洲无码原创':
-        success_list[2] += 1
-    elif section_name == '高清中文字幕':
-        success_list[3] += 1
-    
     # 发送通知
     if init.bot_config.get('sehua_spider', {}).get('notify_me', False):
             msg_av_number = escape_markdown(f"#{av_number}", version=2)
@@ -280,93 +157,10 @@ def sehua_success_proccesser(item, save_path, task, success_list):
             
 
 
-def av_daily_offline():
-    update_list = []
-    # 找到需要下载的AV
-    with SqlLiteLib() as sqlite:
-        sql = "SELECT av_number, magnet, publish_date, title, post_url, pub_url, id FROM av_daily_update WHERE is_download=0 ORDER BY publish_date DESC"
-        need_offline_av = sqlite.query(sql)
-        if not need_offline_av:
-            init.logger.info("没有需要离线下载的日更")
-            return
-        for row in need_offline_av:
-            update_list.append({
-                "av_number": row[0],
-                "magnet": row[1],
-                "publish_date": row[2],
-                "title": row[3],
-                "post_url": row[4],
-                "pub_url": row[5],
-                "id": row[6],
-                "success": False  # 初始状态为未成功
-            })
-    
-    # 分批处理，每100个任务一批
-    create_offline_url_list = create_offline_url(update_list)
-    save_path = init.bot_config.get('av_daily_update', {}).get('save_path', '/AV/日更')
-    # 按年月分类存储
-    save_path = add_year_month_to_path(init.bot_config.get('av_daily_update', {}).get('sort_by_year_month', False), save_path)
-    
-    if create_offline_url_list:
-        for offline_tasks in create_offline_url_list:
-            # 离线到115
-            offline2115(offline_tasks, len(update_list), save_path)
-    else:
-        init.logger.warn("AV日更离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-        add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/male023.png", "AV日更离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-        return
-    
-    # 等待离线完成
-    time.sleep(300)
-    # 获取离线任务状态
-    offline_task_status = init.openapi_115.get_offline_tasks()
-    time_stamp = int(time.time())
-    success_task = []
-    # 检查离线下载状态     
-    for item in update_list:
-        for task in offline_task_status:
-            if task['url'] == item['magnet']:
-                if task['status'] == 2 and task['percentDone'] == 100:
-                    av_daily_success_proccesser(item, task, save_path)
-                    success_task.append({"task": task, "save_path": save_path})
-                    item['success'] = True
-                else:
-                    init.logger.warn(f"{item['av_number']} 离线下载失败或未完成。")
-                    # 删除离线失败的文件
-                    init.openapi_115.del_offline_task(task['info_hash'])
-                break
-            
-    # 等待消息队列处理完成，避免在消息发送期间进行清理操作
-    wait_for_message_queue_completion("AV日更")
-            
-    # 发送总结消息
-    total_count = len(update_list)
-    success_count = sum(1 for item in update_list if item['success'])
-    message = f"本次AV日更结束！总计离线：{total_count}， 成功：{success_count}， 失败：{total_count - success_count}"
-    init.logger.info(message) 
-    if total_count != success_count:
-        init.logger.info("失败的任务会在下次自动重试，请检查日志。")
-        message += "\n失败的任务会在下次自动重试，请留意日志或通知！"
-
-    add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/av_daily_update.png", message)
-    
-    # 删除垃圾文件 创建strm文件
-    init.openapi_115.auto_clean_all(save_path)
-    # 创建软链
-    result = init.openapi_115.find_all_voideos(save_path, success_task, time_stamp)
-    generate_strm_file(result)
-    
-    # 清空已完成的离线任务
-    init.openapi_115.clear_cloud_task()
-    
-    
 def av_daily_success_proccesser(item, task, save_path):
     
     # 更新数据库状态
-    with SqlLiteLib() as sqlite:
-        sql_update = "UPDATE av_daily_update SET is_download=1 WHERE id=?"
-        params_update = (item['id'],)
-        sqlite.execute_sql(sql_update, params_update)
+    status_updates.add("av_daily_update", "is_download=1", item['id'])
     
     init.logger.info(f"{item['av_number'].upper()} 离线下载完成！")
     
@@ -393,17 +187,23 @@ def av_daily_success_proccesser(item, task, save_path):
 
 
 def offline2115(offline_tasks, task_count, save_path):
-    
+    """按离线配额提交任务，返回因配额不足未提交的链接列表"""
+    links = offline_tasks.split('\n')
     # 调用115的离线下载API
-    offline_success = init.openapi_115.offline_download_specify_path(
-        offline_tasks,
-        save_path)
+    try:
+        offline_success, deferred = submit_offline(links, save_path, PRIORITY_CRAWLER)
+    except Exception as e:
+        init.logger.error(f"{task_count}个离线任务添加离线失败: {e}")
+        return []
+    if len(deferred) == len(links):
+        return deferred
     if not offline_success: 
-        init.logger.error(f"{task_count}个离线任务添加离线失败!")
+        init.logger.error(f"{task_count - len(deferred)}个离线任务添加离线失败!")
     else:
-        init.logger.info(f"{task_count}个离线任务添加离线成功!")
+        init.logger.info(f"{task_count - len(deferred)}个离线任务添加离线成功!")
 
     time.sleep(2)
+    return deferred
 
 def create_offline_url(res_list):
     offline_tasks = ""
@@ -499,102 +299,6 @@ def push2aria2(save_path, user_id, cover_image, message):
     add_task_to_queue(user_id, cover_image, message, reply_markup)
     
     
-def t66y_offline():
-    save_path_list= []
-    check_results = []
-    
-    # 查询所有未下载的任务
-    sql = "select * from t66y WHERE is_download=0 order by publish_date desc"
-    with SqlLiteLib() as sqlite:
-        results = sqlite.query_all(sql)
-        if not results:
-            init.logger.info("t66y没有找到需要离线任务~")
-            return
-        
-        init.logger.info(f"t66y找到 {len(results)} 个需要离线的任务")
-        check_results.extend(results)
-        
-        # 分批处理
-        offline_groups = create_offline_group_by_save_path(results)
-        if offline_groups:
-            for save_path, batches in offline_groups.items():
-                # 按年月分类存储
-                save_path = add_year_month_to_path(init.bot_config.get('rsshub', {}).get('t66y', {}).get('sort_by_year_month', False), save_path)
-                if save_path not in save_path_list:
-                    save_path_list.append(save_path)
-                for batch_tasks in batches:
-                    task_count = len(batch_tasks.split('\n'))
-                    offline2115(batch_tasks, task_count, save_path)
-        else:
-            init.logger.warn("t66y离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/male023.png", "t66y离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-            return
-
-    # 等待离线完成
-    time.sleep(300)
-    
-    # 统计各板块成功数
-    section_stats = {} # {section_name: {'total': 0, 'success': 0}}
-    
-    # 初始化统计
-    for item in check_results:
-        section_name = item.get('section_name', '未知板块')
-        if section_name not in section_stats:
-            section_stats[section_name] = {'total': 0, 'success': 0}
-        section_stats[section_name]['total'] += 1
-
-    # 获取离线任务状态
-    offline_task_status = init.openapi_115.get_offline_tasks()
-    time_stamp = int(time.time())
-    success_task = []
-    for item in check_results:
-        magnet = item['magnet']
-        save_path = add_year_month_to_path(init.bot_config.get('rsshub', {}).get('t66y', {}).get('sort_by_year_month', False), item['save_path'])
-        section_name = item.get('section_name', '未知板块')
-        
-        for task in offline_task_status:
-            if task['url'] == magnet:
-                if task['status'] == 2 and task['percentDone'] == 100:
-                    t66y_success_proccesser(item, save_path, task)
-                    success_task.append({"task": task, "save_path": save_path})
-                    section_stats[section_name]['success'] += 1
-                else:
-                    init.logger.warn(f"{item['title']} 离线下载失败或未完成。")
-                    # 删除离线失败的文件
-                    init.openapi_115.del_offline_task(task['info_hash'])
-                break
-    
-    # 等待消息队列处理完成
-    wait_for_message_queue_completion("t66y")
-    
-    # 生成汇总消息
-    messages = []
-    total_success = 0
-    for section_name, stats in section_stats.items():
-        if stats['total'] > 0:
-            message_line = escape_markdown(f"[{section_name}]离线任务完成情况: {stats['success']}/{stats['total']}", version=2)
-            messages.append(message_line)
-            init.logger.info(f"[{section_name}]离线任务完成情况: {stats['success']}/{stats['total']}")
-            total_success += stats['success']
-            
-    if messages:
-        final_message = "**t66y离线任务完成情况:**\n" + "\n".join(messages)
-        if total_success > 0:
-            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/rss_1024.jpg", final_message)
-        else:
-            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/teacher_pto.jpg", final_message)
-            
-    # 删除垃圾文件
-    for path in save_path_list:
-        init.openapi_115.auto_clean_all(path, clean_empty_dir=True)
-        # 创建软链
-        result = init.openapi_115.find_all_voideos(path, success_task, time_stamp)
-        generate_strm_file(result)
-        
-    # 清空已完成的离线任务
-    init.openapi_115.clear_cloud_task()
-
-
 def t66y_success_proccesser(item, save_path, task):
     id = item['id']
     title = item['title']
@@ -605,10 +309,7 @@ def t66y_success_proccesser(item, save_path, task):
     pub_date = item['publish_date']
     
     # 更新数据库状态
-    with SqlLiteLib() as sqlite:
-        sql_update = "UPDATE t66y SET is_download=1 WHERE id=?"
-        params_update = (id,)
-        sqlite.execute_sql(sql_update, params_update)
+    status_updates.add("t66y", "is_download=1", id)
         
     init.logger.info(f"{title} 离线下载成功！")
     
@@ -637,88 +338,6 @@ def t66y_success_proccesser(item, save_path, task):
             push2aria2(f"{save_path}/{task['name']}", init.bot_config['allowed_user'], poster_url, message)
 
 
-def javbus_offline():
-    save_path_list= []
-    check_results = []
-    images = []
-    # 查询所有未下载的任务
-    sql = "select * from javbus WHERE is_download=0 order by publish_date desc"
-    with SqlLiteLib() as sqlite:
-        results = sqlite.query_all(sql)
-        if not results:
-            init.logger.info("JavBus没有找到需要离线任务~")
-            return
-        
-        init.logger.info(f"JavBus找到 {len(results)} 个需要离线的任务")
-        check_results.extend(results)
-        
-        # 分批处理
-        offline_groups = create_offline_group_by_save_path(results)
-        if offline_groups:
-            for save_path, batches in offline_groups.items():
-                # 按年月分类存储
-                save_path = add_year_month_to_path(init.bot_config.get('rsshub', {}).get('javbus', {}).get('sort_by_year_month', False), save_path)
-                if save_path not in save_path_list:
-                    save_path_list.append(save_path)
-                for batch_tasks in batches:
-                    task_count = len(batch_tasks.split('\n'))
-                    offline2115(batch_tasks, task_count, save_path)
-        else:
-            init.logger.warn("JavBus离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-            add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/male023.png", "JavBus离线任务未执行，可能是115离线配额不足，请检查115账号状态！")
-            return
-
-    # 等待离线完成
-    time.sleep(300)
-
-    # 获取离线任务状态
-    offline_task_status = init.openapi_115.get_offline_tasks()
-    time_stamp = int(time.time())
-    success_task = []
-    total_success = 0
-    total_offline = len(check_results)
-    for item in check_results:
-        magnet = item['magnet']
-        save_path = add_year_month_to_path(init.bot_config.get('rsshub', {}).get('javbus', {}).get('sort_by_year_month', False), item['save_path'])
-        image_path = item['poster_url']
-        
-        for task in offline_task_status:
-            if task['url'] == magnet:
-                if task['status'] == 2 and task['percentDone'] == 100:
-                    javbus_success_proccesser(item, save_path, task)
-                    success_task.append({"task": task, "save_path": save_path})
-                    total_success += 1
-                    images.append(image_path)
-                else:
-                    init.logger.warn(f"{item['title']} 离线下载失败或未完成。")
-                    # 删除离线失败的文件
-                    init.openapi_115.del_offline_task(task['info_hash'])
-                break
-    
-    # 等待消息队列处理完成
-    wait_for_message_queue_completion("JavBus")
-    
-    # 生成汇总消息
-    message = escape_markdown(f"JavBus订阅任务完成情况: {total_success}/{total_offline}", version=2) 
-    if total_success > 0:
-        add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/rss_javbus.jpg", message)
-    else:
-        add_task_to_queue(init.bot_config['allowed_user'], f"{init.IMAGE_PATH}/teacher_pto.jpg", message)
-            
-    # 删除垃圾文件
-    for path in save_path_list:
-        init.openapi_115.auto_clean_all(path)
-        # 创建软链
-        result = init.openapi_115.find_all_voideos(path, success_task, time_stamp)
-        generate_strm_file(result)
-        
-    # 删除本地临时文件
-    del_images(images)
-        
-    # 清空已完成的离线任务
-    init.openapi_115.clear_cloud_task()
-
-
 def javbus_success_proccesser(item, save_path, task):
     id = item['id']
     title = item['title']
@@ -726,10 +345,7 @@ def javbus_success_proccesser(item, save_path, task):
     poster_url = item['poster_url']
     
     # 更新数据库状态
-    with SqlLiteLib() as sqlite:
-        sql_update = "UPDATE javbus SET is_download=1 WHERE id=?"
-        params_update = (id,)
-        sqlite.execute_sql(sql_update, params_update)
+    status_updates.add("javbus", "is_download=1", id)
         
     init.logger.info(f"{title} 离线下载成功！")
     
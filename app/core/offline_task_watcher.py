@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import threading
+import init
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError, wait as wait_futures
+from app.core.offline_task_index import offline_task_key, is_task_success
+
+# 离线任务的最终状态
+TASK_SUCCESS = "success"
+TASK_FAILED = "failed"
+TASK_TIMEOUT = "timeout"
+
+# 轮询间隔(秒)：有状态变化或新任务时回到最小间隔，否则逐步放大到最大间隔
+DEFAULT_MIN_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 60
+DEFAULT_BACKOFF_FACTOR = 1.5
+# 批量等待离线任务的默认截止时间(秒)
+DEFAULT_WAIT_TIMEOUT = 300
+
+
+def task_state(task):
+    """根据任务信息判断状态，未结束返回None；成功与否与 is_task_success 保持一致"""
+    if not task:
+        return None
+    if is_task_success(task):
+        return TASK_SUCCESS
+    if task['status'] == -1:
+        return TASK_FAILED
+    return None
+
+
+class _Watch:
+    def __init__(self, deadline):
+        self.future = Future()
+        self.deadline = deadline
+        self.last_task = None
+
+
+class OfflineTaskWatcher:
+    """
+    115离线任务完成监听器
+
+    所有调用方共享一个后台线程轮询离线任务列表（通过 OfflineTaskIndex 增量刷新），
+    同一个任务的多个调用方共享同一个Future，任务成功、失败或超过所有调用方的最长等待时间后完成。
+    Future的结果为 (state, task)，state 为 TASK_SUCCESS / TASK_FAILED / TASK_TIMEOUT。
+    """
+
+    def __init__(self, index, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        self._index = index
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self._watches = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._interval = min_interval
+        # 统计信息
+        self.poll_count = 0
+
+    @classmethod
+    def from_config(cls, index):
+        """根据配置创建监听器"""
+        wait_config = init.bot_config.get('offline_wait') or {}
+        return cls(
+            index,
+            min_interval=float(wait_config.get('min_interval', DEFAULT_MIN_INTERVAL)),
+            max_interval=float(wait_config.get('max_interval', DEFAULT_MAX_INTERVAL))
+        )
+
+    def watch(self, url, timeout=300):
+        """开始监听任务（磁力链接、info_hash或其他离线链接），返回共享的Future"""
+        key = offline_task_key(url)
+        deadline = time.time() + timeout
+        with self._cond:
+            watch = self._watches.get(key)
+            if watch is None or watch.future.done():
+                watch = _Watch(deadline)
+                self._watches[key] = watch
+            else:
+                watch.deadline = max(watch.deadline, deadline)
+            # 有新的监听时立即进入高频轮询
+            self._interval = self.min_interval
+            self._ensure_thread()
+            self._cond.notify()
+        return watch.future
+
+    def wait(self, url, timeout=300):
+        """阻塞等待任务结束，返回 (state, task)"""
+        future = self.watch(url, timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return TASK_TIMEOUT, self.last_seen(url)
+
+    async def wait_async(self, url, timeout=300):
+        """协程版本的wait，等待期间不阻塞事件循环"""
+        future = asyncio.wrap_future(self.watch(url, timeout))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return TASK_TIMEOUT, self.last_seen(url)
+
+    def wait_all(self, urls, timeout=DEFAULT_WAIT_TIMEOUT):
+        """
+        等待一批任务全部结束或到达截止时间
+        :return: {url: (state, task)}，到截止时间仍未结束的任务state为TASK_TIMEOUT
+        """
+        futures = {url: self.watch(url, timeout) for url in dict.fromkeys(urls) if url}
+        wait_futures(list(futures.values()), timeout=timeout)
+        results = {}
+        for url, future in futures.items():
+            if future.done():
+                results[url] = future.result()
+            else:
+                results[url] = (TASK_TIMEOUT, self.last_seen(url))
+        return results
+
+    def last_seen(self, url):
+        """最近一次轮询看到的任务信息"""
+        with self._cond:
+            watch = self._watches.get(offline_task_key(url))
+        if watch and watch.last_task:
+            return watch.last_task
+        return self._index.get(url)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="offline-task-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._watches:
+                    self._cond.wait()
+                keys = list(self._watches)
+
+            changed = self._poll(keys)
+
+            with self._cond:
+                if changed:
+                    self._interval = self.min_interval
+                else:
+                    self._interval = min(self._interval * self.backoff_factor, self.max_interval)
+                # 不要睡过最早的截止时间
+                now = time.time()
+                deadlines = [w.deadline - now for w in self._watches.values()]
+                interval = min([self._interval] + [max(d, 0) for d in deadlines])
+                if self._watches:
+                    self._cond.wait(interval)
+
+    def _poll(self, keys):
+        """刷新一次任务列表并完成已结束的监听，返回是否有状态变化"""
+        # 只要求已经在列表中的任务必须拿到最新状态，新添加的任务会出现在第一页
+        known = {key for key in keys if self._index.get(key)}
+        try:
+            self._index.refresh(until_seen=known)
+        except Exception as e:
+            init.logger.warn(f"刷新离线任务状态失败: {e}")
+        self.poll_count += 1
+
+        changed = False
+        now = time.time()
+        finished = []
+        with self._cond:
+            for key in keys:
+                watch = self._watches.get(key)
+                if watch is None:
+                    continue
+                task = self._index.get(key)
+                if task is not None and task != watch.last_task:
+                    changed = True
+                    watch.last_task = task
+                state = task_state(task)
+                if state is None and now >= watch.deadline:
+                    state = TASK_TIMEOUT
+                if state is not None:
+                    del self._watches[key]
+                    finished.append((watch, state, watch.last_task))
+        for watch, state, task in finished:
+            watch.future.set_result((state, task))
+        return changed
+
+    def pending(self):
+        """正在监听的任务数"""
+        with self._cond:
+            return len(self._watches)
+
+
+def wait_offline_tasks(urls, timeout=None):
+    """
+    等待刚提交的离线任务结束：轮询间隔逐步放大，全部结束或到达截止时间（offline_wait.timeout）后立即返回
+    :return: {url: (state, task)}
+    """
+    if timeout is None:
+        timeout = float((init.bot_config.get('offline_wait') or {}).get('timeout', DEFAULT_WAIT_TIMEOUT))
+    urls = [url for url in urls if url]
+    if not urls:
+        return {}
+    start = time.time()
+    results = init.offline_task_watcher.wait_all(urls, timeout)
+    finished = sum(1 for state, _ in results.values() if state != TASK_TIMEOUT)
+    init.logger.info(f"离线任务等待结束: {finished}/{len(urls)}个已结束, 耗时{time.time() - start:.0f}秒")
+    return results
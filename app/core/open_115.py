@@ -1,10 +1,13 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import base64
 import hashlib
 import re
 import sys
 import threading
+import atexit
 current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
@@ -19,10 +22,45 @@ from pathlib import Path
 from functools import wraps
 from app.utils.message_queue import add_task_to_queue
 from app.utils.alioss import upload_file_to_oss
+from app.utils.rate_limiter import TokenBucket
+from app.utils.path_cache import PathCache
+from app.utils.single_flight import SingleFlight
+from app.utils.file_hash import file_sha1, file_sha1_by_range
 from telegram.helpers import escape_markdown
 
 RISK_THRESHOLD = 0.95
 
+# HTTP连接池默认设置
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+
+# 限流默认设置：每秒2个令牌（与原先0.5s最小间隔一致）
+DEFAULT_RATE = 2.0
+DEFAULT_BURST = 2
+# 写操作类接口消耗更多令牌
+DEFAULT_ENDPOINT_WEIGHTS = {
+    "/open/offline/add_task_urls": 2,
+    "/open/ufile/delete": 2,
+    "/open/offline/clear_task": 2
+}
+
+# 路径缓存默认设置
+DEFAULT_CACHE_MAX_SIZE = 5000
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+DEFAULT_CACHE_NEGATIVE_TTL = 60
+# 非业务错误（风控、HTTP错误、token失效）不做负缓存
+NO_NEGATIVE_CACHE_CODES = {-1, 40140125, 40140116, 40140119}
+# 合并的只读请求，写操作之后丢弃进行中的请求，避免写之后发起的调用拿到写之前的结果
+FILE_READ_REQUESTS = ("get_file_info", "get_file_list")
+OFFLINE_READ_REQUESTS = ("get_offline_tasks", "get_offline_tasks_by_page")
+
+
+def request_name(key):
+    """合并请求的key为 名称 或 (名称, 参数)"""
+    return key[0] if isinstance(key, tuple) else key
+
 def handle_token_expiry(func):
     """装饰器：统一处理API调用中的token过期情况"""
     @wraps(func)
@@ -84,10 +122,95 @@ class OpenAPI_115:
         self.lifetime_vip = False
         self.request_count = 0
         self.lock = threading.Lock()
-        self.last_req_time = 0
-        self.file_info_cache = {}
-        self.cache_hit = 0
+        # 所有线程共享115请求配额的令牌桶
+        self.rate_limiter = self._create_rate_limiter()
+        # 路径 -> 文件信息缓存
+        self.path_cache = self._create_path_cache()
+        # 合并并发的相同只读请求，共享同一次HTTP调用的结果
+        self.single_flight = SingleFlight()
+        # 写操作之后需要丢弃进行中请求的请求合并，协程客户端创建时加入自己的
+        self.single_flights = [self.single_flight]
+        # 所有线程共享的长连接会话，避免每次请求重新握手
+        self.session, self.timeout = self._create_session()
         self.get_token()  # 初始化时获取token
+
+    @staticmethod
+    def _create_session():
+        """创建带连接池和连接重试的HTTP会话"""
+        http_config = init.bot_config.get('115_http') or {}
+        pool_size = int(http_config.get('pool_size', DEFAULT_POOL_SIZE))
+        max_retries = int(http_config.get('max_retries', DEFAULT_MAX_RETRIES))
+        connect_timeout = float(http_config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT))
+        read_timeout = float(http_config.get('read_timeout', DEFAULT_READ_TIMEOUT))
+        # 连接被重置/建立失败时重试；读超时只对GET重试，避免POST（如添加离线任务）重复提交
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=0,
+            backoff_factor=0.5,
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session, (connect_timeout, read_timeout)
+
+    @staticmethod
+    def _create_rate_limiter():
+        """根据配置创建令牌桶限流器"""
+        limit_config = init.bot_config.get('115_rate_limit') or {}
+        weights = dict(DEFAULT_ENDPOINT_WEIGHTS)
+        weights.update(limit_config.get('weights') or {})
+        return TokenBucket(
+            rate=float(limit_config.get('rate', DEFAULT_RATE)),
+            burst=float(limit_config.get('burst', DEFAULT_BURST)),
+            weights=weights
+        )
+
+    @staticmethod
+    def _create_path_cache():
+        """根据配置创建路径缓存，并加载上次保存的快照"""
+        cache_config = init.bot_config.get('path_cache') or {}
+        path_cache = PathCache(
+            max_size=int(cache_config.get('max_size', DEFAULT_CACHE_MAX_SIZE)),
+            ttl=float(cache_config.get('ttl', DEFAULT_CACHE_TTL)),
+            negative_ttl=float(cache_config.get('negative_ttl', DEFAULT_CACHE_NEGATIVE_TTL)),
+            snapshot_file=init.PATH_CACHE_FILE if cache_config.get('persist', True) else None
+        )
+        if path_cache.snapshot_file:
+            try:
+                loaded = path_cache.load()
+                init.logger.info(f"已加载115路径缓存快照: {loaded}条")
+            except Exception as e:
+                init.logger.warn(f"加载115路径缓存快照失败: {e}")
+            atexit.register(OpenAPI_115._save_path_cache, path_cache)
+        return path_cache
+
+    @staticmethod
+    def _save_path_cache(path_cache):
+        try:
+            path_cache.save()
+        except Exception as e:
+            init.logger.warn(f"保存115路径缓存快照失败: {e}")
+
+    def save_path_cache(self):
+        """保存路径缓存快照"""
+        self._save_path_cache(self.path_cache)
+
+    def _forget_file_reads(self):
+        """文件写操作之后调用，与路径缓存失效配合；同步、协程客户端进行中的请求一并丢弃"""
+        for single_flight in self.single_flights:
+            single_flight.forget(lambda key: request_name(key) in FILE_READ_REQUESTS)
+
+    def _forget_offline_reads(self):
+        """离线任务添加、删除之后调用，离线任务索引的刷新同样重新发起"""
+        for single_flight in self.single_flights:
+            single_flight.forget(lambda key: request_name(key) in OFFLINE_READ_REQUESTS)
+        if init.offline_task_index:
+            init.offline_task_index.invalidate()
         
     def get_token(self):
         if not self.refresh_token or not self.access_token:
@@ -124,7 +247,7 @@ class OpenAPI_115:
             "code_challenge": challenge,
             "code_challenge_method": "sha256"
         }
-        response = requests.post(f"https://passportapi.115.com/open/authDeviceCode", headers=header, data=data)
+        response = self.session.post(f"https://passportapi.115.com/open/authDeviceCode", headers=header, data=data, timeout=self.timeout)
         res = response.json()
         if response.status_code == 200:
             uid = res['data']['uid']
@@ -161,7 +284,8 @@ class OpenAPI_115:
             "sign": sign
         }
         while True:
-            response = requests.get(f"https://qrcodeapi.115.com/get/status/", params=params)
+            # 状态接口为长轮询，读超时需要放宽
+            response = self.session.get(f"https://qrcodeapi.115.com/get/status/", params=params, timeout=(self.timeout[0], 120))
             if response.status_code == 200:
                 res = response.json()
                 if res['state'] == 0:
@@ -180,10 +304,10 @@ class OpenAPI_115:
                         # 2.扫码成功，获取access_token
                         init.logger.info("二维码扫码成功，正在获取access_token...")
                         time.sleep(1)
-                        response = requests.post("https://passportapi.115.com/open/deviceCodeToToken", headers=header, data={
+                        response = self.session.post("https://passportapi.115.com/open/deviceCodeToToken", headers=header, data={
                             "uid": uid,
                             "code_verifier": verifier
-                        })
+                        }, timeout=self.timeout)
                         res = response.json()
                         if response.status_code == 200 and 'data' in res:
                             self.access_token = res['data']['access_token']
@@ -205,6 +329,10 @@ class OpenAPI_115:
         return "", ""
 
     def refresh_access_token(self):
+        # 多个线程同时遇到token过期时只刷新一次
+        return self.single_flight.do("refresh_access_token", self._refresh_access_token)
+
+    def _refresh_access_token(self):
         # 1. 尝试从文件加载最新Token
         file_access_token, file_refresh_token = self._load_token_from_file()
         
@@ -236,7 +364,7 @@ class OpenAPI_115:
         }
         
         try:
-            response = requests.post(url, headers=header, data=data)
+            response = self.session.post(url, headers=header, data=data, timeout=self.timeout)
             res = response.json()
         except Exception as e:
             init.logger.warn(f"刷新Token请求异常: {e}")
@@ -265,28 +393,22 @@ class OpenAPI_115:
 
     def _make_api_request(self, method: str, url: str, params=None, data=None, headers=None):
         """统一的API请求方法"""
+        # 1. 检查风控计数
         with self.lock:
-            # 1. 检查风控计数
             if self.check_risk():
                 return {"code": -1, "message": "今日请求即将到达上限！请明日再试！"}
-            
-            # 2. 智能流控：确保请求间隔至少 0.5s (即最大 2 QPS)
-            min_interval = 0.5
-            current_time = time.time()
-            elapsed = current_time - self.last_req_time
-            
-            if elapsed < min_interval:
-                time.sleep(min_interval - elapsed)
-            
-            self.last_req_time = time.time()
-            
-            if headers is None:
-                headers = self._get_headers()
+        
+        # 2. 令牌桶流控：在锁外等待，多个线程按先后顺序共享请求配额
+        endpoint = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        self.rate_limiter.acquire(self.rate_limiter.get_weight(endpoint))
+        
+        if headers is None:
+            headers = self._get_headers()
         
         if method.upper() == 'GET':
-            response = requests.get(url, headers=headers, params=params)
+            response = self.session.get(url, headers=headers, params=params, timeout=self.timeout)
         elif method.upper() == 'POST':
-            response = requests.post(url, headers=headers, data=data)
+            response = self.session.post(url, headers=headers, data=data, timeout=self.timeout)
         else:
             raise ValueError(f"不支持的HTTP方法: {method}")
         if response.status_code == 200:
@@ -298,28 +420,34 @@ class OpenAPI_115:
     @handle_token_expiry
     def get_file_info(self, path: str):
         # 优先从缓存获取
-        if path in self.file_info_cache:
-            data = self.file_info_cache[path]
-            # 直接从缓存中获取
+        found, data = self.path_cache.get(path)
+        if found:
+            # data为None表示路径不存在（负缓存）
             init.logger.debug(f"Cache hit for {path}")
-            self.cache_hit += 1
             return data
 
-
         url = f"{self.base_url}/open/folder/get_info"
         params = {"path": path}
-        response = self._make_api_request('GET', url, params=params)
+        # 查询期间发生写操作时不写入缓存
+        generation = self.path_cache.generation
+        # 并发查询同一路径时只发起一次请求
+        response = self.single_flight.do(("get_file_info", PathCache.normalize(path)),
+                                         self._make_api_request, 'GET', url, params=params)
         
         # 如果成功获取文件信息，记录日志
         if isinstance(response, dict) and response.get('code') == 0:
             init.logger.debug(f"获取文件信息成功: {response}")
             # 更新缓存
-            self.file_info_cache[path] = (response['data'])
+            self.path_cache.set(path, response['data'], generation=generation)
             return response['data']
         else:
             init.logger.warn(f"获取文件信息失败: {response}")
             if response['code'] == 40140125:
                 return response
+            # 只有115明确返回业务错误（路径不存在）才记录负缓存
+            if isinstance(response, dict) and response.get('code', 0) not in NO_NEGATIVE_CACHE_CODES \
+                    and response.get('code', 0) >= 1000:
+                self.path_cache.set_missing(path, generation=generation)
             return None
         
     @handle_token_expiry
@@ -353,6 +481,7 @@ class OpenAPI_115:
         response = self._make_api_request('POST', url, data=data, headers=self._get_headers())
         if response['state'] == True:
             init.logger.info(f"离线下载任务添加成功: {response['message']}")
+            self._forget_offline_reads()
             return True
         else:
             init.logger.warn(f"离线下载任务添加失败: {response['message']}")
@@ -374,6 +503,8 @@ class OpenAPI_115:
             # Create directory might have lag, retry getting info
             if not file_info:
                 for _ in range(3):
+                    # 跳过负缓存，确保每次重试都真正请求115
+                    self.path_cache.invalidate(save_path)
                     file_info = self.get_file_info(save_path)
                     if file_info:
                         break
@@ -386,6 +517,7 @@ class OpenAPI_115:
         response = self._make_api_request('POST', url, data=data, headers=self._get_headers())
         if response['state'] == True:
             init.logger.info(f"离线下载任务添加成功: {response}")
+            self._forget_offline_reads()
             return True
         else:
             if response['code'] == 40140125:
@@ -397,7 +529,8 @@ class OpenAPI_115:
     def get_offline_tasks_by_page(self, page=1):
         url = f"{self.base_url}/open/offline/get_task_list"
         params = {"page": page}
-        response = self._make_api_request('GET', url, params=params)
+        response = self.single_flight.do(("get_offline_tasks_by_page", page),
+                                         self._make_api_request, 'GET', url, params=params)
         if isinstance(response, dict) and response.get('code') == 0 and 'data' in response:
             return response['data'] 
         else:
@@ -409,6 +542,13 @@ class OpenAPI_115:
     
     @handle_token_expiry
     def get_offline_tasks(self):
+        # 多个线程同时拉取任务列表时共享同一次翻页结果
+        task_list = self.single_flight.do("get_offline_tasks", self._get_offline_tasks)
+        if isinstance(task_list, list):
+            return list(task_list)
+        return task_list
+
+    def _get_offline_tasks(self):
         url = f"{self.base_url}/open/offline/get_task_list"
         response = self._make_api_request('GET', url)
         task_list = []
@@ -418,17 +558,7 @@ class OpenAPI_115:
                 tasks = self.get_offline_tasks_by_page(i)
                 if tasks and 'tasks' in tasks:
                     for task in tasks['tasks']:
-                        task_list.append({
-                            'name': task['name'],
-                            'url': task['url'],
-                            'status': task['status'],
-                            'percentDone': task['percentDone'],
-                            'info_hash': task['info_hash'],
-                            'file_id': task['file_id'],               # 最终目录id
-                            'wp_path_id': task['wp_path_id'],         # 下载目录id
-                            'delete_file_id': task['delete_file_id']  # 同file_id
-                        })
-                time.sleep(2)  # 避免请求过快
+                        task_list.append(format_offline_task(task))
             return task_list  
         else:
             init.logger.warn(f"获取离线下载任务列表失败: {response}")
@@ -447,6 +577,7 @@ class OpenAPI_115:
         }
         response = self._make_api_request('POST', url, data=data, headers=self._get_headers())
         if response['state'] == True:
+            self._forget_offline_reads()
             if del_source_file == 1:
                 init.logger.info(f"清理失败的离线下载任务成功!")
             else:
@@ -482,6 +613,7 @@ class OpenAPI_115:
         response = self._make_api_request('POST', url, data=data, headers=self._get_headers())
         if response['state'] == True:
             init.logger.info(f"文件复制成功: [{source_path}] -> [{target_path}]")
+            self._forget_file_reads()
             return True
         else:
             init.logger.warn(f"文件复制失败: {response['message']}")
@@ -507,23 +639,14 @@ class OpenAPI_115:
         if response['state'] == True:
             init.logger.info(f"文件重命名成功: [{old_name}] -> [{new_name}]")
             
-            # 1. 清除旧名称缓存
-            if old_name in self.file_info_cache:
-                del self.file_info_cache[old_name]
+            # 1. 清除旧名称及其子路径的缓存
+            self.path_cache.invalidate_prefix(old_name)
             
             # 2. 关键修复：清除新名称可能存在的全部缓存
             # 避免因缓存了旧同名目录的ID，导致get_files_from_dir获取到错误的文件列表
-            try:
-                # 获取父目录
-                parent_dir = str(Path(old_name).parent)
-                full_new_path = f"{parent_dir}/{new_name}"
-                
-                # 如果新路径在缓存中（可能是旧的ID），必须清除
-                if full_new_path in self.file_info_cache:
-                    init.logger.info(f"发现新名称[{full_new_path}]的脏缓存，正在清除...")
-                    del self.file_info_cache[full_new_path]
-            except Exception as e:
-                init.logger.warn(f"清除新名称缓存异常: {e}")
+            parent_dir = str(Path(old_name).parent)
+            self.path_cache.invalidate_prefix(f"{parent_dir}/{new_name}")
+            self._forget_file_reads()
                 
             return True
         else:
@@ -544,21 +667,16 @@ class OpenAPI_115:
         if response['state'] == True:
             init.logger.info(f"文件重命名成功: [{old_name}] -> [{new_name}]")
             
-            # 1. 清除旧名称缓存
-            if old_name in self.file_info_cache:
-                del self.file_info_cache[old_name]
+            # 1. 清除旧名称缓存（按ID清除，old_name不一定是全路径）
+            self.path_cache.invalidate_file_id(file_id)
             
             # 2. 清除新名称缓存（防止脏数据）
-            try:
-                # 尝试推断父目录（虽然rename_by_id不一定能准确拿到父path，但如果有old_name是全路径则可以）
-                if "/" in old_name:
-                    parent_dir = str(Path(old_name).parent)
-                    full_new_path = f"{parent_dir}/{new_name}"
-                    if full_new_path in self.file_info_cache:
-                        init.logger.info(f"同时清除新名称[{full_new_path}]的缓存")
-                        del self.file_info_cache[full_new_path]
-            except Exception as e:
-                init.logger.warn(f"清除新名称缓存异常: {e}")
+            # 尝试推断父目录（虽然rename_by_id不一定能准确拿到父path，但如果有old_name是全路径则可以）
+            if "/" in old_name:
+                self.path_cache.invalidate_prefix(old_name)
+                parent_dir = str(Path(old_name).parent)
+                self.path_cache.invalidate_prefix(f"{parent_dir}/{new_name}")
+            self._forget_file_reads()
                 
             return True
         else:
@@ -571,7 +689,8 @@ class OpenAPI_115:
     def get_file_list(self, params):
         """获取指定目录下的所有文件"""
         url = f"{self.base_url}/open/ufile/files"
-        response = self._make_api_request('GET', url, params=params, headers=self._get_headers())
+        response = self.single_flight.do(("get_file_list", tuple(sorted(params.items()))),
+                                         self._make_api_request, 'GET', url, params=params)
         
         if isinstance(response, dict) and response.get('code') == 0:
             init.logger.debug(f"获取文件列表成功: {response}")
@@ -604,6 +723,7 @@ class OpenAPI_115:
             #    或者该目录曾存在->删除->重建，那么缓存中的旧 ID 必须清除。
             #    由于无法根据 pid 轻易拼出完整路径，这里无法像 rename 那样精确清除。
             #    建议调用 create_directory 的地方，如果涉及到完整路径的缓存，手动清除。
+            self._forget_file_reads()
             
             return response.get('data') or True
         elif response.get('code') == 20004:
@@ -625,6 +745,9 @@ class OpenAPI_115:
         response = self._make_api_request('POST', url, data=data, headers=self._get_headers())
         if response['state'] == True:
             init.logger.info(f"文件或目录删除成功: {file_ids}")
+            for file_id in str(file_ids).split(","):
+                self.path_cache.invalidate_file_id(file_id)
+            self._forget_file_reads()
             return True
         else:
             init.logger.warn(f"文件或目录删除失败: {response}")
@@ -681,8 +804,8 @@ class OpenAPI_115:
         response = self._make_api_request('POST', url, data=data, headers=self._get_headers())
         if response['state'] == True:
             init.logger.info(f"文件(夹)删除成功: {path}")
-            if path in self.file_info_cache:
-                del self.file_info_cache[path]
+            self.path_cache.invalidate_prefix(path)
+            self._forget_file_reads()
             return True
         else:
             init.logger.warn(f"文件(夹)删除失败: {response['message']}")
@@ -910,6 +1033,7 @@ class OpenAPI_115:
         response = self._make_api_request('POST', url, data=data)
         if response['state'] == True:
             init.logger.info(f"清理云端任务成功！")
+            self._forget_offline_reads()
             return True
         else:
             init.logger.warn(f"清理云端任务失败: {response['message']}")
@@ -926,19 +1050,8 @@ class OpenAPI_115:
         copy_result = self.copy_file(source_path, target_path)
         if copy_result == True:
             # 2. 清除目标位置可能存在的旧缓存（因为现在有了新文件）
-            try:
-                # 获取源文件/目录名称
-                msg_filename = os.path.basename(source_path.rstrip('/'))
-                
-                # 构造目标完整路径
-                target_path_clean = target_path.rstrip('/')
-                full_new_path = f"{target_path_clean}/{msg_filename}"
-                
-                if full_new_path in self.file_info_cache:
-                    init.logger.info(f"清除移动目标位置[{full_new_path}]的缓存")
-                    del self.file_info_cache[full_new_path]
-            except Exception as e:
-                init.logger.warn(f"清除移动目标缓存异常: {e}")
+            msg_filename = os.path.basename(source_path.rstrip('/'))
+            self.path_cache.invalidate_prefix(f"{target_path.rstrip('/')}/{msg_filename}")
 
             # 3. 执行删除源文件
             # delete_single_file 内部已经处理了 source_path 的缓存清除
@@ -956,7 +1069,9 @@ class OpenAPI_115:
     def clear_request_count(self):
         """清除请求计数"""
         self.request_count = 0
-        self.cache_hit = 0
+        self.path_cache.reset_stats()
+        self.single_flight.reset_metrics()
+        self.rate_limiter.reset_metrics()
         
     def welcome_message(self):
         """欢迎消息"""
@@ -983,26 +1098,17 @@ class OpenAPI_115:
 
 
     def check_offline_download_success(self, url, offline_timeout=300):
-        time_out = 0
-        task_name = ""
-        info_hash = ""
-        while time_out < offline_timeout:
-            tasks = self.get_offline_tasks()
-            if not tasks:
-                return False, "", ""
-            for task in tasks:
-                # 判断任务的URL是否匹配
-                if task.get('url') == url:
-                    task_name = task.get('name', '')
-                    info_hash = task.get('info_hash', '')
-                    # 检查任务状态
-                    if task.get('status') == 2 or task.get('percentDone') == 100:
-                        return True, task_name, info_hash
-                    else:
-                        time.sleep(10)
-                        time_out += 10
-                    break
-        init.logger.warn(f"[{task_name}]离线下载超时!")
+        # 由共享的后台监听器轮询任务列表，这里只等待结果
+        from app.core.offline_task_watcher import TASK_SUCCESS, TASK_FAILED
+        state, task = init.offline_task_watcher.wait(url, offline_timeout)
+        task_name = task.get('name', '') if task else ""
+        info_hash = task.get('info_hash', '') if task else ""
+        if state == TASK_SUCCESS:
+            return True, task_name, info_hash
+        if state == TASK_FAILED:
+            init.logger.warn(f"[{task_name}]离线下载失败!")
+        else:
+            init.logger.warn(f"[{task_name}]离线下载超时!")
         return False, task_name, info_hash
     
     # def check_offline_download_success(self, url, offline_timeout=180):
@@ -1094,7 +1200,8 @@ class OpenAPI_115:
             init.logger.warn(f"获取目录信息失败: {path}")
             return False
         
-        # 创建文件夹
+        # 创建文件夹，清除新目录可能存在的负缓存
+        self.path_cache.invalidate(f"{path}/{floder_name}")
         return self.create_directory(file_info['file_id'], floder_name)
         
     
@@ -1375,8 +1482,7 @@ class OpenAPI_115:
     def create_dir_recursive(self, path):
         """递归创建目录"""
         # 清除目标路径缓存，确保状态最新
-        if path in self.file_info_cache:
-            del self.file_info_cache[path]
+        self.path_cache.invalidate(path)
 
         res = self.get_file_info(path)
         if res:
@@ -1391,8 +1497,7 @@ class OpenAPI_115:
         
         for index, item in enumerate(path_list):
             # 同样清除沿途路径缓存
-            if item in self.file_info_cache:
-                del self.file_info_cache[item]
+            self.path_cache.invalidate(item)
 
             res = self.get_file_info(item)  # 确保目录存在
             if res:
@@ -1454,7 +1559,7 @@ class OpenAPI_115:
                 if current_info:
                     final_info = current_info
                     # 关键：更新缓存！
-                    self.file_info_cache[item] = final_info
+                    self.path_cache.set(item, final_info)
                     last_path = item
                     init.logger.info(f"目录[{item}]检查/创建/获取成功, ID: {final_info.get('file_id')}")
                 else:
@@ -1500,10 +1605,6 @@ class OpenAPI_115:
         challenge = base64.urlsafe_b64encode(sha256_hash).rstrip(b'=').decode('utf-8')
         return verifier, challenge
     
-def file_sha1(file_path):
-    with open(file_path, 'rb') as f:
-        return hashlib.sha1(f.read()).hexdigest()
-    
 def sha1_digest(file_path):
     h = hashlib.sha1()
     with Path(file_path).open('rb') as f:
@@ -1515,28 +1616,25 @@ def sha1_digest(file_path):
 
 def calculate_sha1(file_path):
     """计算文件的SHA1哈希值"""
-    sha1 = hashlib.sha1()
     try:
-        with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(8192)
-                if not chunk:
-                    break
-                sha1.update(chunk)
-        return sha1.hexdigest()
+        return file_sha1(file_path)
     except FileNotFoundError:
         init.logger.error(f"错误：文件未找到 -> {file_path}")
         return None
-    
-def file_sha1_by_range(file_path, start, end):
-    """计算文件从start到end（含end）的SHA1"""
-    size = end - start + 1
-    sha1 = hashlib.sha1()
-    with open(file_path, "rb") as f:
-        f.seek(start)
-        data = f.read(size)
-        sha1.update(data)
-    return sha1.hexdigest()
+
+
+def format_offline_task(task):
+    """提取离线任务中需要的字段"""
+    return {
+        'name': task['name'],
+        'url': task['url'],
+        'status': task['status'],
+        'percentDone': task['percentDone'],
+        'info_hash': task['info_hash'],
+        'file_id': task['file_id'],               # 最终目录id
+        'wp_path_id': task['wp_path_id'],         # 下载目录id
+        'delete_file_id': task['delete_file_id']  # 同file_id
+    }
 
 
 def get_parent_paths(path):
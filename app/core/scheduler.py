@@ -45,8 +45,12 @@ def get_sync_time(category):
 def clear_request_count():
     """清除115请求计数"""
     init.logger.info(f"昨日累计115 OpenAPI请求次数: [{init.openapi_115.request_count}]")
-    cache_hit_rate = (init.openapi_115.cache_hit / init.openapi_115.request_count * 100) if init.openapi_115.request_count > 0 else 0
-    init.logger.info(f"昨日累计115 缓存命中率: [{cache_hit_rate:.2f}%]")
+    cache_stats = init.openapi_115.path_cache.stats()
+    init.logger.info(f"昨日累计115 缓存命中率: [{cache_stats['hit_rate']:.2f}%], 命中[{cache_stats['hits']}], 负缓存命中[{cache_stats['negative_hits']}], 未命中[{cache_stats['misses']}], 淘汰[{cache_stats['evictions']}], 过期[{cache_stats['expirations']}], 当前条目[{cache_stats['size']}/{cache_stats['max_size']}]")
+    init.openapi_115.save_path_cache()
+    init.logger.info(f"昨日115合并重复请求: [{init.openapi_115.single_flight.coalesced}]次")
+    limiter_metrics = init.openapi_115.rate_limiter.metrics()
+    init.logger.info(f"昨日115限流等待: [{limiter_metrics['total_waited']}/{limiter_metrics['total_requests']}]次, 平均等待[{limiter_metrics['avg_wait_time']}s], 最长等待[{limiter_metrics['max_wait_time']}s]")
     init.logger.info("正在重置115请求计数...")
     init.openapi_115.clear_request_count()
     init.logger.info("115请求计数已重置！")
@@ -19,8 +19,9 @@ from urllib.parse import urlparse
 from urllib.parse import urlparse
 from app.core.offline_task_retry import sehua_offline
 from app.core.selenium_browser import SeleniumBrowser
-from app.utils.utils import get_magnet_hash, read_yaml_file, check_magnet
+from app.utils.utils import magnet_info_hash, read_yaml_file, check_magnet
 from app.utils.message_queue import add_task_to_queue
+from app.utils.temp_storage import SUBSYSTEM_SEHUA
 import asyncio
 import requests
 
@@ -107,8 +108,8 @@ async def download_image(image_url, save_path):
                     final_save_path = os.path.join(save_path, filename)
                     init.logger.debug(f"保存到: {final_save_path}")
                     
-                    with open(final_save_path, 'wb') as f:
-                        f.write(image_data)
+                    if not init.temp_storage.save_bytes(SUBSYSTEM_SEHUA, final_save_path, image_data):
+                        return False, "临时目录空间不足"
                     
                     file_size = len(image_data)
                     if os.path.exists(final_save_path) and file_size > 0:
@@ -383,7 +384,7 @@ async def parse_topic(section_name, html, url, date):
         
         # 下载图片到本地保存到tmp
         if result['post_url']:
-            success, local_path = await download_image(result['post_url'], f"{init.TEMP}/sehua")
+            success, local_path = await download_image(result['post_url'], init.temp_storage.subsystem_dir(SUBSYSTEM_SEHUA))
             if success:
                 init.logger.debug(f"图片已下载到: {local_path}")
                 result['image_path'] = local_path
@@ -653,71 +654,52 @@ def get_image_name(image_url):
 
 
 def save_sehua2db(results):
-    insert_count = 0
+    records = []
+    for result in results:
+        # 检查是否满足爬取策略
+        match_strategyed, specify_path = match_strategy(result)
+        if not match_strategyed:
+            continue
+        # 判断数据完整性
+        if not result.get('section_name') or \
+            not result.get('av_number') or \
+            not result.get('title') or \
+            not result.get('magnet') or \
+            not result.get('size') or \
+            not result.get('movie_type') or \
+            not result.get('post_url') or \
+            not result.get('publish_date') or \
+            not result.get('pub_url') or \
+            not specify_path or \
+            not result.get('image_path'):
+            init.logger.warn(f"数据不完整，跳过入库: {result}")
+            continue
+
+        if check_magnet(result.get('magnet')) is False:
+            init.logger.warn(f"[{result.get('magnet')}]磁力链接格式不正确，跳过入库!")
+            continue
+
+        records.append({
+            'section_name': result.get('section_name'),
+            'av_number': result.get('av_number'),
+            'title': result.get('title'),
+            'movie_type': result.get('movie_type'),
+            'size': result.get('size'),
+            'magnet': result.get('magnet'),
+            'post_url': result.get('post_url'),
+            'publish_date': result.get('publish_date'),
+            'pub_url': result.get('pub_url'),
+            'image_path': result.get('image_path'),
+            'save_path': specify_path,
+            # 通过info_hash去重（忽略tracker等参数差异）
+            'info_hash': magnet_info_hash(result.get('magnet'))
+        })
+    if not records:
+        return
     try:
         with SqlLiteLib() as sqlite:
-            for result in results:
-                # 检查是否满足爬取策略
-                match_strategyed, specify_path = match_strategy(result)
-                if not match_strategyed:
-                    continue
-                # 检查是否已存在（通过磁力链接Hash判断，忽略tracker等参数差异）
-                magnet_hash = get_magnet_hash(result.get('magnet'))
-                if magnet_hash:
-                    # 如果能提取到hash，使用模糊匹配查询
-                    sql_check = "select count(*) from sehua_data where magnet LIKE ?"
-                    params_check = (f'%{magnet_hash}%', )
-                else:
-                    # 提取不到hash，回退到完全匹配
-                    sql_check = "select count(*) from sehua_data where magnet = ?"
-                    params_check = (result.get('magnet'), )
-
-                count = sqlite.query_one(sql_check, params_check)
-                if count > 0:
-                    init.logger.info(f"[{result.get('title')}]检测到相同磁力链接(Hash: {magnet_hash})已存在，跳过入库！")
-                    continue  # 已存在，跳过
-                
-                # 判断数据完整性
-                if not result.get('section_name') or \
-                    not result.get('av_number') or \
-                    not result.get('title') or \
-                    not result.get('magnet') or \
-                    not result.get('size') or \
-                    not result.get('movie_type') or \
-                    not result.get('post_url') or \
-                    not result.get('publish_date') or \
-                    not result.get('pub_url') or \
-                    not specify_path or \
-                    not result.get('image_path'):
-                    init.logger.warn(f"数据不完整，跳过入库: {result}")
-                    continue
-                
-                if check_magnet(result.get('magnet')) is False:
-                    init.logger.warn(f"[{result.get('magnet')}]磁力链接格式不正确，跳过入库!")
-                    continue
-                
-                # 插入数据
-                insert_query = '''
-                INSERT INTO sehua_data (section_name, av_number, title, movie_type, size, magnet, post_url, publish_date, pub_url, image_path, save_path)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                '''
-                params_insert = (
-                        result.get('section_name'),
-                        result.get('av_number'),
-                        result.get('title'),
-                        result.get('movie_type'),
-                        result.get('size'),
-                        result.get('magnet'),
-                        result.get('post_url'),
-                        result.get('publish_date'),
-                        result.get('pub_url'),
-                        result.get('image_path'),
-                        specify_path
-                    )
-                sqlite.execute_sql(insert_query, params_insert)
-                insert_count += 1
-                
-            init.logger.info(f"涩花[{results[0].get('section_name')}]版块，[{results[0].get('publish_date')}]日，[{insert_count}]条数据入库成功!")
+            insert_count, skip_count = sqlite.bulk_insert('sehua_data', records)
+        init.logger.info(f"涩花[{results[0].get('section_name')}]版块，[{results[0].get('publish_date')}]日，[{insert_count}]条数据入库成功，[{skip_count}]条已存在跳过!")
     except Exception as e:
         init.logger.error(f"保存涩花数据到数据库时出错: {str(e)}")
         
@@ -812,4 +794,5 @@ if __name__ == "__main__":
     init.load_yaml_config()
     init.create_logger()
     init.init_db()
+    init.init_temp_storage()
     sehua_spider_by_date("2025-09-25")
\ No newline at end of file
@@ -9,6 +9,7 @@ from app.handlers.download_handler import create_strm_file, notice_emby_scan_lib
 from app.utils.message_queue import add_task_to_queue
 from app.utils.cover_capture import get_movie_cover
 from telegram.helpers import escape_markdown
+from app.core.offline_quota import submit_offline, PRIORITY_CRAWLER
 
 
 def get_tmdb_id(movie_name, page=1):
@@ -196,8 +197,10 @@ def download_from_link(download_url, movie_name, save_path):
     info_hash = ""
     try: 
         # 调用离线下载API，捕获可能的异常
-        offline_success = init.openapi_115.offline_download_specify_path(download_url, save_path)
-        if not offline_success:
+        offline_success, deferred = submit_offline([download_url], save_path, PRIORITY_CRAWLER)
+        if deferred:
+            init.logger.warn(f"离线配额不足，[{movie_name}]推迟到下次订阅检查")
+        elif not offline_success:
             init.logger.error(f"❌ 离线遇到错误！")
         else:
             init.logger.info(f"✅ [`{download_url}`]添加离线成功")
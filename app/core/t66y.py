@@ -344,45 +344,36 @@ async def pares_t66y_rss(rss_data, section_name, save_path, browser):
 def save2DB_t66y(results):
     if not results:
         return
-    insert_count = 0
-    section_name = ""
+    section_name = results[0].get("section_name", "")
+    records = [{
+        "section_name": result.get("section_name", ""),
+        "title": result.get("title", ""),
+        "movie_info": result.get("movie_info", ""),
+        "poster_url": result.get("poster_url", ""),
+        "magnet": result.get("magnet", ""),
+        "publish_date": result.get("publish_date", ""),
+        "pub_url": result.get("pub_url", ""),
+        "save_path": result.get("save_path", ""),
+        # 有info_hash时按info_hash去重
+        "info_hash": magnet_info_hash(result.get("magnet", ""))
+    } for result in results]
     with SqlLiteLib() as sqlite:
         try:
-            for result in results:
-                title = result.get("title", "")
-                pub_url = result.get("pub_url", "")
-                publish_date = result.get("publish_date", "")
-                movie_info = result.get("movie_info", "")
-                poster_url = result.get("poster_url", "")
-                magnet = result.get("magnet", "")
-                section_name = result.get("section_name", "")
-                save_path = result.get("save_path", "")
-                
-                # Check if exists
-                magnet_hash = get_magnet_hash(magnet)
-                if magnet_hash:
-                    # 如果能提取到hash，使用模糊匹配查询
-                    sql_check = "select count(*) from t66y where magnet LIKE ?"
-                    params_check = (f'%{magnet_hash}%', )
-                else:
-                    # 提取不到hash，回退到完全匹配
-                    sql_check = "select count(*) from t66y where magnet = ?"
-                    params_check = (magnet, )
-
-                count = sqlite.query_one(sql_check, params_check)
-                if count > 0:
-                    init.logger.info(f"[{title}]检测到相同磁力链接(Hash: {magnet_hash})已存在，跳过入库！")
-                    continue  # 已存在，跳过
-                
-                insert_sql = """
-                    INSERT INTO t66y (section_name, title, movie_info, poster_url, magnet, publish_date, pub_url, save_path)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                sqlite.execute_sql(insert_sql, (section_name, title, movie_info, poster_url, magnet, publish_date, pub_url, save_path))
-                insert_count += 1
-            init.logger.info(f"[{section_name}]板块新增入库 {insert_count} 条！")
+            # 提取不到info_hash的磁力链接回退到完全匹配
+            existing_magnets = sqlite.existing_values(
+                "t66y", "magnet", (record["magnet"] for record in records if not record["info_hash"]))
+            new_records = []
+            for record in records:
+                if not record["info_hash"]:
+                    if record["magnet"] in existing_magnets:
+                        continue
+                    existing_magnets.add(record["magnet"])
+                new_records.append(record)
+            records = new_records
+            insert_count, skip_count = sqlite.bulk_insert("t66y", records)
+            init.logger.info(f"[{section_name}]板块新增入库 {insert_count} 条，已存在跳过 {skip_count + len(results) - len(records)} 条！")
         except Exception as e:
-            init.logger.error(f"保存t66y资源到数据库失败: {e}, title: {result.get('title', 'unknown')}")
+            init.logger.error(f"保存t66y资源到数据库失败: {e}, section: {section_name}")
         
     
 def match_strategy(result):
@@ -1,64 +1,130 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import os
-import hashlib
 import math
+import hashlib
+import itertools
 from datetime import datetime
 from pathlib import Path
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import init
-from app.utils.fast_telethon import download_file_parallel
+from app.utils.fast_telethon import download_file_parallel, remove_part_bitmap, has_part_bitmap, TelegramFileStream, \
+    DEFAULT_THREADS, DEFAULT_PART_SIZE
+from app.utils.file_hash import file_sha1_async, StreamingSha1
+from app.utils.alioss import upload_stream_to_oss
+from app.utils.temp_storage import SUBSYSTEM_VIDEO, TempStorageError
+
+# 流式上传的最小文件大小，小文件直接下载到本地
+STREAM_MIN_SIZE = 10 * 1024 * 1024
+# 默认最大并发任务数
+DEFAULT_MAX_CONCURRENT_TASKS = 3
+# 等待临时目录空间时的重新检查间隔(秒)
+SPACE_RECHECK_INTERVAL = 30
 
 class VideoDownloadManager:
+    """
+    视频转存任务管理
+
+    固定数量的worker协程从优先队列中领取任务（可配置小文件优先），
+    需要下载到本地的任务在开始前向 init.temp_storage 预留空间，空间不足时等待其他任务完成。
+    """
+
     def __init__(self):
-        # 任务队列
-        self.queue = asyncio.Queue()
+        # 任务队列 (优先级, 序号, task_info)
+        self.queue = asyncio.PriorityQueue()
+        # 排队中的任务 {task_id: task_info}
+        self.queued_tasks = {}
         # 正在进行的任务 {task_id: task_info}
         self.active_tasks = {}
         # 最大并发数
-        self.max_concurrent_tasks = 3
-        # 当前并发数
-        self.current_tasks = 0
+        self.max_concurrent_tasks = DEFAULT_MAX_CONCURRENT_TASKS
+        # 小文件优先
+        self.small_first = False
         # 任务锁
         self.lock = asyncio.Lock()
-        
+        self._workers = set()
+        self._seq = itertools.count()
+
+    def _apply_config(self):
+        download_config = init.bot_config.get('video_download') or {}
+        self.small_first = bool(download_config.get('small_first', False))
+        self.set_max_concurrent_tasks(int(download_config.get('max_concurrent_tasks', DEFAULT_MAX_CONCURRENT_TASKS)))
+
+    def set_max_concurrent_tasks(self, count):
+        """调整最大并发数，减少时多余的worker在完成当前任务后退出"""
+        self.max_concurrent_tasks = max(int(count), 1)
+        while len(self._workers) < self.max_concurrent_tasks:
+            worker = asyncio.create_task(self._worker())
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+
     async def add_task(self, task_info):
         """添加下载任务"""
-        await self.queue.put(task_info)
+        self._apply_config()
+        task_info['cancel_event'] = asyncio.Event()
+        priority = (task_info.get('file_size') or 0) if self.small_first else 0
+        async with self.lock:
+            self.queued_tasks[task_info['task_id']] = task_info
+        await self.queue.put((priority, next(self._seq), task_info))
         init.logger.info(f"任务已添加到队列: {task_info['file_name']}")
-        # 尝试启动任务处理循环（如果尚未启动）
-        asyncio.create_task(self._process_queue())
 
     async def cancel_task(self, task_id):
-        """取消任务"""
+        """取消任务，排队中的任务会在轮到时直接跳过"""
         async with self.lock:
-            if task_id in self.active_tasks:
-                task = self.active_tasks[task_id]
+            task = self.active_tasks.get(task_id) or self.queued_tasks.get(task_id)
+            if task:
                 task['cancel_event'].set()
                 init.logger.info(f"正在取消任务: {task_id}")
                 return True
         return False
 
-    async def _process_queue(self):
-        """处理队列中的任务"""
+    async def _worker(self):
+        """常驻worker，依次处理队列中的任务"""
         while True:
-            async with self.lock:
-                if self.current_tasks >= self.max_concurrent_tasks:
-                    # 达到最大并发数，等待
-                    await asyncio.sleep(1)
-                    continue
-                
-                if self.queue.empty():
-                    # 队列为空，退出循环
-                    break
-                
-                # 获取下一个任务
-                task_info = await self.queue.get()
-                self.current_tasks += 1
-                self.active_tasks[task_info['task_id']] = task_info
-                
-            # 启动任务
-            asyncio.create_task(self._run_task(task_info))
+            item = await self.queue.get()
+            try:
+                # 并发数调小后多余的worker把任务放回队列后退出
+                if len(self._workers) > self.max_concurrent_tasks:
+                    self._workers.discard(asyncio.current_task())
+                    self.queue.put_nowait(item)
+                    return
+                task_info = item[2]
+                async with self.lock:
+                    self.queued_tasks.pop(task_info['task_id'], None)
+                    self.active_tasks[task_info['task_id']] = task_info
+                try:
+                    await self._run_task(task_info)
+                except Exception as e:
+                    init.logger.error(f"任务异常 {task_info['task_id']}: {e}")
+                finally:
+                    async with self.lock:
+                        self.active_tasks.pop(task_info['task_id'], None)
+            finally:
+                self.queue.task_done()
+
+    def _uses_temp_space(self, task_info):
+        download_config = init.bot_config.get('video_download') or {}
+        return not (download_config.get('stream_upload', False) and task_info['file_size'] >= STREAM_MIN_SIZE)
+
+    async def _acquire_space(self, task_info):
+        """
+        准入检查：向临时目录空间管理预留文件大小的空间，空间不足时等待其他任务完成或定期重新检查；
+        任务被取消时返回False
+        """
+        task_id = task_info['task_id']
+
+        async def on_wait():
+            await self._update_status(task_info['context'], task_info['chat_id'], task_info['message_id'],
+                                      f"⏳ 临时目录空间不足，等待其他任务完成: {task_info['file_name']}",
+                                      task_id, show_cancel=True)
+
+        try:
+            return await init.temp_storage.reserve_async(SUBSYSTEM_VIDEO, task_id, task_info['file_size'],
+                                                         path=task_info['temp_file_path'],
+                                                         cancel_event=task_info['cancel_event'],
+                                                         on_wait=on_wait, poll_interval=SPACE_RECHECK_INTERVAL)
+        except TempStorageError as e:
+            raise Exception(str(e))
 
     async def _run_task(self, task_info):
         """执行单个下载任务"""
@@ -71,11 +137,17 @@ class VideoDownloadManager:
         chat_id = task_info['chat_id']
         message_id = task_info['message_id']
         
-        temp_file_path = f"{init.TEMP}/{file_name}"
-        cancel_event = asyncio.Event()
-        task_info['cancel_event'] = cancel_event
+        temp_file_path = os.path.join(init.temp_storage.subsystem_dir(SUBSYSTEM_VIDEO), file_name)
+        task_info['temp_file_path'] = temp_file_path
+        cancel_event = task_info['cancel_event']
         
         try:
+            if cancel_event.is_set():
+                raise asyncio.CancelledError("用户取消下载")
+            # 准入检查：需要下载到本地时等待临时目录有足够空间
+            if self._uses_temp_space(task_info) and not await self._acquire_space(task_info):
+                raise asyncio.CancelledError("用户取消下载")
+
             # 更新状态：开始下载
             await self._update_status(context, chat_id, message_id, 
                                     f"⬇️ 正在下载: {file_name}\n等待队列...", 
@@ -99,14 +171,27 @@ class VideoDownloadManager:
                     await self._update_status(context, chat_id, message_id, text, task_id, show_cancel=True)
                     last_update_time = now
 
-            # 执行下载
+            download_config = init.bot_config.get('video_download') or {}
+            threads = int(download_config.get('threads', DEFAULT_THREADS))
+            part_size = int(download_config.get('part_size', DEFAULT_PART_SIZE // 1024)) * 1024
+
+            # 流式上传：不下载到本地
+            if download_config.get('stream_upload', False) and file_size >= STREAM_MIN_SIZE:
+                if await self._stream_to_115(message, file_name, save_path, threads, part_size, progress_callback,
+                                             cancel_event, context, chat_id, message_id, task_id):
+                    return
+
+            # 执行下载，同时计算SHA1
+            hasher = StreamingSha1()
             saved_path = await download_file_parallel(
                 init.tg_user_client,
                 message,
                 file_path=temp_file_path,
                 progress_callback=progress_callback,
-                threads=8,
-                cancel_event=cancel_event
+                threads=threads,
+                cancel_event=cancel_event,
+                hasher=hasher,
+                part_size=part_size
             )
 
             if not saved_path:
@@ -120,42 +205,43 @@ class VideoDownloadManager:
                 
             await self._update_status(context, chat_id, message_id, "🔄 正在处理文件...", task_id)
             final_path = self._process_file(saved_path)
+            # 重命名后按新文件计算已写入的空间，避免重复计算
+            init.temp_storage.update_path(task_id, final_path)
+            # 回退到默认下载时没有边下载边计算，上传前再读取文件计算
+            sha1 = hasher.hexdigest() if hasher.complete(os.path.getsize(final_path)) else None
             
             # 上传到115
             if cancel_event.is_set():
                 raise asyncio.CancelledError("用户取消下载")
 
             await self._update_status(context, chat_id, message_id, f"☁️ 正在上传到115: {Path(final_path).name}", task_id)
-            await self._upload_to_115(final_path, save_path, context, chat_id, message_id, task_id)
+            await self._upload_to_115(final_path, save_path, context, chat_id, message_id, task_id, sha1)
 
         except asyncio.CancelledError:
             init.logger.info(f"任务 {task_id} 已取消")
             await self._update_status(context, chat_id, message_id, "🛑 下载已取消", task_id, show_cancel=False)
-            self._cleanup(temp_file_path)
+            # 非用户取消（如关闭机器人）时保留已下载的分片，重新转发后续传
+            self._cleanup(temp_file_path, keep_resumable=not cancel_event.is_set())
         except Exception as e:
             init.logger.error(f"任务失败 {task_id}: {e}")
             await self._update_status(context, chat_id, message_id, f"❌ 失败: {str(e)}", task_id, show_cancel=False)
-            self._cleanup(temp_file_path)
+            self._cleanup(temp_file_path, keep_resumable=True)
         finally:
-            async with self.lock:
-                self.current_tasks -= 1
-                if task_id in self.active_tasks:
-                    del self.active_tasks[task_id]
-            # 继续处理队列
-            asyncio.create_task(self._process_queue())
-
-    async def _upload_to_115(self, file_path, save_dir, context, chat_id, message_id, task_id):
+            init.temp_storage.release(task_id)
+
+    async def _upload_to_115(self, file_path, save_dir, context, chat_id, message_id, task_id, sha1=None):
         """上传文件到115"""
         try:
             file_size = os.path.getsize(file_path)
             file_name = Path(file_path).name
-            sha1 = self._calculate_sha1(file_path)
+            if not sha1:
+                sha1 = await file_sha1_async(file_path)
             
             # 确保目录存在
-            init.openapi_115.create_dir_recursive(save_dir)
+            await init.openapi_115_async.create_dir_recursive(save_dir)
             
             # 上传
-            is_upload, bingo = init.openapi_115.upload_file(
+            is_upload, bingo = await init.openapi_115_async.upload_file(
                 target=save_dir,
                 file_name=file_name,
                 file_size=file_size,
@@ -164,18 +250,75 @@ class VideoDownloadManager:
                 request_times=1
             )
             
-            if is_upload:
-                status = "⚡ 秒传成功" if bingo else "✅ 上传成功"
-                text = (f"{status}\n"
-                       f"📄 文件: {file_name}\n"
-                       f"📂 目录: {save_dir}")
-                await self._update_status(context, chat_id, message_id, text, task_id, show_cancel=False)
-            else:
-                await self._update_status(context, chat_id, message_id, "❌ 上传失败", task_id, show_cancel=False)
+            await self._report_upload(is_upload, bingo, file_name, save_dir, context, chat_id, message_id, task_id)
                 
         finally:
             self._cleanup(file_path)
 
+    async def _stream_to_115(self, message, file_name, save_dir, threads, part_size, progress_callback,
+                             cancel_event, context, chat_id, message_id, task_id):
+        """
+        不落盘上传到115，无法流式读取时返回False
+        115上传初始化需要整个文件的SHA1，所以第一遍从Telegram流式读取计算SHA1并尝试秒传；
+        秒传失败时第二遍边从Telegram读取边分片上传到OSS，内存中只保留有限个分片
+        """
+        stream = TelegramFileStream(init.tg_user_client, message, threads=threads, part_size=part_size)
+        try:
+            if not await stream.open():
+                return False
+
+            # 第一遍：计算SHA1，同时根据文件头确定格式
+            hasher = StreamingSha1()
+            header = b''
+            async for offset, data in stream.iter_parts():
+                if cancel_event.is_set():
+                    raise asyncio.CancelledError("用户取消下载")
+                if offset == 0:
+                    header = data[:260]
+                await hasher.feed(offset, data)
+                await progress_callback(min(offset + len(data), stream.file_size), stream.file_size)
+            upload_name = file_name[:-3] + self._detect_format_from_header(header)
+
+            async def range_sha1(start, end):
+                return hashlib.sha1(await stream.read_range(start, end)).hexdigest()
+
+            async def stream_uploader(**oss_params):
+                await self._update_status(context, chat_id, message_id,
+                                          f"☁️ 秒传失败，正在从Telegram流式上传: {upload_name}", task_id, show_cancel=True)
+
+                async def chunks():
+                    async for _, chunk in stream.iter_parts():
+                        if cancel_event.is_set():
+                            raise asyncio.CancelledError("用户取消下载")
+                        yield chunk
+                return await upload_stream_to_oss(chunks(), **oss_params)
+
+            await self._update_status(context, chat_id, message_id, f"☁️ 正在上传到115: {upload_name}", task_id)
+            await init.openapi_115_async.create_dir_recursive(save_dir)
+            is_upload, bingo = await init.openapi_115_async.upload_file(
+                target=save_dir,
+                file_name=upload_name,
+                file_size=stream.file_size,
+                fileid=hasher.hexdigest(),
+                request_times=1,
+                sign_val_provider=range_sha1,
+                oss_uploader=stream_uploader
+            )
+            await self._report_upload(is_upload, bingo, upload_name, save_dir, context, chat_id, message_id, task_id)
+            return True
+        finally:
+            await stream.close()
+
+    async def _report_upload(self, is_upload, bingo, file_name, save_dir, context, chat_id, message_id, task_id):
+        if is_upload:
+            status = "⚡ 秒传成功" if bingo else "✅ 上传成功"
+            text = (f"{status}\n"
+                   f"📄 文件: {file_name}\n"
+                   f"📂 目录: {save_dir}")
+            await self._update_status(context, chat_id, message_id, text, task_id, show_cancel=False)
+        else:
+            await self._update_status(context, chat_id, message_id, "❌ 上传失败", task_id, show_cancel=False)
+
     def _process_file(self, file_path):
         """处理文件格式"""
         format_name = self._detect_video_format(file_path)
@@ -185,11 +328,18 @@ class VideoDownloadManager:
             return new_path
         return file_path
 
-    def _cleanup(self, file_path):
-        """清理临时文件"""
+    def _cleanup(self, file_path, keep_resumable=False):
+        """
+        清理临时文件
+        :param keep_resumable: 有断点续传记录时保留，由 TempStorageManager.clean_orphans 按 resume_max_age 清理
+        """
+        if keep_resumable and has_part_bitmap(file_path):
+            init.logger.info(f"保留未完成的下载，再次下载时续传: {file_path}")
+            return
         try:
             if os.path.exists(file_path):
                 os.remove(file_path)
+            remove_part_bitmap(file_path)
         except Exception as e:
             init.logger.warn(f"清理文件失败: {e}")
 
@@ -222,10 +372,6 @@ class VideoDownloadManager:
         filled = int(percentage // 5)
         return "█" * filled + "░" * (20 - filled) + f" {percentage:.1f}%"
 
-    def _calculate_sha1(self, file_path):
-        with open(file_path, 'rb') as f:
-            return hashlib.sha1(f.read()).hexdigest()
-
     def _detect_video_format(self, file_path):
         # 复用原有的格式检测逻辑
         try:
@@ -233,7 +379,9 @@ class VideoDownloadManager:
                 header = f.read(260)
         except:
             return "mp4"
-            
+        return self._detect_format_from_header(header)
+
+    def _detect_format_from_header(self, header):
         if len(header) < 4: return "mp4"
         
         if len(header) >= 12 and header[4:8] == b'ftyp':
@@ -10,6 +10,9 @@ from app.utils.message_queue import add_task_to_queue
 import re
 from concurrent.futures import ThreadPoolExecutor
 from app.utils.cover_capture import get_av_cover
+from app.core.offline_task_index import is_task_success
+from app.core.offline_task_watcher import wait_offline_tasks
+from app.core.offline_quota import submit_offline, PRIORITY_USER
 from telegram.helpers import escape_markdown
 
 # 全局线程池，用于处理下载任务
@@ -249,7 +252,10 @@ def download_task(av_result, av_number, save_path, user_id):
             magnet = item['magnet']
             title = item['title']
             # 离线下载到115
-            offline_success = init.openapi_115.offline_download_specify_path(magnet, save_path)
+            offline_success, deferred = submit_offline([magnet], save_path, PRIORITY_USER)
+            if deferred:
+                add_task_to_queue(user_id, f"{init.IMAGE_PATH}/male023.png", f"❌ [{av_number}] 离线配额不足，请等待配额恢复后重试！")
+                return
             if not offline_success:
                 continue
             
@@ -341,45 +347,48 @@ def batch_download_task(magnet_links, save_path, user_id):
         return
     
     init.logger.info(f"发现 {len(valid_links)} 个有效链接，准备添加离线任务...")
-    # 配额检查
-    # quota_info = init.openapi_115.get_quota_info()
-    # left_offline_quota = quota_info['count'] - quota_info['used']
-    # # 离线配额不足
-    # if left_offline_quota < len(valid_links):
-    #     init.logger.warn("❌ 离线配额不足，无法添加离线任务！")
-    #     add_task_to_queue(user_id, f"{init.IMAGE_PATH}/male023.png", "❌ 离线配额不足，无法添加离线任务！")
-    #     return
-    
     # 分割磁力，避免数量太多超过接口限制
     dl_list = split_list_compact(valid_links)
     success_append_count = 0
-    # 添加到离线列表
+    deferred_links = []
+    # 添加到离线列表，超出离线配额的链接不再提交
     for sub_list in dl_list:
-        offline_tasks = "\n".join(sub_list)
+        if deferred_links:
+            deferred_links.extend(sub_list)
+            continue
         # 调用115的离线下载API
-        offline_success = init.openapi_115.offline_download_specify_path(offline_tasks, save_path)
+        offline_success, deferred = submit_offline(sub_list, save_path, PRIORITY_USER)
+        deferred_links.extend(deferred)
         if offline_success: 
-            success_append_count += len(sub_list)
+            success_append_count += len(sub_list) - len(deferred)
         time.sleep(2)
     
     init.logger.info(f"✅ 离线任务添加成功：{success_append_count}/{len(valid_links)}")
+    if deferred_links:
+        init.logger.warn(f"❌ 离线配额不足，{len(deferred_links)}个链接未提交")
+        add_task_to_queue(user_id, f"{init.IMAGE_PATH}/male023.png", f"❌ 离线配额不足，{len(deferred_links)}个链接未提交，请等待配额恢复后重新发送！")
+        deferred_set = set(deferred_links)
+        valid_links = [link for link in valid_links if link not in deferred_set]
+        if not valid_links:
+            return
     
-    time.sleep(120)  # 等待一段时间让离线任务开始处理
+    # 等待离线完成，全部结束或超时后继续
+    wait_offline_tasks(valid_links)
 
     success_count = 0
     success_list = []
-    offline_task_status = init.openapi_115.get_offline_tasks()
+    init.offline_task_index.refresh()
     for link in valid_links:
-        for task in offline_task_status:
-            if task['url'] == link:
-                if task['status'] == 2 and task['percentDone'] == 100:
-                    success_count += 1
-                    success_list.append(task['info_hash'])
-                else:
-                    init.logger.warn(f"[{task['name']}] 离线下载失败或未完成!")
-                    # 删除离线失败的文件
-                    init.openapi_115.del_offline_task(task['info_hash'])
-                break
+        task = init.offline_task_index.get(link)
+        if not task:
+            continue
+        if is_task_success(task):
+            success_count += 1
+            success_list.append(task['info_hash'])
+        else:
+            init.logger.warn(f"[{task['name']}] 离线下载失败或未完成!")
+            # 删除离线失败的文件
+            init.openapi_115.del_offline_task(task['info_hash'])
     message = f"✅ 批量离线任务完成！\n离线成功: {success_count}/{len(valid_links)}\n保存目录: {save_path}"
     
     add_task_to_queue(user_id, f"{init.IMAGE_PATH}/male022.png", message)
@@ -18,6 +18,8 @@ from warnings import filterwarnings
 from telegram.warnings import PTBUserWarning
 from app.utils.sqlitelib import *
 from concurrent.futures import ThreadPoolExecutor
+from app.core.offline_quota import submit_offline, PRIORITY_USER
+from app.utils.utils import magnet_info_hash
 
 filterwarnings(action="ignore", message=r".*CallbackQueryHandler", category=PTBUserWarning)
 
@@ -292,14 +294,29 @@ def save_failed_download_to_db(title, magnet, save_path):
     """保存失败的下载任务到数据库"""
     try:
         with SqlLiteLib() as sqlite:
+            info_hash = magnet_info_hash(magnet) if magnet.startswith("magnet:") else None
+            if info_hash:
+                # 同一保存路径下未完成的相同磁力链接由唯一索引去重
+                sql = "INSERT OR IGNORE INTO offline_task (title, magnet, save_path, info_hash) VALUES (?, ?, ?, ?)"
+                # execute_sql 出错时返回None，被唯一索引忽略时返回0
+                inserted = sqlite.execute_sql(sql, (title, magnet, save_path, info_hash))
+                if inserted is None:
+                    init.logger.error(f"[{title}]添加到重试列表失败")
+                elif inserted == 0:
+                    init.logger.info(f"[{title}]已在重试列表中，跳过")
+                else:
+                    init.logger.info(f"[{title}]已添加到重试列表")
+                return
             # 检查是否已存在相同的任务
             check_sql = "SELECT * FROM offline_task WHERE magnet = ? AND save_path = ? AND title = ?"
             existing = sqlite.query_one(check_sql, (magnet, save_path, title))
             
             if not existing:
                 sql = "INSERT INTO offline_task (title, magnet, save_path) VALUES (?, ?, ?)"
-                sqlite.execute_sql(sql, (title, magnet, save_path))
-                init.logger.info(f"[{title}]已添加到重试列表")
+                if sqlite.execute_sql(sql, (title, magnet, save_path)) is None:
+                    init.logger.error(f"[{title}]添加到重试列表失败")
+                else:
+                    init.logger.info(f"[{title}]已添加到重试列表")
     except Exception as e:
         raise str(e)
     
@@ -309,7 +326,10 @@ def download_task(link, selected_path, user_id):
     from app.utils.message_queue import add_task_to_queue
     info_hash = ""
     try:
-        offline_success = init.openapi_115.offline_download_specify_path(link, selected_path)
+        offline_success, deferred = submit_offline([link], selected_path, PRIORITY_USER)
+        if deferred:
+            add_task_to_queue(user_id, f"{init.IMAGE_PATH}/male023.png", message=f"❌ 离线配额不足，请等待配额恢复后重试！")
+            return
         if not offline_success:
             add_task_to_queue(user_id, f"{init.IMAGE_PATH}/male023.png", message=f"❌ 离线遇到错误！")
             return
@@ -10,6 +10,10 @@ from warnings import filterwarnings
 from telegram.warnings import PTBUserWarning
 from telegram.error import TelegramError
 from app.utils.cover_capture import get_movie_cover
+from app.core.offline_task_index import is_task_success
+from app.core.offline_task_watcher import wait_offline_tasks
+from app.core.offline_quota import submit_offline, PRIORITY_CRAWLER
+from app.core.offline_task_retry import status_updates
 
 filterwarnings(action="ignore", message=r".*CallbackQueryHandler", category=PTBUserWarning)
 
@@ -21,13 +25,11 @@ def get_failed_tasks():
         return sqlite.query_all(sql)
 
 def mark_task_as_completed(task_id: int):
-    """标记任务为已完成"""
-    with SqlLiteLib() as sqlite:
-        sql = "UPDATE offline_task SET is_download = 1, completed_at = datetime('now') WHERE id = ?"
-        sqlite.execute_sql(sql, (task_id,))
+    """标记任务为已完成，写入缓冲区，重试结束时统一写入"""
+    status_updates.add("offline_task", "is_download = 1, completed_at = datetime('now')", task_id)
         
 def update_retry_time(task_id: int):
-    """更新重试次数"""
+    """更新重试次数，自增不能合并写入，不经过缓冲区"""
     with SqlLiteLib() as sqlite:
         sql = "UPDATE offline_task SET retry_count = retry_count + 1 WHERE id = ?"
         sqlite.execute_sql(sql, (task_id,))
@@ -48,108 +50,127 @@ def try_to_offline2115_again():
     
     from app.core.offline_task_retry import create_offline_url
     create_offline_url_list = create_offline_url(failed_tasks)
+    # 因配额不足未提交的链接，不等待、不处理，保持未下载状态到下次重试
+    deferred_links = set()
     for offline_tasks in create_offline_url_list:
         if not offline_tasks:
             continue
-        offline_success = init.openapi_115.offline_download_specify_path(offline_tasks, failed_tasks[0]['save_path'])
+        offline_success, deferred = submit_offline(offline_tasks.split('\n'), failed_tasks[0]['save_path'], PRIORITY_CRAWLER)
+        if deferred:
+            deferred_links.update(deferred)
+            init.logger.warn(f"离线配额不足，{len(deferred)}个重试任务推迟到下次重试")
         if offline_success:
             init.logger.info(f"重试任务 {offline_tasks} 添加离线成功")
         else:
             init.logger.error(f"重试任务 {offline_tasks} 添加离线失败")
         time.sleep(2)  
 
-    time.sleep(300)  # 等待5秒，确保任务状态更新
+    # 等待离线完成，全部结束或超时后继续
+    wait_offline_tasks([task['magnet'] for task in failed_tasks if task['magnet'] not in deferred_links])
     
-    success_list= []
-    offline_task_status = init.openapi_115.get_offline_tasks()
+    init.offline_task_index.refresh()
+    try:
+        success_list = _process_retry_results(failed_tasks, deferred_links)
+    finally:
+        # 处理中途出错时也写入已完成任务的状态，避免下次重复离线和通知
+        status_updates.flush()
+    # 清除云端任务
+    for info_hash in success_list:
+        init.logger.info(f"清除云端任务 {info_hash} ...")
+        init.openapi_115.del_offline_task(info_hash, del_source_file=0)
+        time.sleep(2)
+
+
+def _process_retry_results(failed_tasks, deferred_links):
+    """处理重试任务的离线结果，返回下载成功的info_hash列表"""
+    success_list = []
     for failed_task in failed_tasks:
         task_id = failed_task['id']
         link = failed_task['magnet']
         title = failed_task['title']
         save_path = failed_task['save_path']
         retry_count = failed_task['retry_count']
-        for task in offline_task_status:
-            if task['url'] == link:
-                if task['status'] == 2 and task['percentDone'] == 100:
-                    resource_name = task['name']
-                    init.logger.info(f"重试任务 {title} 下载完成！")
-                    # 处理下载成功后的清理和重命名准备
-                    if init.openapi_115.is_directory(f"{save_path}/{resource_name}"):
-                        # 清除垃圾文件
-                        init.openapi_115.auto_clean_all(f"{save_path}/{resource_name}")
-                        old_name = f"{save_path}/{resource_name}"
-                    else:
-                        init.openapi_115.create_dir_for_file(f"{save_path}", "temp")
-                        # 移动文件到临时目录
-                        init.openapi_115.move_file(f"{save_path}", f"{save_path}/temp")
-                        old_name = f"{save_path}/temp"
-                    
-                    # 执行重命名
-                    init.openapi_115.rename(old_name, title)
-                    new_final_path = f"{save_path}/{title}"
-                    file_list = init.openapi_115.get_files_from_dir(new_final_path)
-                    # 创建软链
-                    from app.handlers.download_handler import create_strm_file, notice_emby_scan_library
-                    create_strm_file(new_final_path, file_list)
-                    
-                    # 发送封面图片（如果有的话）
-                    cover_url = ""
-                    
-                    # 根据分类获取封面
-                    cover_url = get_movie_cover(title)
-                    
-                    # 检查是否为订阅内容
-                    from app.core.subscribe_movie import is_subscribe, update_subscribe
-                    if is_subscribe(title):
-                        # 更新订阅信息
-                        update_subscribe(title, cover_url, link)
-                        init.logger.info(f"订阅影片[{title}]已手动下载成功！")
-                    
-                    # 通知Emby扫库
-                    notice_emby_scan_library(new_final_path)
-                    # 避免link过长
-                    if len(link) > 600:
-                        link = link[:600] + "..."
-                    
-                    message = f"""✅ **重试任务 `{title}` 下载成功！**
+        if link in deferred_links:
+            # 未提交，不计入重试次数
+            continue
+        task = init.offline_task_index.get(link)
+        if not task:
+            continue
+        if is_task_success(task):
+            resource_name = task['name']
+            init.logger.info(f"重试任务 {title} 下载完成！")
+            # 处理下载成功后的清理和重命名准备
+            if init.openapi_115.is_directory(f"{save_path}/{resource_name}"):
+                # 清除垃圾文件
+                init.openapi_115.auto_clean_all(f"{save_path}/{resource_name}")
+                old_name = f"{save_path}/{resource_name}"
+            else:
+                init.openapi_115.create_dir_for_file(f"{save_path}", "temp")
+                # 移动文件到临时目录
+                init.openapi_115.move_file(f"{save_path}", f"{save_path}/temp")
+                old_name = f"{save_path}/temp"
+            
+            # 执行重命名
+            init.openapi_115.rename(old_name, title)
+            new_final_path = f"{save_path}/{title}"
+            file_list = init.openapi_115.get_files_from_dir(new_final_path)
+            # 创建软链
+            from app.handlers.download_handler import create_strm_file, notice_emby_scan_library
+            create_strm_file(new_final_path, file_list)
+            
+            # 发送封面图片（如果有的话）
+            cover_url = ""
+            
+            # 根据分类获取封面
+            cover_url = get_movie_cover(title)
+            
+            # 检查是否为订阅内容
+            from app.core.subscribe_movie import is_subscribe, update_subscribe
+            if is_subscribe(title):
+                # 更新订阅信息
+                update_subscribe(title, cover_url, link)
+                init.logger.info(f"订阅影片[{title}]已手动下载成功！")
+            
+            # 通知Emby扫库
+            notice_emby_scan_library(new_final_path)
+            # 避免link过长
+            if len(link) > 600:
+                link = link[:600] + "..."
+            
+            message = f"""✅ **重试任务 `{title}` 下载成功！**
 
 **资源名称:** `{title}`
 **磁力链接:** `{link}`
 **保存路径:** `{save_path}`
-        """
-                    if cover_url:
-                        try:
-                            init.logger.info(f"cover_url: {cover_url}")
-                            # 发送通知给授权用户
-                            add_task_to_queue(
-                                init.bot_config['allowed_user'], 
-                                cover_url, 
-                                message=message
-                            )
-                        except TelegramError as e:
-                            init.logger.warn(f"Telegram API error: {e}")
-                        except Exception as e:
-                            init.logger.warn(f"Unexpected error: {e}")
-                    else:
-                        add_task_to_queue(init.bot_config['allowed_user'], None, message=message)
-                    
-                    # 标记任务为完成
-                    mark_task_as_completed(task_id)
-                    success_list.append(task['info_hash'])
-                    
-                else:
-                    init.logger.warn(f"重试任务 {title} 下载超时！")
-                    # 更新重试次数
-                    update_retry_time(task_id)
-                    # 删除失败资源
-                    init.openapi_115.del_offline_task(task['info_hash'])
-                break
-    # 清除云端任务
-    for info_hash in success_list:
-        init.logger.info(f"清除云端任务 {info_hash} ...")
-        init.openapi_115.del_offline_task(info_hash, del_source_file=0)
-        time.sleep(2)
-    
+"""
+            if cover_url:
+                try:
+                    init.logger.info(f"cover_url: {cover_url}")
+                    # 发送通知给授权用户
+                    add_task_to_queue(
+                        init.bot_config['allowed_user'], 
+                        cover_url, 
+                        message=message
+                    )
+                except TelegramError as e:
+                    init.logger.warn(f"Telegram API error: {e}")
+                except Exception as e:
+                    init.logger.warn(f"Unexpected error: {e}")
+            else:
+                add_task_to_queue(init.bot_config['allowed_user'], None, message=message)
+            
+            # 标记任务为完成
+            mark_task_as_completed(task_id)
+            success_list.append(task['info_hash'])
+            
+        else:
+            init.logger.warn(f"重试任务 {title} 下载超时！")
+            # 更新重试次数
+            update_retry_time(task_id)
+            # 删除失败资源
+            init.openapi_115.del_offline_task(task['info_hash'])
+    return success_list
+
 
 
 async def view_retry_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -8,6 +8,11 @@ import subprocess
 from typing import Optional
 from telethon import TelegramClient
 from app.core.open_115 import OpenAPI_115
+from app.core.async_open_115 import AsyncOpenAPI_115
+from app.core.offline_task_index import OfflineTaskIndex
+from app.core.offline_task_watcher import OfflineTaskWatcher
+from app.core.offline_quota import OfflineQuotaScheduler
+from app.utils.temp_storage import TempStorageManager
 
 
 # 模块路径现在通过 Dockerfile 中的 PYTHONPATH 环境变量设置
@@ -29,6 +34,7 @@ _ensure_module_paths()
 
 from app.utils.logger import Logger
 from app.utils.sqlitelib import *
+from app.utils.db_migrations import run_migrations
 
 
 # 调试模式
@@ -42,6 +48,16 @@ bot_config = dict()
 
 # 115开放API对象
 openapi_115 = None
+# 115开放API协程客户端，与openapi_115共享token和限流
+openapi_115_async = None
+# 115离线任务状态索引
+offline_task_index = None
+# 115离线任务完成监听器
+offline_task_watcher = None
+# 115离线配额调度
+offline_quota = None
+# 临时目录空间管理
+temp_storage = None
 
 # Tg 用户客户端
 tg_user_client: Optional[TelegramClient] = None
@@ -66,6 +82,8 @@ TG_SESSION_FILE = "/config/user_session.session"
 DB_FILE = "/config/db.db"
 # 115 Token File
 TOKEN_FILE = "/config/115_tokens.json"
+# 115 路径缓存快照
+PATH_CACHE_FILE = "/config/115_path_cache.json"
 # APP path
 APP = "/app"
 # Config path
@@ -104,6 +122,7 @@ if debug_mode:
     TG_SESSION_FILE = "config/user_session.session"
     DB_FILE = "config/db.db"
     TOKEN_FILE = "config/115_tokens.json"
+    PATH_CACHE_FILE = "config/115_path_cache.json"
     APP = "app"
     CONFIG = "config"
     TEMP = "tmp"
@@ -198,6 +217,21 @@ def create_tmp():
         os.mkdir(TEMP, mode=0o777)
         os.chmod(TEMP, 0o777)
 
+def init_temp_storage():
+    """
+    初始化临时目录空间管理，并清理上次运行崩溃遗留的临时文件
+    待离线任务引用的图片不会被清理
+    """
+    global temp_storage
+    temp_storage = TempStorageManager.from_config(TEMP)
+    try:
+        with SqlLiteLib() as sqlite:
+            referenced = [row[0] for row in sqlite.query("SELECT image_path FROM sehua_data WHERE is_download=0")]
+            referenced += [row[0] for row in sqlite.query("SELECT poster_url FROM javbus WHERE is_download=0")]
+        temp_storage.clean_orphans(referenced)
+    except Exception as e:
+        logger.warn(f"清理临时目录失败: {e}")
+
 def initialize_tg_usr_client():
     """
     初始化Tg用户客户端
@@ -272,9 +306,13 @@ def initialize_115open():
     初始化115开放API客户端
     :return: bool - 初始化是否成功
     """
-    global openapi_115, logger
+    global openapi_115, openapi_115_async, offline_task_index, offline_task_watcher, offline_quota, logger
     try:
         openapi_115 = OpenAPI_115()
+        openapi_115_async = AsyncOpenAPI_115(openapi_115)
+        offline_task_index = OfflineTaskIndex(openapi_115)
+        offline_task_watcher = OfflineTaskWatcher.from_config(offline_task_index)
+        offline_quota = OfflineQuotaScheduler.from_config(openapi_115)
         # 检查是否成功获取到token
         if openapi_115.access_token and openapi_115.refresh_token:
             user_info = openapi_115.get_user_info()
@@ -289,6 +327,10 @@ def initialize_115open():
     except Exception as e:
         logger.error(f"115 OpenAPI客户端初始化失败: {e}")
         openapi_115 = None
+        openapi_115_async = None
+        offline_task_index = None
+        offline_task_watcher = None
+        offline_quota = None
         return False
 
 
@@ -387,6 +429,7 @@ def init_db():
             title TEXT, -- 任务标题
             save_path TEXT, -- 保存路径
             magnet TEXT, -- 磁力链接
+            info_hash TEXT, -- 磁力链接info_hash，40位小写hex，用于去重
             is_download TINYINT DEFAULT 0, -- 是否下载, 0或1, 默认0
             retry_count INTEGER DEFAULT 1, -- 重试次数
             completed_at DATETIME, -- 完成时间
@@ -404,6 +447,7 @@ def init_db():
             post_url TEXT, -- 封面URL
             pub_url TEXT, -- 发布链接
             magnet TEXT, -- 磁力链接
+            info_hash TEXT, -- 磁力链接info_hash，40位小写hex，用于去重
             is_download TINYINT DEFAULT 0, -- 是否下载, 0或1, 默认0
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP -- 创建时间，默认当前时间
         );
@@ -441,6 +485,7 @@ def init_db():
             pub_url TEXT, -- 资源链接
             image_path TEXT, -- 图片本地路径 
             save_path TEXT, -- 保存路径
+            info_hash TEXT, -- 磁力链接info_hash，40位小写hex，用于去重
             is_download TINYINT DEFAULT 0, -- 是否下载, 0或1, 默认0
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP -- 创建时间，默认当前时间
         );
@@ -458,6 +503,7 @@ def init_db():
             publish_date DATE, -- 发布日期
             pub_url TEXT, -- 资源链接
             save_path TEXT, -- 保存路径
+            info_hash TEXT, -- 磁力链接info_hash，40位小写hex，用于去重
             is_download TINYINT DEFAULT 0, -- 是否下载, 0或1, 默认0
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP -- 创建时间，默认当前时间
         );
@@ -477,11 +523,14 @@ def init_db():
             publish_date DATE, -- 发布日期
             pub_url TEXT, -- 资源链接
             save_path TEXT, -- 保存路径
+            info_hash TEXT, -- 磁力链接info_hash，40位小写hex，用于去重
             is_download TINYINT DEFAULT 0, -- 是否下载, 0或1, 默认0
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP -- 创建时间，默认当前时间
         );
         '''
         sqlite.execute_sql(create_table_query)
+        # 建表之后的结构变更（新增列、索引）通过迁移应用到已有数据库
+        run_migrations(sqlite)
         logger.info("init DataBase success.")
         
 
@@ -499,6 +548,7 @@ def init():
     create_logger()
     create_tmp()
     init_db()
+    init_temp_storage()
     initialize_tg_usr_client()
     init_aria2()
 
@@ -1,4 +1,56 @@
+import os
+import math
+import time
+import asyncio
+import threading
+import init
 import alibabacloud_oss_v2 as oss
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 超过该大小的文件使用分片上传
+DEFAULT_MULTIPART_THRESHOLD = 32 * 1024 * 1024
+# 分片大小，OSS要求除最后一个分片外不小于100KB，最多10000个分片
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MIN_PART_SIZE = 100 * 1024
+MAX_PART_COUNT = 10000
+# 同时上传的分片数，内存中最多缓存 并发数 个分片
+DEFAULT_PARALLEL = 4
+# 单个分片的重试次数
+PART_RETRIES = 3
+
+
+def upload_config():
+    """读取oss_upload配置，返回 (分片上传阈值, 分片大小, 并发数)，单位为字节"""
+    config = init.bot_config.get('oss_upload') or {}
+    threshold = int(config.get('multipart_threshold', DEFAULT_MULTIPART_THRESHOLD // 1024 // 1024)) * 1024 * 1024
+    part_size = int(config.get('part_size', DEFAULT_PART_SIZE // 1024 // 1024)) * 1024 * 1024
+    parallel = int(config.get('parallel', DEFAULT_PARALLEL))
+    return threshold, max(part_size, MIN_PART_SIZE), max(parallel, 1)
+
+
+def _create_client(**kwargs):
+    """根据115返回的STS凭证创建OSS客户端"""
+    region = kwargs.get('region', 'cn-shenzhen')  # 默认深圳区域
+    endpoint = kwargs.get('endpoint', '')
+    # 直接使用StaticCredentialsProvider，不需要先创建Credentials对象
+    credentials_provider = oss.credentials.StaticCredentialsProvider(
+        access_key_id=kwargs.get('access_key_id', ''),
+        access_key_secret=kwargs.get('access_key_secret', ''),
+        security_token=kwargs.get('security_token', '')
+    )
+    # 加载SDK的默认配置，并设置凭证提供者
+    cfg = oss.config.load_default()
+    cfg.credentials_provider = credentials_provider
+
+    # 设置配置中的区域信息
+    cfg.region = region
+
+    # 如果提供了endpoint参数，则设置配置中的endpoint
+    if endpoint is not None:
+        cfg.endpoint = endpoint
+
+    # 使用配置好的信息创建OSS客户端
+    return oss.Client(cfg)
 
 
 def upload_file_to_oss(**kwargs):
@@ -13,37 +65,19 @@ def upload_file_to_oss(**kwargs):
     :param region: 区域信息
     :param endpoint: 自定义endpoint
     :param callback: 回调参数
+    大文件使用并行分片上传，见 upload_file_multipart
     """
     file_path = kwargs.get('file_path', '')
-    region = kwargs.get('region', 'cn-shenzhen')  # 默认深圳区域
     bucket = kwargs.get('bucket', '')
-    endpoint = kwargs.get('endpoint', '')
     key = kwargs.get('key', '')
-    access_key_id = kwargs.get('access_key_id', '')
-    access_key_secret = kwargs.get('access_key_secret', '')
-    security_token = kwargs.get('security_token', '')
     callback = kwargs.get('callback', None)
     callback_var = kwargs.get('callback_var', None)
     try:
-        # 直接使用StaticCredentialsProvider，不需要先创建Credentials对象
-        credentials_provider = oss.credentials.StaticCredentialsProvider(
-            access_key_id=access_key_id,
-            access_key_secret=access_key_secret,
-            security_token=security_token
-        )
-        # 加载SDK的默认配置，并设置凭证提供者
-        cfg = oss.config.load_default()
-        cfg.credentials_provider = credentials_provider
-
-        # 设置配置中的区域信息
-        cfg.region = region
+        threshold, part_size, parallel = upload_config()
+        if os.path.getsize(file_path) >= threshold:
+            return upload_file_multipart(part_size=part_size, parallel=parallel, **kwargs)
 
-        # 如果提供了endpoint参数，则设置配置中的endpoint
-        if endpoint is not None:
-            cfg.endpoint = endpoint
-
-        # 使用配置好的信息创建OSS客户端
-        client = oss.Client(cfg)
+        client = _create_client(**kwargs)
 
         # 执行上传对象的请求，直接从文件上传
         # 指定存储空间名称、对象名称和本地文件路径
@@ -61,4 +95,177 @@ def upload_file_to_oss(**kwargs):
         else:
             return False
     except oss.exceptions.BaseError as e:
-        return False
\ No newline at end of file
+        return False
+
+
+def upload_file_multipart(part_size=DEFAULT_PART_SIZE, parallel=DEFAULT_PARALLEL, **kwargs):
+    """
+    并行分片上传文件到OSS，参数与 upload_file_to_oss 相同
+    所有分片完成后合并，合并时提交115的回调参数；有分片最终失败时取消本次分片上传。
+    115每次上传分配新的对象和临时凭证，失败后无法续传，重新上传即可
+    """
+    file_path = kwargs.get('file_path', '')
+    file_size = os.path.getsize(file_path)
+    # 分片数不能超过OSS的上限
+    part_size = max(part_size, math.ceil(file_size / MAX_PART_COUNT), MIN_PART_SIZE)
+    part_count = max(math.ceil(file_size / part_size), 1)
+
+    upload = MultipartUpload(**kwargs)
+    upload.initiate()
+    etags = {}
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def upload_one(part_number):
+        if failed.is_set():
+            return
+        offset = (part_number - 1) * part_size
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(min(part_size, file_size - offset))
+        for attempt in range(PART_RETRIES):
+            try:
+                etag = upload.upload_part(part_number, data)
+                break
+            except oss.exceptions.BaseError as e:
+                if attempt == PART_RETRIES - 1 or failed.is_set():
+                    failed.set()
+                    raise
+                init.logger.warn(f"OSS分片{part_number}上传失败，重试: {e}")
+                time.sleep(2 ** attempt)
+        with lock:
+            etags[part_number] = etag
+
+    try:
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="oss-upload") as executor:
+            futures = [executor.submit(upload_one, number) for number in range(1, part_count + 1)]
+            for future in as_completed(futures):
+                future.result()
+        return upload.complete(etags)
+    except BaseException:
+        upload.abort()
+        raise
+
+
+class MultipartUpload:
+    """
+    OSS分片上传，参数与 upload_file_to_oss 相同（不需要file_path）
+    115的回调参数在所有分片上传完成、合并时提交
+    """
+
+    def __init__(self, **kwargs):
+        self.bucket = kwargs.get('bucket', '')
+        self.key = kwargs.get('key', '')
+        self.callback = kwargs.get('callback', None)
+        self.callback_var = kwargs.get('callback_var', None)
+        self.upload_id = kwargs.get('upload_id', None)
+        self._client = _create_client(**kwargs)
+
+    def initiate(self):
+        result = self._client.initiate_multipart_upload(oss.InitiateMultipartUploadRequest(
+            bucket=self.bucket,
+            key=self.key
+        ))
+        self.upload_id = result.upload_id
+        return self.upload_id
+
+    def upload_part(self, part_number, data):
+        """上传一个分片，返回etag"""
+        result = self._client.upload_part(oss.UploadPartRequest(
+            bucket=self.bucket,
+            key=self.key,
+            upload_id=self.upload_id,
+            part_number=part_number,
+            body=data
+        ))
+        return result.etag
+
+    def complete(self, etags):
+        """
+        合并分片并触发115回调
+        :param etags: {part_number: etag}
+        """
+        parts = [oss.UploadPart(part_number=number, etag=etags[number]) for number in sorted(etags)]
+        result = self._client.complete_multipart_upload(oss.CompleteMultipartUploadRequest(
+            bucket=self.bucket,
+            key=self.key,
+            upload_id=self.upload_id,
+            complete_multipart_upload=oss.CompleteMultipartUpload(parts=parts),
+            callback=self.callback,
+            callback_var=self.callback_var
+        ))
+        return result.status_code == 200
+
+    def abort(self):
+        if not self.upload_id:
+            return
+        try:
+            self._client.abort_multipart_upload(oss.AbortMultipartUploadRequest(
+                bucket=self.bucket,
+                key=self.key,
+                upload_id=self.upload_id
+            ))
+        except oss.exceptions.BaseError:
+            pass
+
+
+async def upload_stream_to_oss(chunks, part_size=None, parallel=None, **kwargs):
+    """
+    将按顺序产生的数据流式分片上传到OSS，不需要本地文件
+    :param chunks: 异步迭代器，按文件顺序产生bytes
+    :param part_size: 分片大小，数据会先攒够一个分片再上传，默认读取oss_upload配置
+    :param parallel: 同时上传的分片数，超过后暂停读取chunks，内存中最多缓存 (并发数 + 1) 个分片
+    :param kwargs: 与 upload_file_to_oss 相同的参数
+    :return: 是否上传成功
+    """
+    _, default_part_size, default_parallel = upload_config()
+    part_size = part_size or default_part_size
+    parallel = parallel or default_parallel
+    upload = MultipartUpload(**kwargs)
+    slots = asyncio.Semaphore(parallel)
+    etags = {}
+    uploads = []
+
+    async def upload_part(part_number, data):
+        try:
+            for attempt in range(3):
+                try:
+                    etags[part_number] = await asyncio.to_thread(upload.upload_part, part_number, data)
+                    return
+                except oss.exceptions.BaseError:
+                    if attempt == 2:
+                        raise
+                    await asyncio.sleep(1)
+        finally:
+            slots.release()
+
+    async def submit(part_number, data):
+        await slots.acquire()
+        uploads.append(asyncio.create_task(upload_part(part_number, data)))
+        # 尽早发现失败的分片
+        for task in uploads:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+
+    try:
+        await asyncio.to_thread(upload.initiate)
+        buffer = bytearray()
+        part_number = 0
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= part_size:
+                part_number += 1
+                await submit(part_number, bytes(buffer[:part_size]))
+                del buffer[:part_size]
+        if buffer or part_number == 0:
+            part_number += 1
+            await submit(part_number, bytes(buffer))
+        await asyncio.gather(*uploads)
+        if await asyncio.to_thread(upload.complete, etags):
+            return True
+        return False
+    except BaseException:
+        for task in uploads:
+            task.cancel()
+        await asyncio.to_thread(upload.abort)
+        raise
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import init
+from app.utils.utils import magnet_info_hash
+
+# 按磁力链接info_hash去重的表 {表名: (唯一索引列, 部分索引条件)}
+# offline_task 只约束未完成的任务，同一磁力链接完成后可以再次加入重试列表
+INFO_HASH_TABLES = {
+    'sehua_data': (('info_hash',), None),
+    'av_daily_update': (('info_hash',), None),
+    't66y': (('info_hash',), None),
+    'javbus': (('info_hash',), None),
+    'offline_task': (('info_hash', 'save_path'), 'is_download = 0'),
+}
+
+
+def _execute(sqlite, sql, params=()):
+    """迁移中的语句出错时抛出异常，由 run_migrations 回滚整个迁移"""
+    sqlite.cursor.execute(sql, params)
+
+
+def _columns(sqlite, table):
+    return {row[1] for row in sqlite.query(f"PRAGMA table_info({table})")}
+
+
+def add_info_hash(sqlite):
+    """
+    为旧数据库添加 info_hash 列并回填，然后创建唯一索引。
+    已有的重复记录只保留最早一条的 info_hash，其余置空（不删除数据）。
+    """
+    sqlite.conn.create_function("magnet_info_hash", 1, magnet_info_hash, deterministic=True)
+    for table, (columns, where) in INFO_HASH_TABLES.items():
+        if 'info_hash' not in _columns(sqlite, table):
+            _execute(sqlite, f"ALTER TABLE {table} ADD COLUMN info_hash TEXT")
+            _execute(sqlite, f"UPDATE {table} SET info_hash = magnet_info_hash(magnet) WHERE magnet IS NOT NULL")
+            scope = f"info_hash IS NOT NULL AND {where}" if where else "info_hash IS NOT NULL"
+            _execute(sqlite, f"""
+                UPDATE {table} SET info_hash = NULL
+                WHERE {scope} AND id NOT IN (
+                    SELECT MIN(id) FROM {table} WHERE {scope} GROUP BY {', '.join(columns)}
+                )
+            """)
+            init.logger.info(f"[{table}]已回填info_hash")
+        index_sql = f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_info_hash ON {table} ({', '.join(columns)})"
+        if where:
+            index_sql += f" WHERE {where}"
+        _execute(sqlite, index_sql)
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_javbus_av_number ON javbus (av_number)")
+
+
+def add_pending_indexes(sqlite):
+    """定时离线、订阅检查查询未下载任务时使用的索引，覆盖过滤条件和排序"""
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_sehua_data_pending ON sehua_data (is_download, section_name, publish_date)")
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_av_daily_update_pending ON av_daily_update (is_download, publish_date)")
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_t66y_pending ON t66y (is_download, publish_date)")
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_javbus_pending ON javbus (is_download, publish_date)")
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_sub_movie_pending ON sub_movie (is_download, is_delete, tmdb_id)")
+    # 订阅电影按 tmdb_id 查询、更新时不带 is_download 条件
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_sub_movie_tmdb_id ON sub_movie (tmdb_id)")
+    _execute(sqlite, "CREATE INDEX IF NOT EXISTS idx_offline_task_pending ON offline_task (is_download)")
+
+
+# 按版本号顺序执行的迁移 (版本号, 说明, 迁移函数)，已发布的迁移不要修改，新的变更追加在末尾
+MIGRATIONS = [
+    (1, "磁力链接info_hash去重", add_info_hash),
+    (2, "未下载任务查询索引", add_pending_indexes),
+]
+
+
+def schema_version(sqlite):
+    return sqlite.query_one("SELECT MAX(version) FROM schema_version") or 0
+
+
+def run_migrations(sqlite):
+    """
+    执行尚未应用的迁移，每个迁移在单独的事务中执行，成功后记录版本号；
+    迁移失败时回滚该迁移并抛出异常，之后的迁移不再执行
+    """
+    _execute(sqlite, """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY, -- 迁移版本号
+            description TEXT, -- 迁移说明
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP -- 执行时间
+        )
+    """)
+    current = schema_version(sqlite)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with sqlite.transaction():
+            migrate(sqlite)
+            _execute(sqlite, "INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+        init.logger.info(f"数据库迁移完成: v{version} {description}")
@@ -1,16 +1,518 @@
 import asyncio
 import os
+import math
+import time
+import json
+import base64
 import logging
+import threading
+import weakref
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from telethon import TelegramClient, utils
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
 from telethon.tl.functions.upload import GetFileRequest
 from telethon.tl.types import InputFileLocation, InputDocumentFileLocation
 
 logger = logging.getLogger(__name__)
 
-async def download_file_parallel(client: TelegramClient, message, file_path, progress_callback=None, threads=4, cancel_event=None):
+# 写入磁盘的线程数，同一文件不同偏移的pwrite可以并发
+DEFAULT_WRITE_WORKERS = 4
+# 已下载但尚未写入磁盘的最大分片数，超过后下载等待写入
+DEFAULT_WRITE_BEHIND = 16
+
+# 默认并发连接数和分片大小
+DEFAULT_THREADS = 8
+DEFAULT_PART_SIZE = 512 * 1024
+# Telegram限制：分片大小必须是4KB的倍数且能整除1MB
+MIN_PART_SIZE = 4 * 1024
+MAX_PART_SIZE = 1024 * 1024
+# 单个分片的重试次数（FloodWait不计入）
+CHUNK_RETRIES = 5
+# 单个分片请求超过该耗时(秒)视为过慢，降低并发
+SLOW_CHUNK_SECONDS = 15
+# 有分片最终失败时，只下载缺失分片的重试次数（含第一次）
+DOWNLOAD_ATTEMPTS = 3
+
+# 断点续传记录文件的后缀
+PARTS_SUFFIX = ".parts"
+# 回退到单线程下载时使用的临时文件后缀，成功后替换下载文件，避免覆盖已下载的分片
+FALLBACK_SUFFIX = ".fallback"
+# 每完成多少个分片保存一次断点续传记录
+PARTS_SAVE_INTERVAL = 64
+
+# 每个DC保留的空闲连接数，供后续下载复用
+MAX_IDLE_SENDERS = DEFAULT_THREADS
+
+_write_executor = ThreadPoolExecutor(max_workers=DEFAULT_WRITE_WORKERS, thread_name_prefix="tg-file-write")
+# {client: ExportedSenderPool}
+_sender_pools = weakref.WeakKeyDictionary()
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+class ChunkWriter:
+    """
+    分片写入：整个下载只打开一次文件，按偏移pwrite，写入在线程池中执行不阻塞事件循环；
+    最多 write_behind 个分片在等待写入，超过后 write 会等待，内存占用有上限。
+    """
+
+    def __init__(self, file_path, file_size, write_behind=DEFAULT_WRITE_BEHIND):
+        self.file_path = file_path
+        self._fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # 预分配空间
+        os.ftruncate(self._fd, file_size)
+        self._slots = asyncio.Semaphore(write_behind)
+        self._pending = set()
+        self._error = None
+
+    async def write(self, offset, data, on_written=None):
+        """提交写入，不等待写入完成；写入成功后在事件循环中调用 on_written()"""
+        if self._error is not None:
+            raise self._error
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().run_in_executor(_write_executor, _pwrite_all, self._fd, data, offset)
+        self._pending.add(future)
+        future.add_done_callback(lambda f: self._on_written(f, on_written))
+
+    def _on_written(self, future, on_written):
+        self._pending.discard(future)
+        self._slots.release()
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            if self._error is None:
+                self._error = future.exception()
+        elif on_written is not None:
+            on_written()
+
+    async def flush(self):
+        """等待所有写入完成，有写入失败时抛出异常"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+        if self._error is not None:
+            raise self._error
+
+    async def close(self):
+        """等待写入完成后关闭文件，不抛出写入异常"""
+        if self._fd is None:
+            return
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+        os.close(self._fd)
+        self._fd = None
+
+
+def remove_part_bitmap(file_path):
+    """删除下载文件的断点续传记录"""
+    try:
+        os.remove(file_path + PARTS_SUFFIX)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"删除断点续传记录失败: {e}")
+
+
+def has_part_bitmap(file_path):
+    """下载文件是否有断点续传记录，即可以只下载缺失的分片"""
+    return os.path.exists(file_path + PARTS_SUFFIX)
+
+
+class PartBitmap:
+    """
+    分片完成情况，保存在下载文件旁的 .parts 文件中
+
+    分片写入文件后才标记完成；记录与文件大小、分片大小或文件id不一致时视为无效，重新下载。
+    """
+
+    def __init__(self, file_path, file_id, file_size, part_size):
+        self.path = file_path + PARTS_SUFFIX
+        self.file_id = file_id
+        self.file_size = file_size
+        self.part_size = part_size
+        self.part_count = math.ceil(file_size / part_size)
+        self._bits = bytearray((self.part_count + 7) // 8)
+        self._unsaved = 0
+        self._removed = False
+        self._save_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, file_path, file_id, file_size, part_size):
+        """读取已有的记录，没有或无效时返回空记录"""
+        bitmap = cls(file_path, file_id, file_size, part_size)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != file_size:
+            return bitmap
+        try:
+            with open(bitmap.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if (data.get('file_id'), data.get('file_size'), data.get('part_size')) != (file_id, file_size, part_size):
+                return bitmap
+            bits = base64.b64decode(data['bits'])
+        except FileNotFoundError:
+            return bitmap
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"读取断点续传记录失败: {e}")
+            return bitmap
+        if len(bits) == len(bitmap._bits):
+            bitmap._bits[:] = bits
+        return bitmap
+
+    def is_done(self, index):
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def mark(self, index):
+        self._bits[index >> 3] |= 1 << (index & 7)
+        self._unsaved += 1
+        if self._unsaved >= PARTS_SAVE_INTERVAL:
+            _write_executor.submit(self.save)
+
+    def done_count(self):
+        return sum(bin(b).count('1') for b in self._bits)
+
+    def done_bytes(self):
+        done = self.done_count() * self.part_size
+        # 最后一个分片不足part_size
+        if self.part_count and self.is_done(self.part_count - 1):
+            done -= self.part_count * self.part_size - self.file_size
+        return done
+
+    def missing_offsets(self):
+        return [i * self.part_size for i in range(self.part_count) if not self.is_done(i)]
+
+    def save(self):
+        """原子写入记录文件"""
+        with self._save_lock:
+            # 下载完成删除记录后，不再写入排队中的保存
+            if self._removed:
+                return
+            self._unsaved = 0
+            data = {
+                'file_id': self.file_id,
+                'file_size': self.file_size,
+                'part_size': self.part_size,
+                'bits': base64.b64encode(bytes(self._bits)).decode('ascii')
+            }
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"保存断点续传记录失败: {e}")
+
+    def remove(self):
+        with self._save_lock:
+            self._removed = True
+            remove_part_bitmap(self.path[:-len(PARTS_SUFFIX)])
+
+
+def normalize_part_size(part_size):
+    """取不超过part_size的最大合法分片大小（4KB~1MB之间的2的幂）"""
+    size = MIN_PART_SIZE
+    while size * 2 <= min(int(part_size), MAX_PART_SIZE):
+        size *= 2
+    return size
+
+
+class AdaptiveConcurrency:
+    """
+    分片请求的自适应并发（AIMD）
+
+    从最大并发开始；遇到FloodWait并发减半，请求过慢并发减一；
+    连续成功的请求数达到当前并发数时并发加一，直到最大并发。
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max(int(max_limit), 1)
+        self.limit = self.max_limit
+        self._active = 0
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while self._active >= self.limit:
+                await self._cond.wait()
+            self._active += 1
+
+    async def release(self):
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency):
+        if latency > SLOW_CHUNK_SECONDS:
+            self.limit = max(self.limit - 1, 1)
+            self._successes = 0
+            return
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self._successes = 0
+
+    def on_flood_wait(self):
+        self.limit = max(self.limit // 2, 1)
+        self._successes = 0
+
+
+class ExportedSenderPool:
+    """
+    跨DC下载的连接池
+
+    文件不在当前账号所在DC时，需要向文件所在DC导出授权后新建连接。
+    每个DC只导出一次授权，之后的连接复用同一个auth_key；
+    下载结束后连接放回池中，后续下载同一DC的文件时直接复用。
+    """
+
+    def __init__(self, client):
+        self._client = client
+        # {dc_id: AuthKey}
+        self._auth_keys = {}
+        # {dc_id: [MTProtoSender]}
+        self._idle = {}
+        self._locks = {}
+
+    async def _create_sender(self, dc_id):
+        client = self._client
+        dc = await client._get_dc(dc_id)
+        sender = MTProtoSender(self._auth_keys.get(dc_id), loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address,
+            dc.port,
+            dc.id,
+            loggers=client._log,
+            proxy=client._proxy,
+            local_addr=client._local_addr
+        ))
+        if dc_id not in self._auth_keys:
+            logger.info(f"正在为 DC {dc_id} 导出授权")
+            try:
+                auth = await client(ExportAuthorizationRequest(dc_id))
+                client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+                await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+            except Exception:
+                await sender.disconnect()
+                raise
+            self._auth_keys[dc_id] = sender.auth_key
+        return sender
+
+    async def acquire(self, dc_id, count):
+        """获取最多count个连接到dc_id的sender，至少返回一个，否则抛出异常"""
+        lock = self._locks.setdefault(dc_id, asyncio.Lock())
+        async with lock:
+            senders = []
+            idle = self._idle.setdefault(dc_id, [])
+            while idle and len(senders) < count:
+                sender = idle.pop()
+                if sender.is_connected():
+                    senders.append(sender)
+                else:
+                    await sender.disconnect()
+            while len(senders) < count:
+                try:
+                    senders.append(await self._create_sender(dc_id))
+                except Exception as e:
+                    if senders:
+                        logger.warning(f"连接 DC {dc_id} 失败，使用已有的{len(senders)}个连接: {e}")
+                        break
+                    if dc_id not in self._auth_keys:
+                        raise
+                    # 导出的授权可能已失效，重新导出一次
+                    logger.warning(f"使用已导出的授权连接 DC {dc_id} 失败，重新导出: {e}")
+                    del self._auth_keys[dc_id]
+            return senders
+
+    async def release(self, dc_id, senders):
+        """下载结束后放回连接，超出空闲上限或已断开的连接直接关闭"""
+        idle = self._idle.setdefault(dc_id, [])
+        for sender in senders:
+            if sender.is_connected() and len(idle) < MAX_IDLE_SENDERS:
+                idle.append(sender)
+            else:
+                await sender.disconnect()
+
+
+def get_sender_pool(client):
+    pool = _sender_pools.get(client)
+    if pool is None:
+        pool = _sender_pools[client] = ExportedSenderPool(client)
+    return pool
+
+
+async def _fetch_part(request, input_location, offset, part_size, limiter, should_stop=None):
+    """
+    下载一个分片，FloodWait时按要求等待并降低并发，其他错误重试 CHUNK_RETRIES 次
+    :return: 分片数据，should_stop() 为真时返回None
+    """
+    retries = CHUNK_RETRIES
+    while True:
+        if should_stop is not None and should_stop():
+            return None
+        await limiter.acquire()
+        start = time.monotonic()
+        flood_wait = None
+        try:
+            # 固定请求整个分片大小（满足Telegram对limit的要求），最后一片返回实际剩余字节
+            result = await request(GetFileRequest(
+                location=input_location,
+                offset=offset,
+                limit=part_size
+            ))
+        except FloodWaitError as e:
+            limiter.on_flood_wait()
+            logger.warning(f"分片下载触发FloodWait，等待{e.seconds}秒，并发降为{limiter.limit}")
+            flood_wait = e.seconds
+        except Exception as e:
+            retries -= 1
+            if retries == 0:
+                logger.error(f"分片下载失败 offset={offset}: {e}")
+                raise e
+            await asyncio.sleep(1)
+            continue
+        finally:
+            await limiter.release()
+        if flood_wait is not None:
+            # 释放并发名额后再等待，等待期间不占用已经降低的并发
+            await asyncio.sleep(flood_wait)
+            continue
+        limiter.on_success(time.monotonic() - start)
+        return result.bytes
+
+
+class TelegramFileStream:
+    """
+    不落盘读取Telegram文件：按顺序产生分片，预取的分片数有上限，内存占用与文件大小无关
+    用法：
+        stream = TelegramFileStream(client, message)
+        if await stream.open():
+            async for offset, data in stream.iter_parts():
+                ...
+            await stream.close()
+    """
+
+    def __init__(self, client: TelegramClient, message, threads=DEFAULT_THREADS, part_size=DEFAULT_PART_SIZE):
+        self._client = client
+        self._message = message
+        self.threads = threads
+        self.part_size = normalize_part_size(part_size)
+        self.file_size = 0
+        self._input_location = None
+        self._requests = []
+        self._senders = None
+        self._dc_id = None
+        self._limiter = None
+
+    async def open(self):
+        """解析文件位置并准备连接，不支持流式读取时返回False"""
+        document = getattr(self._message.media, 'document', None)
+        if not document:
+            return False
+        self._input_location = utils.get_input_location(document)
+        if not self._input_location:
+            return False
+        self.file_size = document.size
+        client = self._client
+        self._dc_id = getattr(document, 'dc_id', client.session.dc_id)
+        if self._dc_id != client.session.dc_id:
+            self._senders = await get_sender_pool(client).acquire(self._dc_id, self.threads)
+            self._requests = [sender.send for sender in self._senders]
+        else:
+            self._requests = [client] * self.threads
+        self._limiter = AdaptiveConcurrency(len(self._requests))
+        return True
+
+    async def iter_parts(self, start=0, end=None):
+        """
+        按顺序产生 (offset, data)，覆盖 [start, end) 所在的分片
+        同时预取的分片数不超过并发连接数
+        """
+        end = self.file_size if end is None else min(end, self.file_size)
+        next_offset = start - start % self.part_size
+        pending = collections.deque()
+        index = 0
+        try:
+            while pending or next_offset < end:
+                while next_offset < end and len(pending) < len(self._requests):
+                    request = self._requests[index % len(self._requests)]
+                    index += 1
+                    pending.append((next_offset, asyncio.create_task(_fetch_part(
+                        request, self._input_location, next_offset, self.part_size, self._limiter))))
+                    next_offset += self.part_size
+                offset, task = pending.popleft()
+                yield offset, await task
+        finally:
+            _cancel_tasks([task for _, task in pending])
+
+    async def read_range(self, start, end):
+        """读取 [start, end]（含end）的数据，用于计算115上传的sign_check"""
+        data = bytearray()
+        async for offset, chunk in self.iter_parts(start, end + 1):
+            lo = max(start - offset, 0)
+            hi = min(end + 1 - offset, len(chunk))
+            data += chunk[lo:hi]
+        return bytes(data)
+
+    async def close(self):
+        if self._senders:
+            await get_sender_pool(self._client).release(self._dc_id, self._senders)
+            self._senders = None
+
+
+def _cancel_tasks(tasks):
+    for t in tasks:
+        if not t.done():
+            t.cancel()
+
+
+async def _download_media_fallback(client, message, file_path, progress_callback):
+    """
+    回退到单线程下载：先写入单独的临时文件，成功后替换下载文件并删除断点续传记录，
+    失败或中断时保留已下载的分片，之后重试仍然只下载缺失的分片
+    """
+    fallback_path = file_path + FALLBACK_SUFFIX
+    try:
+        result = await client.download_media(message, file=fallback_path, progress_callback=progress_callback)
+    except BaseException:
+        _remove_file(fallback_path)
+        raise
+    if not result:
+        _remove_file(fallback_path)
+        return None
+    os.replace(result, file_path)
+    remove_part_bitmap(file_path)
+    return file_path
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"删除临时文件失败: {e}")
+
+
+async def download_file_parallel(client: TelegramClient, message, file_path, progress_callback=None, threads=DEFAULT_THREADS, cancel_event=None, hasher=None, part_size=DEFAULT_PART_SIZE):
     """
     使用多线程分片下载 Telegram 文件
+    已完成的分片记录在 file_path.parts 中，分片失败重试或重启后再次下载同一文件时只下载缺失的分片
+    :param threads: 最大并发连接数，实际并发根据FloodWait和请求耗时自动调整
+    :param part_size: 分片大小，最大1MB
+    :param hasher: StreamingSha1，分片写入后按偏移顺序计算SHA1，下载完成时即可得到文件的SHA1；
+                   使用默认下载或断点续传时不会计算，调用方需通过 hasher.complete() 判断
     """
+    senders = None
+    dc_id = None
     try:
         media = message.media
         document = getattr(media, 'document', None)
@@ -22,10 +524,16 @@ async def download_file_parallel(client: TelegramClient, message, file_path, pro
             
         file_size = document.size
         
-        # 检查 DC ID，如果文件在不同 DC，回退到默认下载（处理跨 DC 比较复杂）
-        if hasattr(document, 'dc_id') and document.dc_id != client.session.dc_id:
-            logger.info(f"文件在 DC {document.dc_id}，当前在 DC {client.session.dc_id}，回退到单线程下载")
-            return await client.download_media(message, file=file_path, progress_callback=progress_callback)
+        # 文件在其他 DC 时，使用导出授权的连接池并行下载
+        dc_id = getattr(document, 'dc_id', client.session.dc_id)
+        if dc_id != client.session.dc_id:
+            try:
+                senders = await get_sender_pool(client).acquire(dc_id, threads)
+            except Exception as e:
+                logger.info(f"文件在 DC {dc_id}，连接失败: {e}，回退到单线程下载")
+                return await _download_media_fallback(client, message, file_path, progress_callback)
+            threads = len(senders)
+            logger.info(f"文件在 DC {dc_id}，当前在 DC {client.session.dc_id}，使用{threads}个连接并行下载")
 
         # 获取 input_location，明确传入 document
         input_location = utils.get_input_location(document)
@@ -33,77 +541,125 @@ async def download_file_parallel(client: TelegramClient, message, file_path, pro
         # 确保 input_location 是有效的 TLObject
         if not input_location:
             logger.warning("无法获取有效的 input_location，回退到单线程下载")
-            return await client.download_media(message, file=file_path, progress_callback=progress_callback)
+            return await _download_media_fallback(client, message, file_path, progress_callback)
 
-        # 分片大小 512KB
-        part_size = 512 * 1024 
+        part_size = normalize_part_size(part_size)
         
         # 确保目录存在
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-        # 初始化文件（预分配空间）
-        with open(file_path, 'wb') as f:
-            f.truncate(file_size)
+        # 跨 DC 时每个worker使用独立的连接，同 DC 时共用客户端
+        requests = [sender.send for sender in senders] if senders else [client] * threads
 
-        downloaded = 0
-        progress_lock = asyncio.Lock()
-        sem = asyncio.Semaphore(threads)
-        
-        # 错误标记，如果任何一个分片失败，停止所有任务
-        failed = False
+        bitmap = PartBitmap.load(file_path, document.id, file_size, part_size)
+        if bitmap.done_count():
+            logger.info(f"断点续传: 已完成{bitmap.done_count()}/{bitmap.part_count}个分片")
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            # 已有分片不会再经过hasher，无法按顺序计算
+            if hasher is not None and bitmap.done_count():
+                await hasher.invalidate()
+            try:
+                await _download_parts(requests, input_location, file_path, file_size, part_size, bitmap,
+                                      progress_callback, cancel_event, hasher)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if cancel_event and cancel_event.is_set():
+                    raise asyncio.CancelledError("用户取消下载")
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    raise
+                logger.warning(f"多线程下载失败: {e}，第{attempt}次重试，只下载缺失的{len(bitmap.missing_offsets())}个分片")
+
+        bitmap.remove()
+        return file_path
+
+    except asyncio.CancelledError:
+        # 只有用户取消时清理文件；关闭机器人等其他原因中断时保留已下载的分片，
+        # 再次下载时续传，不再需要时由 TempStorageManager.clean_orphans 按 resume_max_age 清理
+        if cancel_event and cancel_event.is_set():
+            logger.info("下载已取消")
+            remove_part_bitmap(file_path)
+            _remove_file(file_path)
+        else:
+            logger.info("下载被中断，保留已下载的分片")
+        raise
 
-        async def download_chunk(offset):
-            nonlocal downloaded, failed
-            if failed: return
+    except Exception as e:
+        if hasher is not None:
+            await hasher.invalidate()
+        if cancel_event and cancel_event.is_set():
+            raise asyncio.CancelledError("用户取消下载")
             
-            # 检查取消信号
-            if cancel_event and cancel_event.is_set():
-                failed = True
+        logger.error(f"多线程下载遇到错误: {e}，正在回退到单线程下载...")
+        # 如果多线程下载失败，回退到原生下载
+        return await _download_media_fallback(client, message, file_path, progress_callback)
+
+    finally:
+        # 跨 DC 的连接放回连接池
+        if senders:
+            await get_sender_pool(client).release(dc_id, senders)
+
+
+async def _download_parts(requests, input_location, file_path, file_size, part_size, bitmap,
+                          progress_callback, cancel_event, hasher):
+    """由固定数量的worker下载bitmap中缺失的分片，任何分片最终失败时抛出异常"""
+    offsets = asyncio.Queue()
+    for offset in bitmap.missing_offsets():
+        offsets.put_nowait(offset)
+    if offsets.empty():
+        return
+
+    # 打开文件并预分配空间，整个下载过程共用一个文件描述符
+    writer = ChunkWriter(file_path, file_size)
+    limiter = AdaptiveConcurrency(len(requests))
+    downloaded = bitmap.done_bytes()
+    tasks = []
+
+    # 错误标记，如果任何一个分片失败，停止所有任务
+    failed = False
+
+    def should_stop():
+        nonlocal failed
+        if failed or (cancel_event and cancel_event.is_set()):
+            failed = True
+        return failed
+
+    async def fetch_chunk(offset, request):
+        nonlocal failed
+        try:
+            return await _fetch_part(request, input_location, offset, part_size, limiter, should_stop)
+        except Exception:
+            failed = True
+            raise
+
+    async def worker(request):
+        nonlocal downloaded
+        while not failed:
+            try:
+                offset = offsets.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            chunk_data = await fetch_chunk(offset, request)
+            if chunk_data is None:
                 return
 
-            retries = 5
-            while retries > 0 and not failed:
-                if cancel_event and cancel_event.is_set():
-                    failed = True
-                    return
-                    
-                try:
-                    async with sem:
-                        current_part_size = part_size
-                        if offset + current_part_size > file_size:
-                            current_part_size = file_size - offset
-                            
-                        result = await client(GetFileRequest(
-                            location=input_location,
-                            offset=offset,
-                            limit=current_part_size
-                        ))
-                        
-                        chunk_data = result.bytes
-                        
-                        with open(file_path, 'r+b') as f:
-                            f.seek(offset)
-                            f.write(chunk_data)
-                        
-                        async with progress_lock:
-                            downloaded += len(chunk_data)
-                            if progress_callback:
-                                if asyncio.iscoroutinefunction(progress_callback):
-                                    await progress_callback(downloaded, file_size)
-                                else:
-                                    progress_callback(downloaded, file_size)
-                        return
-                except Exception as e:
-                    retries -= 1
-                    if retries == 0:
-                        logger.error(f"分片下载失败 offset={offset}: {e}")
-                        failed = True
-                        raise e
-                    await asyncio.sleep(1)
+            # 释放并发名额后再写入和计算，等待写入或前面分片时不占用下载并发
+            # 写入完成后才在bitmap中标记该分片
+            await writer.write(offset, chunk_data, on_written=lambda o=offset: bitmap.mark(o // part_size))
+            if hasher is not None:
+                await hasher.feed(offset, chunk_data)
 
-        tasks = []
-        for offset in range(0, file_size, part_size):
-            tasks.append(asyncio.create_task(download_chunk(offset)))
+            downloaded += len(chunk_data)
+            if progress_callback:
+                if asyncio.iscoroutinefunction(progress_callback):
+                    await progress_callback(downloaded, file_size)
+                else:
+                    progress_callback(downloaded, file_size)
+
+    try:
+        for i in range(min(len(requests), offsets.qsize())):
+            tasks.append(asyncio.create_task(worker(requests[i])))
 
         # 使用 asyncio.wait 监控任务和取消事件
         if cancel_event:
@@ -119,9 +675,7 @@ async def download_file_parallel(client: TelegramClient, message, file_path, pro
                 logger.info("检测到取消信号，立即停止所有下载任务")
                 # 取消所有下载任务
                 download_future.cancel()
-                for t in tasks:
-                    if not t.done():
-                        t.cancel()
+                _cancel_tasks(tasks)
                 # 等待任务清理完成
                 try:
                     await download_future
@@ -139,24 +693,9 @@ async def download_file_parallel(client: TelegramClient, message, file_path, pro
             if cancel_event and cancel_event.is_set():
                 raise asyncio.CancelledError("用户取消下载")
             raise Exception("多线程下载中有分片失败")
-            
-        return file_path
 
-    except asyncio.CancelledError:
-        logger.info("下载已取消")
-        # 确保清理文件
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except:
-                pass
-        raise
-
-    except Exception as e:
-        if cancel_event and cancel_event.is_set():
-            raise asyncio.CancelledError("用户取消下载")
-            
-        logger.error(f"多线程下载遇到错误: {e}，正在回退到单线程下载...")
-        # 如果多线程下载失败，回退到原生下载
-        # 确保文件被重置或覆盖
-        return await client.download_media(message, file=file_path, progress_callback=progress_callback)
+        await writer.flush()
+    finally:
+        _cancel_tasks(tasks)
+        await writer.close()
+        bitmap.save()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# 每次读取的块大小，内存占用只与块大小有关，与文件大小无关
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# 哈希计算线程数，同时计算的文件过多时磁盘会成为瓶颈
+DEFAULT_HASH_WORKERS = 2
+# 115上传接口的preid为文件前128KB的SHA1
+PREID_SIZE = 128 * 1024
+# 边下载边计算时，等待前面分片到达而暂存的最大字节数
+DEFAULT_MAX_PENDING = 32 * 1024 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=DEFAULT_HASH_WORKERS, thread_name_prefix="file-hash")
+
+
+def hash_file(file_path, ranges=(), chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    流式读取文件，一次遍历同时计算整个文件的SHA1和若干区间的SHA1
+    :param ranges: [(start, end)]，区间包含end，与115上传接口的sign_check一致
+    :return: (整个文件的sha1, {(start, end): sha1})，均为小写hex
+    """
+    full = hashlib.sha1()
+    range_hashes = {(int(start), int(end)): hashlib.sha1() for start, end in ranges}
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    offset = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            chunk = view[:n]
+            full.update(chunk)
+            chunk_end = offset + n
+            for (start, end), h in range_hashes.items():
+                # 区间与当前块的重叠部分
+                lo = max(start, offset)
+                hi = min(end + 1, chunk_end)
+                if lo < hi:
+                    h.update(chunk[lo - offset:hi - offset])
+            offset = chunk_end
+    return full.hexdigest(), {key: h.hexdigest() for key, h in range_hashes.items()}
+
+
+def file_sha1(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """计算整个文件的SHA1"""
+    return hash_file(file_path, chunk_size=chunk_size)[0]
+
+
+def file_sha1_by_range(file_path, start, end, chunk_size=DEFAULT_CHUNK_SIZE):
+    """计算文件从start到end（含end）的SHA1，只读取该区间"""
+    sha1 = hashlib.sha1()
+    remaining = end - start + 1
+    buffer = bytearray(min(chunk_size, max(remaining, 0)))
+    view = memoryview(buffer)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        while remaining > 0:
+            n = f.readinto(view[:min(remaining, chunk_size)])
+            if not n:
+                break
+            sha1.update(view[:n])
+            remaining -= n
+    return sha1.hexdigest()
+
+
+class StreamingSha1:
+    """
+    边下载边计算SHA1
+
+    分片可以乱序调用feed，先到的分片暂存在内存中，按偏移顺序计算整个文件的SHA1和preid；
+    暂存超过max_pending时，非下一个分片的feed会等待，避免内存无限增长。
+    下载失败或回退到其他下载方式时调用invalidate，调用方需要重新读取文件计算。
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING):
+        self.max_pending = max_pending
+        self._sha1 = hashlib.sha1()
+        self._preid = hashlib.sha1()
+        self._pending = {}
+        self._pending_bytes = 0
+        self._cond = asyncio.Condition()
+        # 已按顺序计算到的偏移
+        self.offset = 0
+        self.valid = True
+
+    def _update(self, data):
+        if self.offset < PREID_SIZE:
+            self._preid.update(data[:PREID_SIZE - self.offset])
+        self._sha1.update(data)
+        self.offset += len(data)
+
+    async def feed(self, offset, data):
+        """提交一个分片，offset为分片在文件中的偏移"""
+        async with self._cond:
+            while self.valid and offset != self.offset and self._pending_bytes + len(data) > self.max_pending:
+                await self._cond.wait()
+            if not self.valid or offset < self.offset or offset in self._pending:
+                return
+            if offset != self.offset:
+                self._pending[offset] = data
+                self._pending_bytes += len(data)
+                return
+            self._update(data)
+            while self.offset in self._pending:
+                data = self._pending.pop(self.offset)
+                self._pending_bytes -= len(data)
+                self._update(data)
+            self._cond.notify_all()
+
+    async def invalidate(self):
+        """放弃边下载边计算的结果"""
+        async with self._cond:
+            self.valid = False
+            self._pending.clear()
+            self._pending_bytes = 0
+            self._cond.notify_all()
+
+    def complete(self, file_size):
+        """是否已经按顺序计算完整个文件"""
+        return self.valid and self.offset == file_size and not self._pending
+
+    def hexdigest(self):
+        return self._sha1.hexdigest()
+
+    def preid(self):
+        return self._preid.hexdigest()
+
+
+async def hash_file_async(file_path, ranges=(), chunk_size=DEFAULT_CHUNK_SIZE):
+    """在哈希线程池中计算，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, hash_file, file_path, ranges, chunk_size)
+
+
+async def file_sha1_async(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    return (await hash_file_async(file_path, chunk_size=chunk_size))[0]
+
+
+async def file_sha1_by_range_async(file_path, start, end, chunk_size=DEFAULT_CHUNK_SIZE):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, file_sha1_by_range, file_path, start, end, chunk_size)
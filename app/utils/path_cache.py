@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+
+
+class PathCache:
+    """
+    115路径 -> 文件信息缓存（线程安全）
+
+    - LRU淘汰：超过 max_size 时淘汰最久未使用的条目
+    - TTL：每个条目单独记录过期时间，过期后视为未命中
+    - 负缓存：记录不存在的路径，短时间内不再重复请求
+    - 前缀失效：目录被重命名/删除/移动时，连同其下所有子路径一起失效
+    - 版本号：每次失效后递增，失效前开始的查询结果不再写入缓存
+    - 持久化：可保存为JSON快照，重启后加载（负缓存不持久化）
+    """
+
+    def __init__(self, max_size=5000, ttl=86400, negative_ttl=60, snapshot_file=None):
+        self.max_size = max(int(max_size), 1)
+        self.ttl = float(ttl)
+        self.negative_ttl = float(negative_ttl)
+        self.snapshot_file = snapshot_file
+        # path -> (data, expires_at)，data为None表示负缓存
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 失效版本号，查询前记录，写入时不一致说明查询期间发生了写操作
+        self.generation = 0
+        # 统计信息
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def normalize(path):
+        """统一路径格式：以/开头，去掉多余的/和末尾的/"""
+        path = str(path).replace("\\", "/").strip()
+        if not path.startswith("/"):
+            path = "/" + path
+        return posixpath.normpath(path).replace("//", "/")
+
+    def get(self, path):
+        """
+        查询缓存
+        :return: (found, data) found为False表示未命中；found为True且data为None表示路径不存在（负缓存）
+        """
+        key = self.normalize(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            data, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if data is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, data
+
+    def set(self, path, data, ttl=None, generation=None):
+        """
+        写入缓存
+        :param generation: 查询前的版本号，之后发生过失效时不写入
+        """
+        if data is None:
+            return
+        self._put(self.normalize(path), data, self.ttl if ttl is None else ttl, generation)
+
+    def set_missing(self, path, generation=None):
+        """记录不存在的路径"""
+        if self.negative_ttl > 0:
+            self._put(self.normalize(path), None, self.negative_ttl, generation)
+
+    def _put(self, key, data, ttl, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (data, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """失效单个路径"""
+        key = self.normalize(path)
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def invalidate_prefix(self, path):
+        """失效路径本身及其下所有子路径"""
+        key = self.normalize(path)
+        prefix = key.rstrip("/") + "/"
+        with self._lock:
+            self.generation += 1
+            for k in [k for k in self._entries if k == key or k.startswith(prefix)]:
+                del self._entries[k]
+
+    def invalidate_file_id(self, file_id):
+        """按file_id失效，用于只知道ID不知道路径的操作（如按ID删除/重命名）"""
+        file_id = str(file_id)
+        with self._lock:
+            self.generation += 1
+            paths = [k for k, (data, _) in self._entries.items()
+                     if isinstance(data, dict) and str(data.get('file_id', '')) == file_id]
+        for path in paths:
+            self.invalidate_prefix(path)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """缓存统计信息"""
+        lookups = self.hits + self.negative_hits + self.misses
+        hit_rate = (self.hits + self.negative_hits) / lookups * 100 if lookups else 0.0
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(hit_rate, 2)
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.negative_hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.expirations = 0
+
+    def load(self, file_path=None):
+        """从快照加载缓存，返回加载的条目数"""
+        file_path = file_path or self.snapshot_file
+        if not file_path or not os.path.exists(file_path):
+            return 0
+        with open(file_path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, data, expires_at in snapshot.get('entries', []):
+                if data is None or expires_at <= now:
+                    continue
+                self._entries[key] = (data, expires_at)
+                loaded += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return loaded
+
+    def save(self, file_path=None):
+        """保存缓存快照（先写临时文件再替换，避免写一半被读取）"""
+        file_path = file_path or self.snapshot_file
+        if not file_path:
+            return 0
+        now = time.time()
+        with self._lock:
+            entries = [[key, data, expires_at] for key, (data, expires_at) in self._entries.items()
+                       if data is not None and expires_at > now]
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": 1, "entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+        return len(entries)
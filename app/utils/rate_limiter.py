@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶限流器（线程安全）
+
+    - rate: 每秒补充的令牌数
+    - burst: 桶容量，即允许的最大突发请求数
+    - weights: 不同接口消耗的令牌数 {endpoint: weight}，未配置的接口消耗1个
+
+    锁内只做令牌预约：令牌不足时记为欠账，后到的请求排在欠账之后，
+    因此等待顺序天然先到先得（FIFO）；真正的等待在锁外完成，不会让所有线程排队卡在同一把锁上。
+    """
+
+    def __init__(self, rate=2.0, burst=2, weights=None):
+        if rate <= 0:
+            raise ValueError("rate 必须大于0")
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.weights = dict(weights or {})
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        # 统计信息
+        self.total_requests = 0
+        self.total_waited = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._last
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._last = now
+
+    def get_weight(self, endpoint=None):
+        """获取接口对应的令牌消耗"""
+        if endpoint is None:
+            return 1
+        return self.weights.get(endpoint, 1)
+
+    def reserve(self, weight=1):
+        """预约令牌，返回调用方需要等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= weight
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            self.total_requests += 1
+            if wait > 0:
+                self.total_waited += 1
+                self.total_wait_time += wait
+                self.max_wait_time = max(self.max_wait_time, wait)
+            return wait
+
+    def acquire(self, weight=1):
+        """阻塞直到获得令牌，返回实际等待的秒数"""
+        wait = self.reserve(weight)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, weight=1):
+        """协程版本的acquire，等待期间不阻塞事件循环"""
+        wait = self.reserve(weight)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    @property
+    def tokens(self):
+        """当前可用令牌数（负数表示已有请求在排队）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+    def wait_time(self, weight=1):
+        """预估新请求需要等待的秒数"""
+        remaining = self.tokens - weight
+        return 0.0 if remaining >= 0 else -remaining / self.rate
+
+    def metrics(self):
+        """限流统计信息"""
+        avg_wait = self.total_wait_time / self.total_waited if self.total_waited else 0.0
+        return {
+            "tokens": round(self.tokens, 2),
+            "wait_time": round(self.wait_time(), 2),
+            "total_requests": self.total_requests,
+            "total_waited": self.total_waited,
+            "avg_wait_time": round(avg_wait, 3),
+            "max_wait_time": round(self.max_wait_time, 3)
+        }
+
+    def reset_metrics(self):
+        """重置统计信息"""
+        with self._lock:
+            self.total_requests = 0
+            self.total_waited = 0
+            self.total_wait_time = 0.0
+            self.max_wait_time = 0.0
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    请求合并（线程版）
+
+    同一个key同时只有一个线程真正执行，其余并发调用等待并共享这次执行的结果（或异常），
+    用于合并并发的相同只读请求，减少115请求次数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # 被合并（未实际发起请求）的调用次数
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                # 已被 forget 丢弃时，key可能已经属于新的请求
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def forget(self, match):
+        """
+        写操作之后调用，丢弃进行中的请求，之后的调用重新发起请求，不再共享写之前开始的结果；
+        已经在等待的调用仍然得到原来的结果
+        :param match: key，或判断key是否需要丢弃的函数
+        """
+        with self._lock:
+            for key in [key for key in self._calls if (match(key) if callable(match) else key == match)]:
+                del self._calls[key]
+
+    def reset_metrics(self):
+        self.coalesced = 0
+
+
+class AsyncSingleFlight:
+    """请求合并（协程版），只在同一个事件循环内合并；forget 可以在其他线程中调用"""
+
+    def __init__(self):
+        # 多个事件循环和同步线程中的 forget 会同时访问 _calls
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            task = self._calls.get(key)
+            if task is not None:
+                self.coalesced += 1
+        if task is not None:
+            # shield: 某个等待者被取消时不影响其他等待者
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(fn(*args, **kwargs))
+        with self._lock:
+            self._calls[key] = task
+        task.add_done_callback(lambda _: self._done(key, task))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        with self._lock:
+            # 已被 forget 丢弃时，key可能已经属于新的请求
+            if self._calls.get(key) is task:
+                del self._calls[key]
+
+    def forget(self, match):
+        """写操作之后调用，丢弃所有事件循环中进行中的请求，参数同 SingleFlight.forget"""
+        with self._lock:
+            for key in [key for key in self._calls if (match(key[1]) if callable(match) else key[1] == match)]:
+                del self._calls[key]
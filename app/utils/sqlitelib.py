@@ -1,11 +1,60 @@
 # -*- coding: utf-8 -*-
 
 import sqlite3
+import threading
+import time
 import init
+from contextlib import contextmanager
 from typing import Optional
 
+# 等待其他连接释放写锁的时间(秒)
+BUSY_TIMEOUT = 30
+# 批量去重时每次 IN 查询的参数个数，低于SQLite的参数数量上限
+BULK_QUERY_SIZE = 500
+# 状态更新缓冲区：累积的更新条数或最早一条等待的时间(秒)超过阈值时写入
+DEFAULT_UPDATE_BUFFER_SIZE = 200
+DEFAULT_UPDATE_BUFFER_DELAY = 30
+
+# 每个线程复用自己的连接 {db_file: sqlite3.Connection}，线程退出时连接随之释放
+_local = threading.local()
+
+
+def _create_connection(db_file: str):
+    # isolation_level=None: 不开启隐式事务，单条语句自动提交，批量写入使用 transaction()
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, isolation_level=None)
+    # WAL模式下读写互不阻塞，synchronous=NORMAL 只在checkpoint时fsync
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}")
+    return conn
+
+
+def get_connection(db_file: str):
+    """获取当前线程的连接，不存在时创建"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_file)
+    if conn is None:
+        conn = connections[db_file] = _create_connection(db_file)
+    return conn
+
+
+def close_connection(db_file: Optional[str] = None):
+    """关闭当前线程的连接，db_file为空时关闭全部"""
+    connections = getattr(_local, 'connections', None) or {}
+    for key in [db_file] if db_file else list(connections):
+        conn = connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+
 
 class SqlLiteLib:
+    """
+    数据库访问，同一线程内的多个实例共用一个连接。
+    execute_sql 在事务外自动提交；批量写入放在 transaction() 中，只在结束时提交一次。
+    """
+
     def __init__(self):
         self.conn: Optional[sqlite3.Connection] = None
         self.cursor: Optional[sqlite3.Cursor] = None
@@ -19,22 +68,84 @@ class SqlLiteLib:
         self.close()  # 自动关闭连接
 
     def connect(self, db_file:str):
-        self.conn = sqlite3.connect(db_file)
+        self.conn = get_connection(db_file)
         self.cursor = self.conn.cursor()
 
+    @contextmanager
+    def transaction(self):
+        """
+        事务范围，正常结束时提交，抛出异常时回滚。
+        开始时即获取写锁，避免事务中途升级写锁失败；嵌套使用时并入外层事务。
+        事务中不要await或执行耗时的网络请求，否则会一直占用写锁。
+        """
+        if self.conn.in_transaction:
+            yield self
+            return
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            raise
+        else:
+            if self.conn.in_transaction:
+                self.conn.commit()
+
     def execute_sql(self, sql: str, params: tuple = ()):
+        """执行写入语句，返回影响的行数（INSERT OR IGNORE 被忽略时为0），出错时返回None"""
         try:
             self.cursor.execute(sql, params)
-            self.conn.commit()
+            return self.cursor.rowcount
         except Exception as e:
-            self.conn.rollback()
+            # 事务中出错的语句本身不生效，其余语句由事务统一提交或回滚
             self.logger.error(f"执行查询时发生错误: {e}, sql: {sql}")
+            return None
+
+    def existing_values(self, table: str, column: str, values):
+        """返回values中已存在于table.column的值，按批查询，column需要有索引"""
+        values = list({value for value in values if value is not None})
+        existing = set()
+        for i in range(0, len(values), BULK_QUERY_SIZE):
+            chunk = values[i:i + BULK_QUERY_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            self.cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})", chunk)
+            existing.update(row[0] for row in self.cursor.fetchall())
+        return existing
+
+    def bulk_insert(self, table: str, records, keys=('info_hash',)):
+        """
+        批量写入记录
+        先按keys中的列（需要有索引）批量查询已存在的记录，同一批中重复的记录只保留第一条，
+        其余记录在一个事务中通过一次 executemany 写入；为空的键不参与去重。
+        :param records: 字典列表，所有记录的列相同
+        :return: (写入条数, 跳过条数)
+        """
+        if not records:
+            return 0, 0
+        columns = list(records[0])
+        sql = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        with self.transaction():
+            existing = {key: self.existing_values(table, key, (record.get(key) for record in records)) for key in keys}
+            rows = []
+            for record in records:
+                values = [(key, record.get(key)) for key in keys if record.get(key) is not None]
+                if any(value in existing[key] for key, value in values):
+                    continue
+                for key, value in values:
+                    existing[key].add(value)
+                rows.append(tuple(record[column] for column in columns))
+            if not rows:
+                return 0, len(records)
+            self.cursor.executemany(sql, rows)
+            inserted = self.cursor.rowcount
+        return inserted, len(records) - inserted
 
     def query(self, sql: str, params: tuple = ()):
         self.cursor.execute(sql, params)
         res_list = self.cursor.fetchall()
         return res_list
-    
+
     def query_all(self, sql: str, params: tuple = ()):
         """查询所有记录，返回字典列表"""
         try:
@@ -45,7 +156,7 @@ class SqlLiteLib:
         except Exception as e:
             self.logger.error(f"执行查询时发生错误: {e}, sql: {sql}")
             return []
-    
+
     def query_one(self, sql: str, params=None):
         try:
             self.cursor.execute(sql, params or ())
@@ -54,7 +165,7 @@ class SqlLiteLib:
         except Exception as e:
             self.logger.error(f"执行查询时发生错误: {e}, sql: {sql}")
             return None
-            
+
     def query_row(self, sql: str, params=None):
         try:
             self.cursor.execute(sql, params or ())
@@ -64,7 +175,64 @@ class SqlLiteLib:
             self.logger.error(f"执行查询时发生错误: {e}, sql: {sql}")
 
     def close(self):
+        # 连接由线程复用，这里只释放游标
         if self.cursor is not None:
             self.cursor.close()
-        if self.conn is not None:
-            self.conn.close()
+            self.cursor = None
+        self.conn = None
+
+
+class UpdateBuffer:
+    """
+    按行id更新状态的写缓冲区
+    add 只在内存中记录，相同表和SET子句的更新合并为 UPDATE ... WHERE id IN (...)，
+    在一个事务中写入。达到数量或时间阈值时在add中写入，时间阈值只在add时检查，
+    调用方在一批处理结束时需要调用 flush。可以跨线程共用。
+    同一id的重复更新只写入一次，SET子句必须是幂等的（如 is_download = 1），
+    retry_count = retry_count + 1 这类自增更新不要使用缓冲区。
+    """
+
+    def __init__(self, max_size=DEFAULT_UPDATE_BUFFER_SIZE, max_delay=DEFAULT_UPDATE_BUFFER_DELAY):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        # {(table, set_clause): {id: None}}，保持加入顺序并去重
+        self._pending = {}
+        self._count = 0
+        self._first_added = 0
+
+    def add(self, table: str, set_clause: str, row_id):
+        with self._lock:
+            if not self._count:
+                self._first_added = time.monotonic()
+            ids = self._pending.setdefault((table, set_clause), {})
+            if row_id not in ids:
+                ids[row_id] = None
+                self._count += 1
+            due = self._count >= self.max_size or time.monotonic() - self._first_added >= self.max_delay
+        if due:
+            self.flush()
+
+    def flush(self):
+        """写入所有缓冲的更新，返回更新的行数"""
+        with self._lock:
+            pending, self._pending, self._count = self._pending, {}, 0
+        if not pending:
+            return 0
+        updated = 0
+        with SqlLiteLib() as sqlite:
+            with sqlite.transaction():
+                for (table, set_clause), ids in pending.items():
+                    ids = list(ids)
+                    for i in range(0, len(ids), BULK_QUERY_SIZE):
+                        chunk = ids[i:i + BULK_QUERY_SIZE]
+                        placeholders = ", ".join("?" * len(chunk))
+                        updated += sqlite.execute_sql(
+                            f"UPDATE {table} SET {set_clause} WHERE id IN ({placeholders})", chunk) or 0
+        return updated
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import asyncio
+import threading
+import init
+
+# 使用临时目录的子系统，每个子系统使用 TEMP 下的独立目录
+SUBSYSTEM_VIDEO = "video"
+SUBSYSTEM_SEHUA = "sehua"
+SUBSYSTEM_JAVBUS = "javbus"
+SUBSYSTEMS = (SUBSYSTEM_VIDEO, SUBSYSTEM_SEHUA, SUBSYSTEM_JAVBUS)
+
+# 临时目录默认至少保留的空间
+DEFAULT_MIN_FREE_SPACE = 1024 * 1024 * 1024
+# 可恢复的视频下载（有断点续传记录）保留的时间(秒)
+DEFAULT_RESUME_MAX_AGE = 24 * 60 * 60
+# 清理未被引用的图片时，只清理超过该时间的文件(秒)，避免删除刚下载还未入库的图片
+IMAGE_ORPHAN_MIN_AGE = 60 * 60
+# 等待空间时的重新检查间隔(秒)
+DEFAULT_POLL_INTERVAL = 10
+# 断点续传记录的后缀，与 fast_telethon.PARTS_SUFFIX 一致
+SIDECAR_SUFFIXES = (".parts",)
+
+
+class TempStorageError(Exception):
+    """需要的空间超过了临时目录的容量或预算，无法通过等待满足"""
+
+
+def _allocated_bytes(path):
+    """文件实际占用的空间，预分配的稀疏文件只计算已写入的块"""
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return 0
+
+
+def _dir_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += _allocated_bytes(os.path.join(root, name))
+    return total
+
+
+class TempStorageManager:
+    """
+    临时目录空间管理
+
+    开始下载前按已知大小预留空间：子系统目录已占用的空间 + 已预留但尚未写入的空间 + 本次大小
+    不能超过预算（budget，0为不限制），同时磁盘剩余空间扣除未写入的预留后不能低于 min_free_space。
+    空间不足时 reserve 返回False，reserve_async 等待其他任务释放。
+    """
+
+    def __init__(self, root, budget=0, min_free_space=DEFAULT_MIN_FREE_SPACE, resume_max_age=DEFAULT_RESUME_MAX_AGE):
+        self.root = root
+        self.budget = budget
+        self.min_free_space = min_free_space
+        self.resume_max_age = resume_max_age
+        self._lock = threading.Lock()
+        # {key: (subsystem, size, path)}
+        self._reservations = {}
+
+    @classmethod
+    def from_config(cls, root):
+        storage_config = init.bot_config.get('temp_storage') or {}
+        return cls(
+            root,
+            budget=int(storage_config.get('budget', 0)) * 1024 * 1024,
+            min_free_space=int(storage_config.get('min_free_space', DEFAULT_MIN_FREE_SPACE // 1024 // 1024)) * 1024 * 1024,
+            resume_max_age=float(storage_config.get('resume_max_age', DEFAULT_RESUME_MAX_AGE // 3600)) * 3600
+        )
+
+    def subsystem_dir(self, subsystem):
+        path = os.path.join(self.root, subsystem)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _outstanding(self):
+        """已预留但尚未写入磁盘的空间"""
+        outstanding = 0
+        for _, size, path in self._reservations.values():
+            outstanding += max(size - (_allocated_bytes(path) if path else 0), 0)
+        return outstanding
+
+    def _used(self):
+        return sum(_dir_usage(os.path.join(self.root, subsystem)) for subsystem in SUBSYSTEMS)
+
+    def _check_capacity(self, size):
+        total = shutil.disk_usage(self.root).total
+        if size + self.min_free_space > total:
+            raise TempStorageError(f"需要{size // 1024 // 1024}MB，超过临时目录容量")
+        if self.budget and size > self.budget:
+            raise TempStorageError(f"需要{size // 1024 // 1024}MB，超过临时目录预算")
+
+    def reserve(self, subsystem, key, size, path=None):
+        """
+        预留空间，不等待
+        :param path: 将要写入的文件，用于计算已经写入了多少
+        :return: 是否预留成功
+        """
+        size = max(int(size or 0), 0)
+        self._check_capacity(size)
+        with self._lock:
+            outstanding = self._outstanding()
+            if self.budget and self._used() + outstanding + size > self.budget:
+                return False
+            if shutil.disk_usage(self.root).free - outstanding - self.min_free_space < size:
+                return False
+            self._reservations[key] = (subsystem, size, path)
+            return True
+
+    async def reserve_async(self, subsystem, key, size, path=None, cancel_event=None, on_wait=None,
+                            poll_interval=DEFAULT_POLL_INTERVAL):
+        """
+        预留空间，不足时等待
+        :param on_wait: 第一次需要等待时调用的协程函数
+        :return: 是否预留成功，cancel_event被设置时返回False
+        """
+        waited = False
+        while not (cancel_event and cancel_event.is_set()):
+            # reserve 会遍历子系统目录并持有锁，放到线程中执行，避免阻塞事件循环
+            if await asyncio.to_thread(self.reserve, subsystem, key, size, path):
+                return True
+            if not waited:
+                waited = True
+                init.logger.info(f"临时目录空间不足，[{subsystem}]{key} 等待中")
+                if on_wait:
+                    await on_wait()
+            await asyncio.sleep(poll_interval)
+        return False
+
+    def update_path(self, key, path):
+        """预留对应的文件被重命名后更新路径"""
+        with self._lock:
+            reservation = self._reservations.get(key)
+            if reservation:
+                self._reservations[key] = (reservation[0], reservation[1], path)
+
+    def release(self, key):
+        with self._lock:
+            self._reservations.pop(key, None)
+
+    def save_bytes(self, subsystem, path, data):
+        """
+        预留空间后写入已下载到内存的小文件（图片等），空间不足时不写入
+        :return: 是否写入成功
+        """
+        try:
+            if not self.reserve(subsystem, path, len(data), path):
+                init.logger.warn(f"临时目录空间不足，跳过保存: {path}")
+                return False
+        except TempStorageError as e:
+            init.logger.warn(f"{e}，跳过保存: {path}")
+            return False
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+            return True
+        finally:
+            self.release(path)
+
+    def usage(self):
+        """各子系统占用的空间和未写入的预留 {subsystem: {'used': , 'reserved': }}"""
+        with self._lock:
+            result = {subsystem: {'used': _dir_usage(os.path.join(self.root, subsystem)), 'reserved': 0}
+                      for subsystem in SUBSYSTEMS}
+            for subsystem, size, path in self._reservations.values():
+                result[subsystem]['reserved'] += max(size - (_allocated_bytes(path) if path else 0), 0)
+        return result
+
+    def clean_orphans(self, referenced_images=()):
+        """
+        启动时清理崩溃遗留的临时文件：
+        - 视频：删除没有断点续传记录或记录超过 resume_max_age 的文件
+        - 图片：删除未被待处理任务引用、且超过一小时的图片
+        :return: 释放的字节数
+        """
+        freed = 0
+        now = time.time()
+        video_dir = self.subsystem_dir(SUBSYSTEM_VIDEO)
+        for name in os.listdir(video_dir):
+            path = os.path.join(video_dir, name)
+            if not os.path.isfile(path) or name.endswith(SIDECAR_SUFFIXES):
+                continue
+            parts_path = path + SIDECAR_SUFFIXES[0]
+            if os.path.exists(parts_path) and now - os.path.getmtime(parts_path) < self.resume_max_age:
+                continue
+            freed += self._remove(path)
+            for suffix in SIDECAR_SUFFIXES:
+                freed += self._remove(path + suffix)
+        # 没有对应文件的记录
+        for name in os.listdir(video_dir):
+            path = os.path.join(video_dir, name)
+            for suffix in SIDECAR_SUFFIXES:
+                if name.endswith(suffix) and not os.path.exists(path[:-len(suffix)]):
+                    freed += self._remove(path)
+
+        referenced = {os.path.abspath(p) for p in referenced_images if p}
+        for subsystem in (SUBSYSTEM_SEHUA, SUBSYSTEM_JAVBUS):
+            image_dir = self.subsystem_dir(subsystem)
+            for name in os.listdir(image_dir):
+                path = os.path.join(image_dir, name)
+                if not os.path.isfile(path) or os.path.abspath(path) in referenced:
+                    continue
+                if now - os.path.getmtime(path) > IMAGE_ORPHAN_MIN_AGE:
+                    freed += self._remove(path)
+        if freed:
+            init.logger.info(f"已清理临时目录遗留文件: {freed / 1024 / 1024:.1f}MB")
+        return freed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            size = _allocated_bytes(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            init.logger.warn(f"删除临时文件失败: {path}, {e}")
+            return 0
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import re
+import base64
 import init
 from datetime import datetime, timedelta, date
 import yaml
@@ -58,6 +59,19 @@ def get_magnet_hash(magnet):
     return None
 
 
+def magnet_info_hash(magnet):
+    """提取磁力链接的info_hash，统一为40位小写hex（base32格式会转换为hex）"""
+    magnet_hash = get_magnet_hash(magnet)
+    if not magnet_hash:
+        return None
+    if len(magnet_hash) == 32:
+        try:
+            magnet_hash = base64.b32decode(magnet_hash).hex()
+        except Exception:
+            return None
+    return magnet_hash.lower()
+
+
 def check_magnet(magnet):
     pattern = r"^magnet:\?xt=urn:btih:([a-fA-F0-9]{40}|[a-zA-Z2-7]{32})(?:&.*)?$"
     if not isinstance(magnet, str) or not magnet.startswith('magnet:'):